@@ -0,0 +1,55 @@
+# Per-day aggregate of the numeric values of one entry type. The first and
+# last values are the earliest and latest by time of day, which is what
+# single-sample types such as sleep_quality use.
+AGGREGATE_SELECT = '''
+    SELECT te.entry_date, te.entry_type, COUNT(*), SUM(te.numeric_value),
+           MIN(te.numeric_value), MAX(te.numeric_value),
+           (SELECT earliest.numeric_value FROM timeline_entries earliest
+            WHERE earliest.entry_date = te.entry_date AND earliest.entry_type = te.entry_type
+              AND earliest.numeric_value IS NOT NULL
+            ORDER BY earliest.datetime LIMIT 1),
+           (SELECT latest.numeric_value FROM timeline_entries latest
+            WHERE latest.entry_date = te.entry_date AND latest.entry_type = te.entry_type
+              AND latest.numeric_value IS NOT NULL
+            ORDER BY latest.datetime DESC LIMIT 1)
+    FROM timeline_entries te
+    WHERE te.numeric_value IS NOT NULL {where}
+    GROUP BY te.entry_date, te.entry_type
+'''
+
+def create_table(cursor):
+    """Create the daily_aggregates table."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_aggregates (
+            date TEXT NOT NULL,
+            entry_type TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            sum REAL,
+            min REAL,
+            max REAL,
+            first_value REAL,
+            last_value REAL,
+            PRIMARY KEY (date, entry_type)
+        )
+    ''')
+
+def refresh(cursor, keys):
+    """Recompute the aggregate rows for the given (date, entry_type) keys.
+
+    Each key is recomputed from the entry_date index, so the cost depends on
+    the number of entries for that day only, not on the size of the table.
+    """
+    for date_str, entry_type in set(keys):
+        cursor.execute('DELETE FROM daily_aggregates WHERE date = ? AND entry_type = ?',
+                       (date_str, entry_type))
+        cursor.execute(
+            'INSERT INTO daily_aggregates (date, entry_type, count, sum, min, max, first_value, last_value)'
+            + AGGREGATE_SELECT.format(where='AND te.entry_date = ? AND te.entry_type = ?'),
+            (date_str, entry_type))
+
+def rebuild(cursor):
+    """Recompute every aggregate row from timeline_entries."""
+    cursor.execute('DELETE FROM daily_aggregates')
+    cursor.execute(
+        'INSERT INTO daily_aggregates (date, entry_type, count, sum, min, max, first_value, last_value)'
+        + AGGREGATE_SELECT.format(where=''))
@@ -0,0 +1,500 @@
+import math
+from array import array
+from datetime import date
+import database
+import biorhythm
+from cache import VersionedCache
+
+# SQL expression naming the bucket a day belongs to, per granularity
+PERIODS = {
+    'day': 'days.date',
+    'week': "date(days.date, '-6 days', 'weekday 1')",  # Monday of the week
+    'month': "strftime('%Y-%m-01', days.date)"
+}
+
+# One row per bucket: health averages from daily_aggregates joined with the
+# weather and moon phase of every day in the range. Means of mood and energy
+# are weighted by the number of entries; temperatures of zero are treated as
+# missing, as the weather table stores 0 for absent values.
+SERIES_SELECT = '''
+    WITH RECURSIVE days(date) AS (
+        SELECT date(?)
+        UNION ALL
+        SELECT date(date, '+1 day') FROM days WHERE date < date(?)
+    )
+    SELECT {period} AS date,
+           MIN(days.date) AS start_date,
+           MAX(days.date) AS end_date,
+           SUM(mood.sum) / SUM(mood.count) AS avg_mood,
+           COALESCE(SUM(mood.count), 0) AS mood_count,
+           SUM(energy.sum) / SUM(energy.count) AS avg_energy,
+           COALESCE(SUM(energy.count), 0) AS energy_count,
+           AVG(sleep.first_value) AS sleep_quality,
+           AVG((w.temp_min + w.temp_max) / 2) AS temperature,
+           AVG(w.humidity) AS humidity,
+           AVG(w.air_pressure) AS air_pressure,
+           AVG(w.aqi) AS aqi,
+           AVG(w.daylight_hours) AS daylight_hours,
+           SUM(w.precipitation) AS precipitation,
+           AVG(m.illumination_percent) AS moon_illumination
+    FROM days
+    LEFT JOIN daily_aggregates mood ON mood.date = days.date AND mood.entry_type = 'mood'
+    LEFT JOIN daily_aggregates energy ON energy.date = days.date AND energy.entry_type = 'energy'
+    LEFT JOIN daily_aggregates sleep ON sleep.date = days.date AND sleep.entry_type = 'sleep_quality'
+    LEFT JOIN weather w ON w.date = days.date
+    LEFT JOIN moon_phases m ON m.date = days.date
+    GROUP BY 1
+    ORDER BY 1
+'''
+
+# Series fields that can be correlated with each other
+METRICS = ('avg_mood', 'avg_energy', 'sleep_quality', 'temperature', 'humidity', 'air_pressure',
+           'aqi', 'daylight_hours', 'precipitation', 'moon_illumination')
+
+# Pairs shown on the analytics page
+DEFAULT_PAIRS = [
+    ('temperature', 'avg_mood'),
+    ('sleep_quality', 'avg_mood'),
+    ('air_pressure', 'avg_energy'),
+    ('aqi', 'avg_mood'),
+    ('daylight_hours', 'avg_energy')
+]
+
+# z for a two-sided 95% confidence interval
+Z_95 = 1.959964
+
+# Weather columns usable in lagged correlations, next to numeric entry types
+WEATHER_METRICS = ('temperature', 'humidity', 'air_pressure', 'aqi', 'daylight_hours', 'precipitation')
+
+# Entry types counted per day (summed), and single-sample types (first or
+# latest value of the day); every other numeric type is averaged
+DAILY_TOTAL_TYPES = ('caffeine', 'alcohol', 'water')
+DAILY_FIRST_TYPES = ('sleep_quality',)
+DAILY_LAST_TYPES = ('weight',)
+
+MAX_LAG_DAYS = 60
+
+# Buckets the analytics page charts before switching to a coarser granularity
+MAX_CHART_POINTS = 180
+
+correlation_cache = VersionedCache('correlations', database.get_data_version, max_entries=128)
+series_cache = VersionedCache('series', database.get_data_version, max_entries=32)
+
+def get_series(start_date, end_date, granularity='day'):
+    """Get health, weather and moon averages per day, week or month in one query.
+
+    Every bucket in the range is returned, empty or not, so the cost grows
+    with the number of days rather than with the number of entries. Daily
+    series also carry the biorhythms of each day.
+    """
+    series = query_series(start_date, end_date, granularity)
+    if granularity == 'day':
+        biorhythm_by_date = {b['date']: b['biorhythms']
+                             for b in biorhythm.get_biorhythm_data_range(start_date, end_date)}
+        for row in series:
+            row['biorhythms'] = biorhythm_by_date.get(row['date'], {})
+    return series
+
+def query_series(start_date, end_date, granularity='day'):
+    """Get the rows of SERIES_SELECT for a range, without biorhythms."""
+    if granularity not in PERIODS:
+        raise ValueError(f"granularity must be one of {', '.join(PERIODS)}")
+
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+
+    cursor.execute(SERIES_SELECT.format(period=PERIODS[granularity]),
+                   (start_date.isoformat(), end_date.isoformat()))
+    return [dict(row) for row in cursor.fetchall()]
+
+def parse_range(args, default_days=30):
+    """Read start, end and granularity from request args.
+
+    Defaults to the last default_days days by day. Raises ValueError for a
+    malformed date, an inverted range or an unknown granularity.
+    """
+    end_date = date.fromisoformat(args['end']) if args.get('end') else date.today()
+    if args.get('start'):
+        start_date = date.fromisoformat(args['start'])
+    else:
+        start_date = date.fromordinal(end_date.toordinal() - default_days)
+    granularity = args.get('granularity', 'day')
+
+    if end_date < start_date:
+        raise ValueError('end must not be before start')
+    if granularity not in PERIODS:
+        raise ValueError(f"granularity must be one of {', '.join(PERIODS)}")
+    return start_date, end_date, granularity
+
+def pearson(xs, ys):
+    """Get the Pearson correlation of two equally long lists, or None when undefined."""
+    n = len(xs)
+    if n < 3:
+        return None
+    mean_x = sum(xs) / n
+    mean_y = sum(ys) / n
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    syy = sum((y - mean_y) ** 2 for y in ys)
+    if sxx == 0 or syy == 0:
+        return None  # A constant series has no correlation
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    return max(-1.0, min(1.0, sxy / math.sqrt(sxx * syy)))
+
+def rank(values):
+    """Get the 1-based ranks of values, ties sharing their average rank."""
+    order = sorted(range(len(values)), key=values.__getitem__)
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            ranks[order[k]] = (i + j) / 2 + 1
+        i = j + 1
+    return ranks
+
+def spearman(xs, ys):
+    """Get the Spearman rank correlation of two equally long lists, or None when undefined."""
+    return pearson(rank(xs), rank(ys))
+
+def confidence_interval(r, n, variance=1.0):
+    """Get the 95% confidence interval of a correlation via the Fisher z-transform.
+
+    variance scales the standard error of z, 1.0 for Pearson and 1.06 for
+    Spearman (Fieller et al.). Returns (low, high), or None for n < 4.
+    """
+    if r is None or n < 4:
+        return None
+    z = math.atanh(max(-0.999999, min(0.999999, r)))
+    margin = Z_95 * math.sqrt(variance / (n - 3))
+    return math.tanh(z - margin), math.tanh(z + margin)
+
+def _coefficient(r, n, variance):
+    """Format a coefficient with its confidence interval."""
+    interval = confidence_interval(r, n, variance)
+    return {
+        'r': round(r, 4) if r is not None else None,
+        'ci_low': round(interval[0], 4) if interval else None,
+        'ci_high': round(interval[1], 4) if interval else None
+    }
+
+def correlate(series, x, y):
+    """Correlate two fields over the buckets of a series where both are present."""
+    pairs = [(row[x], row[y]) for row in series if row[x] is not None and row[y] is not None]
+    xs = [float(a) for a, _ in pairs]
+    ys = [float(b) for _, b in pairs]
+    return {
+        'x': x,
+        'y': y,
+        'n': len(pairs),
+        'pearson': _coefficient(pearson(xs, ys), len(pairs), 1.0),
+        'spearman': _coefficient(spearman(xs, ys), len(pairs), 1.06)
+    }
+
+def get_correlations(start_date, end_date, granularity='day', pairs=None):
+    """Get Pearson and Spearman correlations with sample sizes and 95% intervals.
+
+    pairs is a list of (x, y) field names from METRICS and defaults to
+    DEFAULT_PAIRS. Results are cached per range and data version, so they are
+    recomputed only after entries, weather or moon data change.
+    """
+    pairs = tuple(tuple(pair) for pair in (pairs or DEFAULT_PAIRS))
+    for pair in pairs:
+        for metric in pair:
+            if metric not in METRICS:
+                raise ValueError(f"unknown metric {metric}, expected one of {', '.join(METRICS)}")
+
+    def load():
+        series = query_series(start_date, end_date, granularity)
+        return [correlate(series, x, y) for x, y in pairs]
+
+    return correlation_cache.get((start_date, end_date, granularity, pairs), load)
+
+def parse_pairs(args):
+    """Read the metric pairs to correlate from request args.
+
+    Accepts x and y for a single pair, or pairs as x:y,x:y. Returns None
+    (the default pairs) when neither is given.
+    """
+    if args.get('x') or args.get('y'):
+        if not (args.get('x') and args.get('y')):
+            raise ValueError('x and y must be given together')
+        return [(args['x'], args['y'])]
+    if args.get('pairs'):
+        pairs = [tuple(pair.split(':')) for pair in args['pairs'].split(',')]
+        if any(len(pair) != 2 for pair in pairs):
+            raise ValueError('pairs must look like x:y,x:y')
+        return pairs
+    return None
+
+def get_lag_metrics():
+    """Get the metrics available to lagged correlations: numeric entry types and weather columns."""
+    entry_metrics = [t['type_name'] for t in database.get_entry_types()
+                     if t['value_type'] not in ('text', 'boolean')]
+    return entry_metrics + list(WEATHER_METRICS)
+
+def get_daily_values(metric, start_date, end_date):
+    """Get one value of a metric per day of a range as an array, NaN where missing.
+
+    Entry types are read from daily_aggregates and weather columns from the
+    weather table, one query each.
+    """
+    first_ordinal = start_date.toordinal()
+    values = array('d', [math.nan]) * ((end_date - start_date).days + 1)
+
+    if metric in WEATHER_METRICS:
+        for row in database.get_weather_data_range(start_date.isoformat(), end_date.isoformat()):
+            if metric == 'temperature':
+                value = (row['temp_min'] + row['temp_max']) / 2 if row['temp_min'] is not None and row['temp_max'] is not None else None
+            else:
+                value = row[metric]
+            if value is not None:
+                values[date.fromisoformat(row['date']).toordinal() - first_ordinal] = value
+        return values
+
+    daily = database.get_daily_aggregates(start_date.isoformat(), end_date.isoformat(), [metric])
+    for date_str, by_type in daily.items():
+        aggregate = by_type[metric]
+        if metric in DAILY_TOTAL_TYPES:
+            value = aggregate['sum']
+        elif metric in DAILY_FIRST_TYPES:
+            value = aggregate['first_value']
+        elif metric in DAILY_LAST_TYPES:
+            value = aggregate['last_value']
+        else:
+            value = aggregate['avg']
+        if value is not None:
+            values[date.fromisoformat(date_str).toordinal() - first_ordinal] = value
+    return values
+
+def _pearson_from_sums(n, sx, sy, sxx, syy, sxy):
+    """Get a Pearson correlation from running sums, or None when undefined."""
+    if n < 3:
+        return None
+    vx = sxx - sx * sx / n
+    vy = syy - sy * sy / n
+    # Running sums leave rounding noise where the variance is really zero
+    if vx <= 1e-9 * (sxx or 1) or vy <= 1e-9 * (syy or 1):
+        return None
+    return max(-1.0, min(1.0, (sxy - sx * sy / n) / math.sqrt(vx * vy)))
+
+def lagged_correlations(xs, ys, max_lag):
+    """Correlate x on a day with y lag days later, for every lag from 0 to max_lag.
+
+    Days where either value is NaN are skipped. Returns [{'lag', 'n', 'r',
+    'ci_low', 'ci_high'}].
+    """
+    results = []
+    for lag in range(max_lag + 1):
+        n = sx = sy = sxx = syy = sxy = 0.0
+        for i in range(len(ys) - lag):
+            x = xs[i]
+            y = ys[i + lag]
+            if x == x and y == y:  # NaN is the only value not equal to itself
+                n += 1
+                sx += x
+                sy += y
+                sxx += x * x
+                syy += y * y
+                sxy += x * y
+        n = int(n)
+        results.append(dict(lag=lag, n=n, **_coefficient(_pearson_from_sums(n, sx, sy, sxx, syy, sxy), n, 1.0)))
+    return results
+
+def rolling_correlations(xs, ys, lag, window, start_date, step=1, min_periods=None):
+    """Correlate x with y lag days later over a window of days sliding along the range.
+
+    The window sums are updated as it slides, so the whole range costs a
+    single pass. A point is emitted every step days, aligned so the last day
+    of the range is included, dated by the last day of its window; r is None
+    when fewer than min_periods (default a third of the window) days in the
+    window have both values.
+    """
+    min_periods = min_periods or max(3, window // 3)
+    points = []
+    sums = [0.0] * 6  # n, sx, sy, sxx, syy, sxy
+    first_ordinal = start_date.toordinal()
+    last_day = len(ys) - 1
+
+    def add(day, sign):
+        x = xs[day - lag]
+        y = ys[day]
+        if x == x and y == y:
+            sums[0] += sign
+            sums[1] += sign * x
+            sums[2] += sign * y
+            sums[3] += sign * x * x
+            sums[4] += sign * y * y
+            sums[5] += sign * x * y
+
+    for day in range(lag, last_day + 1):
+        add(day, 1)
+        if day - window >= lag:
+            add(day - window, -1)
+        if day - lag < window - 1 or (last_day - day) % step:
+            continue
+
+        n = int(round(sums[0]))
+        r = _pearson_from_sums(n, *sums[1:]) if n >= min_periods else None
+        points.append({
+            'date': date.fromordinal(first_ordinal + day).isoformat(),
+            'n': n,
+            'r': round(r, 4) if r is not None else None
+        })
+    return points
+
+def get_lagged_analysis(x, y, start_date, end_date, max_lag=7, window=90, lag=None, step=7):
+    """Get cross-correlations of x against later y at lags 0..max_lag and their drift over time.
+
+    The rolling coefficients use lag, or the lag with the strongest
+    correlation when not given. Results are cached per arguments and data
+    version. Raises ValueError for unknown metrics or out-of-range settings.
+    """
+    metrics = get_lag_metrics()
+    for metric in (x, y):
+        if metric not in metrics:
+            raise ValueError(f"unknown metric {metric}, expected one of {', '.join(metrics)}")
+    if not 0 <= max_lag <= MAX_LAG_DAYS:
+        raise ValueError(f'max_lag must be between 0 and {MAX_LAG_DAYS}')
+    if lag is not None and not 0 <= lag <= MAX_LAG_DAYS:
+        raise ValueError(f'lag must be between 0 and {MAX_LAG_DAYS}')
+    if window < 7 or step < 1:
+        raise ValueError('window must be at least 7 days and step at least 1')
+
+    def load():
+        xs = get_daily_values(x, start_date, end_date)
+        ys = get_daily_values(y, start_date, end_date)
+        lags = lagged_correlations(xs, ys, max_lag)
+
+        rolling_lag = lag
+        if rolling_lag is None:
+            defined = [result for result in lags if result['r'] is not None]
+            rolling_lag = max(defined, key=lambda result: abs(result['r']))['lag'] if defined else 0
+
+        return {
+            'x': x,
+            'y': y,
+            'start': start_date.isoformat(),
+            'end': end_date.isoformat(),
+            'lags': lags,
+            'rolling': {
+                'lag': rolling_lag,
+                'window': window,
+                'step': step,
+                'points': rolling_correlations(xs, ys, rolling_lag, window, start_date, step)
+            }
+        }
+
+    key = ('lagged', x, y, start_date, end_date, max_lag, window, lag, step)
+    return correlation_cache.get(key, load)
+
+def parse_history_range(args):
+    """Read start and end from request args, defaulting to the whole tracked history.
+
+    Raises ValueError for a malformed date or an inverted range.
+    """
+    first_date, _ = database.get_daily_aggregates_span()
+    end_date = date.fromisoformat(args['end']) if args.get('end') else date.today()
+    if args.get('start'):
+        start_date = date.fromisoformat(args['start'])
+    elif first_date:
+        start_date = min(date.fromisoformat(first_date), end_date)
+    else:
+        start_date = end_date
+
+    if end_date < start_date:
+        raise ValueError('end must not be before start')
+    return start_date, end_date
+
+def fit_granularity(start_date, end_date, max_points):
+    """Get the finest granularity whose number of buckets over a range fits in max_points."""
+    days = (end_date - start_date).days + 1
+    if days <= max_points:
+        return 'day'
+    if math.ceil(days / 7) + 1 <= max_points:  # Partial weeks at both ends
+        return 'week'
+    return 'month'
+
+def lttb(points, threshold):
+    """Reduce (x, y) points to threshold points with Largest-Triangle-Three-Buckets.
+
+    Keeps the first and last point and, from each bucket in between, the
+    point forming the largest triangle with the previously kept point and
+    the average of the next bucket, which preserves peaks and troughs.
+    """
+    if threshold >= len(points) or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    bucket_size = (len(points) - 2) / (threshold - 2)
+    kept = 0
+    for i in range(threshold - 2):
+        # Average of the next bucket (the last point for the final bucket)
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, len(points))
+        next_bucket = points[next_start:next_end]
+        avg_x = sum(x for x, _ in next_bucket) / len(next_bucket)
+        avg_y = sum(y for _, y in next_bucket) / len(next_bucket)
+
+        kept_x, kept_y = points[kept]
+        best_area = -1
+        for j in range(int(i * bucket_size) + 1, next_start):
+            x, y = points[j]
+            area = abs((kept_x - avg_x) * (y - kept_y) - (kept_x - x) * (avg_y - kept_y))
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(points[best])
+        kept = best
+
+    sampled.append(points[-1])
+    return sampled
+
+def get_series_metrics():
+    """Get the metrics of the analytics series, biorhythm cycles included."""
+    return list(METRICS) + [f'biorhythm_{cycle}' for cycle in biorhythm.CYCLES]
+
+def get_downsampled_series(start_date, end_date, points=500, granularity=None, metrics=None):
+    """Get chart-sized series of each metric over any range.
+
+    The range is bucketed by granularity (day, week or month), by default
+    the finest one that fits in points buckets, and every metric with more
+    points than that is then reduced with LTTB. Days without a value are
+    left out. Biorhythm cycles would flatten out when averaged per bucket,
+    so they are computed for every day and reduced with LTTB alone.
+    Returns {'granularity', 'series': {metric: [[date, value]]}}.
+    """
+    all_metrics = get_series_metrics()
+    metrics = metrics or all_metrics
+    for metric in metrics:
+        if metric not in all_metrics:
+            raise ValueError(f"unknown metric {metric}, expected one of {', '.join(all_metrics)}")
+    if points < 3:
+        raise ValueError('points must be at least 3')
+    granularity = granularity or fit_granularity(start_date, end_date, points)
+
+    try:
+        birth_date = biorhythm.get_birth_date()
+    except ValueError:
+        birth_date = None
+
+    def load():
+        rows = query_series(start_date, end_date, granularity)
+        cycles = None
+        if birth_date and any(metric.startswith('biorhythm_') for metric in metrics):
+            cycles = biorhythm.calculate_biorhythm_range(birth_date, start_date, end_date)
+
+        series = {}
+        for metric in metrics:
+            if metric.startswith('biorhythm_'):
+                first_ordinal = start_date.toordinal()
+                values = list(enumerate(cycles[metric[len('biorhythm_'):]], first_ordinal)) if cycles else []
+            else:
+                values = [(date.fromisoformat(row['date']).toordinal(), row[metric]) for row in rows
+                          if row[metric] is not None]
+            series[metric] = [[date.fromordinal(x).isoformat(), round(y, 3)] for x, y in lttb(values, points)]
+        return {'granularity': granularity, 'series': series}
+
+    key = (start_date, end_date, points, granularity, tuple(metrics), birth_date)
+    return series_cache.get(key, load)
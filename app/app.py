@@ -1,16 +1,31 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, jsonify, stream_with_context
+import click
+import os
+import analytics as analytics_engine
+import astronomy
 import database
+import export
 import weather
 import biorhythm
+import openweather
+import scheduler
 from datetime import datetime, timedelta, date
-import threading
-import time
 from dotenv import load_dotenv
 
 # Load environment variables from .env file
 load_dotenv()
 
 app = Flask(__name__)
+database.init_app(app)  # Share one pooled connection per request
+
+@app.before_request
+def start_scheduler():
+    """Start the background scheduler in the process serving requests.
+
+    flask run and WSGI servers never execute __main__, so the first request
+    starts it there.
+    """
+    scheduler.ensure_started()
 
 @app.route('/')
 def home():
@@ -35,10 +50,12 @@ def settings():
         birth_date = request.form.get('birth_date', '1995-04-17')
         
         # Save settings to database
-        database.set_setting('location_mode', location_mode)
-        database.set_setting('latitude', latitude)
-        database.set_setting('longitude', longitude)
-        database.set_setting('birth_date', birth_date)
+        database.set_settings({
+            'location_mode': location_mode,
+            'latitude': latitude,
+            'longitude': longitude,
+            'birth_date': birth_date
+        })
         
         return redirect(url_for('settings'))
     
@@ -47,6 +64,53 @@ def settings():
     current_date = datetime.now().strftime('%Y-%m-%d')
     return render_template('settings.html', settings=settings_data, current_date=current_date)
 
+def fill_missing_environment(context, start_date, end_date):
+    """Fetch weather and calculate moon phases missing from a range context.
+    
+    Stored weather for today and future dates is refetched once it is stale.
+    Each weather fetch stores its own row and new moon phases are stored in
+    one batch; both are merged into the context. Weather fetches that miss
+    the deadline are left out of this render.
+    
+    While the background scheduler is running it keeps both tables filled,
+    so the render never waits on the network and missing moon phases are
+    only calculated for display.
+    """
+    background = scheduler.is_running()
+    missing_weather = []
+    new_moon_phases = {}
+    current_date = start_date
+    while current_date <= end_date:
+        date_str = current_date.isoformat()
+        cached_weather = context['weather'].get(date_str)
+        if not background and (not cached_weather or weather.is_weather_stale(cached_weather, date_str)):
+            missing_weather.append(date_str)
+        
+        current_date += timedelta(days=1)
+    
+    # Moon phases for the whole range come from one batch calculation
+    if len(context['moon_phases']) <= (end_date - start_date).days:
+        for date_str, moon_data in astronomy.moon_phases(start_date, end_date):
+            if date_str not in context['moon_phases']:
+                new_moon_phases[date_str] = {
+                    'date': date_str,
+                    'phase_name': moon_data['phase_name'],
+                    'illumination_percent': moon_data['illumination_percent']
+                }
+    
+    # Fetch concurrently; anything slower than the deadline is stored in the background
+    new_weather = weather.get_weather_for_dates(missing_weather)
+    if not background:
+        database.store_moon_phase_data_batch([
+            (m['date'], m['phase_name'], m['illumination_percent']) for m in new_moon_phases.values()
+        ])
+    context['weather'].update(new_weather)
+    context['moon_phases'].update(new_moon_phases)
+    
+    # Add moon phase emojis for display
+    for moon_phase in context['moon_phases'].values():
+        moon_phase['phase_emoji'] = weather.get_moon_phase_emoji(moon_phase['phase_name'])
+
 @app.route('/timeline')
 def timeline():
     """Render the main timeline view."""
@@ -55,8 +119,8 @@ def timeline():
     start_date = today - timedelta(days=3)  # Show 3 days before
     end_date = today + timedelta(days=3)    # Show 3 days after
     
-    # Get timeline entries for this range
-    entries = database.get_timeline_data(start_date.isoformat(), end_date.isoformat())
+    # Get entries, weather and moon phases for this range
+    context = database.get_range_context(start_date.isoformat(), end_date.isoformat())
     entry_types = database.get_entry_types()
     mood_options = database.get_mood_options()
     energy_options = database.get_energy_options()
@@ -65,72 +129,15 @@ def timeline():
     water_options = database.get_water_options()
     alcohol_options = database.get_alcohol_options()
     
-    # Get weather data for the date range
-    weather_data = database.get_weather_data_range(start_date.isoformat(), end_date.isoformat())
-    weather_by_date = {w['date']: w for w in weather_data}
-    
     # Fetch missing weather and moon phase data synchronously for now to avoid race conditions
-    current_date = start_date
-    while current_date <= end_date:
-        date_str = current_date.isoformat()
-        if date_str not in weather_by_date:
-            weather_info = weather.get_weather_for_date(date_str)
-            if weather_info:
-                database.store_weather_data(date_str, weather_info)
-                weather_by_date[date_str] = weather_info
-        
-        # Calculate and store moon phase data
-        moon_phase = database.get_moon_phase_data(date_str)
-        if not moon_phase:
-            moon_data = weather.calculate_moon_phase(date_str)
-            if moon_data:
-                database.store_moon_phase_data(date_str, moon_data['phase_name'], moon_data['illumination_percent'])
-                moon_phase = {
-                    'phase_name': moon_data['phase_name'],
-                    'illumination_percent': moon_data['illumination_percent']
-                }
-        
-        # Add to weather data for easy access
-        if moon_phase:
-            weather_by_date[date_str + '_moon'] = {
-                'phase_name': moon_phase.get('phase_name') if isinstance(moon_phase, dict) else moon_phase['phase_name'],
-                'illumination_percent': moon_phase.get('illumination_percent') if isinstance(moon_phase, dict) else moon_phase['illumination_percent'],
-                'phase_emoji': weather.get_moon_phase_emoji(moon_phase.get('phase_name') if isinstance(moon_phase, dict) else moon_phase['phase_name'])
-            }
-        
-        current_date += timedelta(days=1)
-    
-    # Organize entries by date and hour
-    timeline_data = {}
-    for entry in entries:
-        entry_datetime = datetime.fromisoformat(entry['datetime'])
-        date_key = entry_datetime.date().isoformat()
-        hour_key = entry_datetime.hour
-        
-        if date_key not in timeline_data:
-            timeline_data[date_key] = {}
-        if hour_key not in timeline_data[date_key]:
-            timeline_data[date_key][hour_key] = []
-            
-        timeline_data[date_key][hour_key].append({
-            'type': entry['entry_type'],
-            'display_name': entry['display_name'],
-            'emoji': entry['emoji'],
-            'value_type': entry['value_type'],
-            'numeric_value': entry['numeric_value'],
-            'text_value': entry['text_value'],
-            'notes': entry['notes']
-        })
+    fill_missing_environment(context, start_date, end_date)
     
     # Generate date range for template with weather and moon phase
     date_range = []
     current_date = start_date
     while current_date <= end_date:
         date_str = current_date.isoformat()
-        weather_info = weather_by_date.get(date_str, {})
-        moon_phase_info = database.get_moon_phase_data(date_str)
-        if moon_phase_info:
-            moon_phase_info['phase_emoji'] = weather.get_moon_phase_emoji(moon_phase_info['phase_name'])
+        weather_info = context['weather'].get(date_str, {})
         is_future = current_date > today
         date_range.append({
             'date': date_str,
@@ -139,12 +146,12 @@ def timeline():
             'is_future': is_future,
             'weather': weather_info,
             'weather_summary': weather.format_weather_summary(weather_info) if weather_info else None,
-            'moon_phase': moon_phase_info
+            'moon_phase': context['moon_phases'].get(date_str)
         })
         current_date += timedelta(days=1)
     
     return render_template('timeline.html', 
-                         timeline_data=timeline_data,
+                         timeline_data=context['timeline'],
                          date_range=date_range,
                          entry_types=entry_types,
                          mood_options=mood_options,
@@ -154,40 +161,79 @@ def timeline():
                          water_options=water_options,
                          alcohol_options=alcohol_options)
 
+def parse_entry(data):
+    """Validate a posted entry and convert it to a timeline entry row."""
+    date_str = data['date']
+    hour = int(data['hour'])
+    entry_type = data['entry_type']
+    
+    # Check if this is a future date and restrict entry types
+    if weather.is_future_date(date_str) and entry_type != 'notes':
+        raise ValueError('For future dates, only general notes entries are allowed')
+    
+    # Create datetime string
+    datetime_str = f"{date_str} {hour:02d}:00:00"
+    
+    # Get values based on entry type
+    return (datetime_str, entry_type, data.get('numeric_value'), data.get('text_value'), data.get('notes'))
+
 @app.route('/api/add_entry', methods=['POST'])
 def add_entry():
     """API endpoint to add a timeline entry."""
     data = request.get_json()
     
     try:
-        date_str = data['date']
-        hour = int(data['hour'])
-        entry_type = data['entry_type']
-        
-        # Check if this is a future date and restrict entry types
-        if weather.is_future_date(date_str):
-            if entry_type != 'notes':
-                return jsonify({
-                    'success': False, 
-                    'error': 'For future dates, only general notes entries are allowed'
-                }), 400
-        
-        # Create datetime string
-        datetime_str = f"{date_str} {hour:02d}:00:00"
-        
-        # Get values based on entry type
-        numeric_value = data.get('numeric_value')
-        text_value = data.get('text_value')
-        notes = data.get('notes')
+        row = parse_entry(data)
         
         # Add to database
-        database.add_timeline_entry(datetime_str, entry_type, numeric_value, text_value, notes)
+        database.add_timeline_entry(*row)
         
         return jsonify({'success': True, 'message': 'Entry added successfully'})
     
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 400
 
+@app.route('/api/add_entries', methods=['POST'])
+def add_entries():
+    """API endpoint to add a batch of timeline entries in one transaction.
+    
+    The batch is validated up front; if any entry is invalid nothing is written.
+    """
+    data = request.get_json()
+    
+    if not isinstance(data, list):
+        data = (data or {}).get('entries')
+    if not isinstance(data, list) or not data:
+        return jsonify({'success': False, 'error': 'Expected a non-empty array of entries'}), 400
+    
+    rows = []
+    results = []
+    for index, item in enumerate(data):
+        try:
+            rows.append(parse_entry(item))
+            results.append({'index': index, 'success': True})
+        except Exception as e:
+            error = f"Missing field: {e}" if isinstance(e, KeyError) else str(e)
+            results.append({'index': index, 'success': False, 'error': error})
+    
+    if len(rows) != len(data):
+        return jsonify({
+            'success': False,
+            'error': 'Some entries are invalid, nothing was saved',
+            'results': results
+        }), 400
+    
+    try:
+        database.add_timeline_entries(rows)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e), 'results': results}), 400
+    
+    return jsonify({
+        'success': True,
+        'message': f'{len(rows)} entries added successfully',
+        'results': results
+    })
+
 @app.route('/api/delete_entry', methods=['POST'])
 def delete_entry():
     """API endpoint to delete a timeline entry."""
@@ -240,6 +286,30 @@ def get_entries():
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+@app.route('/api/export')
+@app.route('/api/export.<export_format>')
+def export_entries(export_format=None):
+    """API endpoint streaming timeline entries with their weather and moon phase as NDJSON or CSV.
+    
+    Takes format (ndjson or csv, or the URL suffix), optional start_date and
+    end_date (YYYY-MM-DD) and an optional comma-separated types filter.
+    """
+    export_format = export_format or request.args.get('format', 'ndjson')
+    start_date = request.args.get('start_date') or '0001-01-01'
+    end_date = request.args.get('end_date') or '9999-12-31'
+    types = request.args.get('types')
+    
+    try:
+        datetime.strptime(start_date, '%Y-%m-%d')
+        datetime.strptime(end_date, '%Y-%m-%d')
+        chunks = export.stream_export(export_format, start_date, end_date, types.split(',') if types else None)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return Response(stream_with_context(chunks), mimetype=export.FORMATS[export_format], headers={
+        'Content-Disposition': f'attachment; filename=moodflow-export.{export_format}'
+    })
+
 @app.route('/entries')
 def view_entries():
     """Enhanced view for daily summaries with weather correlation."""
@@ -247,67 +317,43 @@ def view_entries():
     today = date.today()
     start_date = today - timedelta(days=30)
     
-    # Get weather data for the range
-    weather_data = database.get_weather_data_range(start_date.isoformat(), today.isoformat())
-    weather_by_date = {w['date']: w for w in weather_data}
+    # Get entries, weather and moon phases for the range
+    context = database.get_range_context(start_date.isoformat(), today.isoformat())
     
     # Fetch missing weather and moon phase data synchronously
-    current_date = start_date
-    while current_date <= today:
-        date_str = current_date.isoformat()
-        if date_str not in weather_by_date:
-            weather_info = weather.get_weather_for_date(date_str)
-            if weather_info:
-                database.store_weather_data(date_str, weather_info)
-                weather_by_date[date_str] = weather_info
-        
-        # Calculate and store moon phase data
-        moon_phase = database.get_moon_phase_data(date_str)
-        if not moon_phase:
-            moon_data = weather.calculate_moon_phase(date_str)
-            if moon_data:
-                database.store_moon_phase_data(date_str, moon_data['phase_name'], moon_data['illumination_percent'])
-        
-        current_date += timedelta(days=1)
+    fill_missing_environment(context, start_date, today)
     
-    entries = database.get_timeline_data(start_date.isoformat(), today.isoformat())
+    daily_aggregates = database.get_daily_aggregates(start_date.isoformat(), today.isoformat(),
+                                                     ['mood', 'energy', 'sleep_quality'])
+    
+    biorhythm_by_date = {b['date']: b['biorhythms'] for b in biorhythm.get_biorhythm_data_range(start_date, today)}
     
     # Group entries by date for summary view
     daily_summaries = {}
-    for entry in entries:
-        entry_datetime = datetime.fromisoformat(entry['datetime'])
-        date_key = entry_datetime.date().isoformat()
-        
-        if date_key not in daily_summaries:
-            daily_summaries[date_key] = {
-                'date': date_key,
-                'entries': [],
-                'mood_values': [],
-                'energy_values': [],
-                'sleep_quality': None,
-                'notes': [],
-                'weather': weather_by_date.get(date_key, {}),
-                'moon_phase': weather_by_date.get(date_key + '_moon', {}),
-                'biorhythms': biorhythm.calculate_biorhythms(datetime.strptime(date_key, '%Y-%m-%d').date())
-            }
-        
-        daily_summaries[date_key]['entries'].append(entry)
-        
-        # Extract key metrics for summary
-        if entry['entry_type'] == 'mood' and entry['numeric_value']:
-            daily_summaries[date_key]['mood_values'].append(entry['numeric_value'])
-        elif entry['entry_type'] == 'energy' and entry['numeric_value']:
-            daily_summaries[date_key]['energy_values'].append(entry['numeric_value'])
-        elif entry['entry_type'] == 'sleep_quality' and entry['numeric_value']:
-            daily_summaries[date_key]['sleep_quality'] = entry['numeric_value']
-        elif entry['notes']:
-            daily_summaries[date_key]['notes'].append(entry['notes'])
-    
-    # Calculate averages and add weather summaries
-    for date_key, summary in daily_summaries.items():
-        # Calculate average mood, energy
-        summary['avg_mood'] = sum(summary['mood_values']) / len(summary['mood_values']) if summary['mood_values'] else None
-        summary['avg_energy'] = sum(summary['energy_values']) / len(summary['energy_values']) if summary['energy_values'] else None
+    for date_key, day_entries in context['entries'].items():
+        day_aggregates = daily_aggregates.get(date_key, {})
+        mood = day_aggregates.get('mood', {})
+        energy = day_aggregates.get('energy', {})
+        summary = {
+            'date': date_key,
+            'entries': day_entries,
+            'avg_mood': mood.get('avg'),
+            'mood_count': mood.get('count', 0),
+            'avg_energy': energy.get('avg'),
+            'energy_count': energy.get('count', 0),
+            'sleep_quality': day_aggregates.get('sleep_quality', {}).get('last_value'),
+            'notes': [],
+            'weather': context['weather'].get(date_key, {}),
+            'moon_phase': context['moon_phases'].get(date_key, {}),
+            'biorhythms': biorhythm_by_date.get(date_key, {})
+        }
+        
+        for entry in day_entries:
+            # Mood, energy and sleep quality come from daily_aggregates
+            if entry['entry_type'] in ('mood', 'energy', 'sleep_quality') and entry['numeric_value']:
+                continue
+            if entry['notes']:
+                summary['notes'].append(entry['notes'])
         
         # Add weather summary
         summary['weather_summary'] = weather.format_weather_summary(summary['weather']) if summary['weather'] else None
@@ -315,6 +361,8 @@ def view_entries():
         # Add moon phase summary
         if summary['moon_phase']:
             summary['moon_phase_summary'] = f"{summary['moon_phase']['phase_emoji']} {summary['moon_phase']['phase_name']} ({summary['moon_phase']['illumination_percent']:.0f}% visible)"
+        
+        daily_summaries[date_key] = summary
     
     # Convert to list and sort by date (newest first)
     summaries_list = list(daily_summaries.values())
@@ -332,7 +380,7 @@ def load_timeline():
         return jsonify({'error': 'start_date and end_date are required'}), 400
     
     try:
-        entries = database.get_timeline_data(start_date, end_date)
+        context = database.get_range_context(start_date, end_date)
         entry_types = database.get_entry_types()
         mood_options = database.get_mood_options()
         energy_options = database.get_energy_options()
@@ -341,34 +389,8 @@ def load_timeline():
         water_options = database.get_water_options()
         alcohol_options = database.get_alcohol_options()
         
-        # Get weather data for the range
-        weather_data = database.get_weather_data_range(start_date, end_date)
-        weather_by_date = {w['date']: w for w in weather_data}
-            
-        # Organize entries by date and hour
-        timeline_data = {}
-        for entry in entries:
-            entry_datetime = datetime.fromisoformat(entry['datetime'])
-            date_key = entry_datetime.date().isoformat()
-            hour_key = entry_datetime.hour
-                
-            if date_key not in timeline_data:
-                timeline_data[date_key] = {}
-            if hour_key not in timeline_data[date_key]:
-                timeline_data[date_key][hour_key] = []
-                    
-            timeline_data[date_key][hour_key].append({
-                'type': entry['entry_type'],
-                'display_name': entry['display_name'],
-                'emoji': entry['emoji'],
-                'value_type': entry['value_type'],
-                'numeric_value': entry['numeric_value'],
-                'text_value': entry['text_value'],
-                'notes': entry['notes']
-            })
-            
         return jsonify({
-            'timeline_data': timeline_data,
+            'timeline_data': context['timeline'],
             'entry_types': [dict(et) for et in entry_types],
             'mood_options': mood_options,
             'energy_options': energy_options,
@@ -376,7 +398,8 @@ def load_timeline():
             'caffeine_options': caffeine_options,
             'water_options': water_options,
             'alcohol_options': alcohol_options,
-            'weather_data': weather_by_date
+            'weather_data': context['weather'],
+            'moon_phases': context['moon_phases']
         })
     
     except Exception as e:
@@ -410,10 +433,11 @@ def submit():
     if request.form.get('notes'):
         entries_to_add.append(('23:00:00', 'notes', None, request.form['notes']))
     
-    # Add all entries
-    for time_str, entry_type, numeric_value, text_value in entries_to_add:
-        datetime_str = f"{date_str} {time_str}"
-        database.add_timeline_entry(datetime_str, entry_type, numeric_value, text_value, None)
+    # Add all entries in one transaction
+    database.add_timeline_entries([
+        (f"{date_str} {time_str}", entry_type, numeric_value, text_value, None)
+        for time_str, entry_type, numeric_value, text_value in entries_to_add
+    ])
     
     return redirect(url_for('timeline'))
 
@@ -423,7 +447,7 @@ def get_weather_api(date_str):
     try:
         # Check if we have cached weather data
         cached_weather = database.get_weather_data(date_str)
-        if cached_weather:
+        if cached_weather and not weather.is_weather_stale(cached_weather, date_str):
             return jsonify({
                 'success': True,
                 'weather': cached_weather,
@@ -431,9 +455,8 @@ def get_weather_api(date_str):
             })
         
         # Fetch fresh weather data
-        weather_data = weather.get_weather_for_date(date_str)
+        weather_data = weather.fetch_and_store_weather(date_str)
         if weather_data:
-            database.store_weather_data(date_str, weather_data)
             return jsonify({
                 'success': True,
                 'weather': weather_data,
@@ -453,83 +476,227 @@ def get_weather_api(date_str):
 
 @app.route('/analytics')
 def analytics():
-    """Render the analytics page with correlation data."""
+    """Render the analytics page with correlation data.
+    
+    Accepts start, end (YYYY-MM-DD) and granularity (day, week or month)
+    query parameters; defaults to the last 30 days. Without a granularity,
+    long ranges are bucketed by week or month to keep the charts readable.
+    """
     try:
-        # Get data for the last 30 days
-        end_date = date.today()
-        start_date = end_date - timedelta(days=30)
-        
-        # Get all entries for analytics
-        entries_raw = database.get_timeline_data(start_date.isoformat(), end_date.isoformat())
-        entries = [dict(e) for e in entries_raw]
-        
-        # Get weather data
-        weather_data_raw = database.get_weather_data_range(start_date.isoformat(), end_date.isoformat())
-        weather_data = [dict(w) for w in weather_data_raw]
-        weather_by_date = {w['date']: w for w in weather_data}
-        
-        # Get moon phase data
-        moon_data_raw = database.get_moon_phase_data_range(start_date.isoformat(), end_date.isoformat())
-        moon_data = [dict(m) for m in moon_data_raw]
-        moon_by_date = {m['date']: m for m in moon_data}
-        
-        # Get biorhythm data
-        biorhythm_data = biorhythm.get_biorhythm_data_range(start_date, end_date)
-        biorhythm_by_date = {b['date']: b['biorhythms'] for b in biorhythm_data}
-        
-        # Process daily summaries for analytics
-        daily_data = []
-        current_date = start_date
-        
-        while current_date <= end_date:
-            date_str = current_date.isoformat()
-            
-            # Get entries for this date - extract date from datetime
-            day_entries = [e for e in entries if e.get('datetime', '').startswith(date_str)]
-            
-            # Calculate averages for mood, energy, sleep
-            mood_values = [e['numeric_value'] for e in day_entries if e.get('entry_type') == 'mood' and e.get('numeric_value') is not None]
-            energy_values = [e['numeric_value'] for e in day_entries if e.get('entry_type') == 'energy' and e.get('numeric_value') is not None]
-            sleep_values = [e['numeric_value'] for e in day_entries if e.get('entry_type') == 'sleep_quality' and e.get('numeric_value') is not None]
-            
-            # Get weather for this date
-            weather = weather_by_date.get(date_str, {})
-            moon = moon_by_date.get(date_str, {})
-            biorhythms = biorhythm_by_date.get(date_str, {})
-            
-            # Calculate average temperature (exclude invalid zero values)
-            temp_min = weather.get('temp_min')
-            temp_max = weather.get('temp_max')
-            if temp_min is not None and temp_max is not None and temp_min > 0 and temp_max > 0:
-                temperature = (temp_min + temp_max) / 2
-            else:
-                temperature = None
-            
-            daily_summary = {
-                'date': date_str,
-                'avg_mood': sum(mood_values) / len(mood_values) if mood_values else None,
-                'avg_energy': sum(energy_values) / len(energy_values) if energy_values else None,
-                'sleep_quality': sleep_values[0] if sleep_values else None,
-                'temperature': temperature,
-                'humidity': weather.get('humidity'),
-                'air_pressure': weather.get('air_pressure'),
-                'aqi': weather.get('aqi'),
-                'daylight_hours': weather.get('daylight_hours'),
-                'moon_illumination': moon.get('illumination_percent'),
-                'weather_main': weather.get('weather_main'),
-                'precipitation': weather.get('precipitation', 0),
-                'biorhythms': biorhythms
-            }
-            
-            daily_data.append(daily_summary)
-            current_date += timedelta(days=1)
-        
-        return render_template('analytics.html', daily_data=daily_data)
+        start_date, end_date, granularity = analytics_engine.parse_range(request.args)
+    except ValueError as e:
+        return render_template('analytics.html', daily_data=[], lag_metrics=[], error=str(e))
+    
+    if not request.args.get('granularity'):
+        granularity = analytics_engine.fit_granularity(start_date, end_date, analytics_engine.MAX_CHART_POINTS)
+    
+    try:
+        daily_data = analytics_engine.get_series(start_date, end_date, granularity)
+        return render_template('analytics.html', daily_data=daily_data, granularity=granularity,
+                               lag_metrics=analytics_engine.get_lag_metrics())
         
     except Exception as e:
-        return render_template('analytics.html', daily_data=[], error=str(e))
+        return render_template('analytics.html', daily_data=[], lag_metrics=[], error=str(e))
+
+@app.route('/api/analytics')
+def get_analytics_api():
+    """API endpoint to get the analytics series for a date range."""
+    try:
+        start_date, end_date, granularity = analytics_engine.parse_range(request.args)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({
+        'success': True,
+        'granularity': granularity,
+        'series': analytics_engine.get_series(start_date, end_date, granularity)
+    })
+
+@app.route('/api/analytics/series')
+def get_analytics_series_api():
+    """API endpoint to get chart-sized metric series for any range.
+    
+    Takes start and end (defaulting to the last year), points (the chart
+    width, default 500), an optional granularity (day, week or month; picked
+    to fit points when omitted) and an optional comma-separated metrics list.
+    """
+    try:
+        start_date, end_date, granularity = analytics_engine.parse_range(request.args, default_days=365)
+        metrics = request.args.get('metrics')
+        result = analytics_engine.get_downsampled_series(
+            start_date, end_date,
+            points=int(request.args.get('points', 500)),
+            granularity=granularity if request.args.get('granularity') else None,
+            metrics=metrics.split(',') if metrics else None
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify(dict(result, success=True, start=start_date.isoformat(), end=end_date.isoformat()))
+
+@app.route('/api/analytics/correlations')
+def get_correlations_api():
+    """API endpoint to get Pearson and Spearman correlations of metric pairs for a date range.
+    
+    Takes start, end and granularity like /api/analytics, plus either x and y
+    for one pair or pairs=x:y,x:y; defaults to the pairs on the analytics page.
+    """
+    try:
+        start_date, end_date, granularity = analytics_engine.parse_range(request.args)
+        pairs = analytics_engine.parse_pairs(request.args)
+        correlations = analytics_engine.get_correlations(start_date, end_date, granularity, pairs)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify({
+        'success': True,
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'granularity': granularity,
+        'correlations': correlations
+    })
+
+@app.route('/api/analytics/lagged')
+def get_lagged_correlations_api():
+    """API endpoint to correlate one metric with another some days later, over the full history.
+    
+    Takes x (the earlier metric) and y, optional start and end (defaulting to
+    the whole history), max_lag, and window, lag and step for the rolling
+    coefficients.
+    """
+    try:
+        start_date, end_date = analytics_engine.parse_history_range(request.args)
+        lag = request.args.get('lag')
+        analysis = analytics_engine.get_lagged_analysis(
+            request.args.get('x', 'caffeine'),
+            request.args.get('y', 'mood'),
+            start_date, end_date,
+            max_lag=int(request.args.get('max_lag', 7)),
+            window=int(request.args.get('window', 90)),
+            lag=int(lag) if lag else None,
+            step=int(request.args.get('step', 7))
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
+    return jsonify(dict(analysis, success=True))
+
+@app.route('/api/astronomy')
+def get_astronomy_api():
+    """API endpoint to get moon phases and daylight hours for a date range."""
+    try:
+        start_date = datetime.strptime(request.args.get('start_date'), '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.args.get('end_date'), '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'start_date and end_date (YYYY-MM-DD) are required'}), 400
+    
+    if end_date < start_date:
+        return jsonify({'success': False, 'error': 'end_date must not be before start_date'}), 400
+    if (end_date - start_date).days >= astronomy.MAX_RANGE_DAYS:
+        return jsonify({'success': False, 'error': f'Range must not exceed {astronomy.MAX_RANGE_DAYS} days'}), 400
+    
+    days = astronomy.get_range(start_date, end_date, weather.get_latitude(), scheduler.get_window())
+    return jsonify({'success': True, 'days': days})
+
+@app.route('/api/biorhythm/events')
+def get_biorhythm_events_api():
+    """API endpoint to get biorhythm critical, peak and trough days for a date range."""
+    try:
+        start_date = datetime.strptime(request.args.get('start_date'), '%Y-%m-%d').date()
+        end_date = datetime.strptime(request.args.get('end_date'), '%Y-%m-%d').date()
+        min_cycles = int(request.args.get('min_cycles', 1))
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'start_date and end_date (YYYY-MM-DD) are required'}), 400
+    
+    event = request.args.get('event')
+    if event and event not in ('critical', 'peak', 'trough'):
+        return jsonify({'success': False, 'error': 'event must be critical, peak or trough'}), 400
+    if end_date < start_date:
+        return jsonify({'success': False, 'error': 'end_date must not be before start_date'}), 400
+    if (end_date - start_date).days >= biorhythm.MAX_EVENT_RANGE_DAYS:
+        return jsonify({'success': False, 'error': f'Range must not exceed {biorhythm.MAX_EVENT_RANGE_DAYS} days'}), 400
+    
+    events = biorhythm.get_biorhythm_events(start_date, end_date, event, min_cycles)
+    return jsonify({'success': True, 'events': events})
+
+@app.route('/api/stats')
+def get_stats():
+    """API endpoint exposing cache, weather client, rate limit and scheduler statistics."""
+    return jsonify({
+        'cache': dict(database.get_cache_stats(), biorhythm=biorhythm.range_cache.stats(),
+                      correlations=analytics_engine.correlation_cache.stats(),
+                      series=analytics_engine.series_cache.stats()),
+        'weather_client': openweather.get_client().stats(),
+        'rate_limit': openweather.get_client().rate_limiter.stats(),
+        'single_flight': weather.get_flights().stats(),
+        'scheduler': {
+            'running': scheduler.is_running(),
+            'jobs': database.get_scheduler_jobs()
+        }
+    })
+
+@app.cli.command('rebuild-aggregates')
+def rebuild_aggregates_command():
+    """Recompute the daily_aggregates table from all timeline entries."""
+    database.init_db()
+    database.rebuild_daily_aggregates()
+    print("Daily aggregates rebuilt")
+
+@app.cli.command('backfill-air-pollution')
+@click.option('--days', default=365, help='Number of past days to backfill.')
+def backfill_air_pollution_command(days):
+    """Fetch daily air pollution for past days, one API call per month."""
+    database.init_db()
+    end_date = date.today() - timedelta(days=1)
+    stored = weather.ingest_air_pollution_history(end_date - timedelta(days=days - 1), end_date)
+    print(f"Stored air pollution for {len(stored)} days")
+
+@app.cli.command('precompute-astronomy')
+@click.option('--start', 'start_date', default='2000-01-01', help='First date (YYYY-MM-DD).')
+@click.option('--end', 'end_date', default=None, help='Last date (YYYY-MM-DD), a year from today by default.')
+def precompute_astronomy_command(start_date, end_date):
+    """Bulk-load moon phases for a date range into the database."""
+    database.init_db()
+    end_date = end_date or (date.today() + timedelta(days=365)).isoformat()
+    stored = astronomy.ensure_moon_phases(start_date, end_date)
+    print(f"Stored moon phases for {stored} days")
+
+@app.cli.command('bench-weather')
+@click.option('--days', default=50, help='Number of past days to fetch, one call each.')
+@click.option('--concurrency', default=4, help='Number of fetching threads.')
+def bench_weather_command(days, concurrency):
+    """Measure get_weather_for_date throughput and latency.
+    
+    Point OPENWEATHER_BASE_URL at app/fake_openweather.py to run offline.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    import time
+    database.init_db()
+    
+    def timed_fetch(date_str):
+        started = time.monotonic()
+        weather_data = weather.get_weather_for_date(date_str)
+        database.close_thread_connection()
+        return time.monotonic() - started, weather_data is not None
+    
+    dates = [(date.today() - timedelta(days=i)).isoformat() for i in range(1, days + 1)]
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed_fetch, dates))
+    elapsed = time.monotonic() - started
+    
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    percentile = lambda p: latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+    print(f"{len(dates)} days in {elapsed:.2f}s ({len(dates) / elapsed:.1f}/s), "
+          f"{sum(ok for _, ok in results)} succeeded")
+    print(f"latency ms: p50 {percentile(0.5):.1f}, p95 {percentile(0.95):.1f}, "
+          f"p99 {percentile(0.99):.1f}, max {latencies[-1]:.1f}")
+    print(f"client: {openweather.get_client().stats()}")
 
 if __name__ == '__main__':
-    database.init_db()  # Initialize the database on startup
-    database.update_entry_types_for_integers()  # Update existing entry types
-    app.run(host='0.0.0.0', port=8081, debug=True)
\ No newline at end of file
+    database.init_db()  # Initialize the database and apply pending migrations
+    debug = True
+    # With debug on the reloader runs this file twice; only its child serves requests
+    if not debug or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        scheduler.ensure_started()  # Keep weather and moon phases filled in the background
+    app.run(host='0.0.0.0', port=8081, debug=debug)
\ No newline at end of file
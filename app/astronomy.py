@@ -0,0 +1,139 @@
+import math
+from bisect import bisect_right
+from datetime import date, datetime
+from functools import lru_cache
+import database
+
+# Known new moon date as reference (January 6, 2000)
+KNOWN_NEW_MOON = datetime(2000, 1, 6, 18, 14)
+
+# Moon cycle is approximately 29.53 days
+MOON_CYCLE = 29.530588853
+
+# Longest range served by the astronomy API in one request
+MAX_RANGE_DAYS = 3 * 366
+
+# Phase names by upper bound of the cycle position (0-1)
+MOON_PHASES = [
+    (0.0625, 'New Moon', '🌑'),
+    (0.1875, 'Waxing Crescent', '🌒'),
+    (0.3125, 'First Quarter', '🌓'),
+    (0.4375, 'Waxing Gibbous', '🌔'),
+    (0.5625, 'Full Moon', '🌕'),
+    (0.6875, 'Waning Gibbous', '🌖'),
+    (0.8125, 'Last Quarter', '🌗'),
+    (1.0, 'Waning Crescent', '🌘')
+]
+
+PHASE_EMOJIS = {name: emoji for _, name, emoji in MOON_PHASES}
+_PHASE_BOUNDS = [bound for bound, _, _ in MOON_PHASES]
+
+def to_date(value):
+    """Accept a date or an ISO date string."""
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+def moon_phase_for_position(cycle_position):
+    """Get the moon phase dict for a position in the lunar cycle (0-1)."""
+    # Waxing from 0 to 100%, then waning back to 0%
+    if cycle_position <= 0.5:
+        illumination = cycle_position * 2 * 100
+    else:
+        illumination = (1 - cycle_position) * 2 * 100
+
+    _, phase_name, phase_emoji = MOON_PHASES[bisect_right(_PHASE_BOUNDS, cycle_position)]
+    return {
+        'phase_name': phase_name,
+        'phase_emoji': phase_emoji,
+        'illumination_percent': round(illumination, 1),
+        'cycle_position': cycle_position
+    }
+
+def moon_phases(start_date, end_date):
+    """Calculate moon phases for every day from start_date to end_date inclusive.
+
+    The offset from the reference new moon is computed once and then
+    advanced a day at a time. Returns [(date string, moon phase dict)].
+    """
+    start_date, end_date = to_date(start_date), to_date(end_date)
+    first_day = datetime.combine(start_date, datetime.min.time())
+    days_since = (first_day - KNOWN_NEW_MOON).total_seconds() / (24 * 3600)
+
+    first_ordinal = start_date.toordinal()
+    return [(date.fromordinal(first_ordinal + i).isoformat(),
+             moon_phase_for_position(((days_since + i) % MOON_CYCLE) / MOON_CYCLE))
+            for i in range((end_date - start_date).days + 1)]
+
+@lru_cache(maxsize=32)
+def daylight_table(latitude):
+    """Get daylight hours for day of year 1-366 at a latitude (index 0 unused)."""
+    lat_rad = math.radians(latitude)
+    table = [0.0]
+    for day_of_year in range(1, 367):
+        # Solar declination angle
+        decl_rad = math.radians(23.45 * math.sin(math.radians(360 * (284 + day_of_year) / 365)))
+
+        # Sunrise hour angle, clamped for polar night and polar day
+        cos_hour_angle = -math.tan(lat_rad) * math.tan(decl_rad)
+        if cos_hour_angle > 1:
+            table.append(0)
+        elif cos_hour_angle < -1:
+            table.append(24)
+        else:
+            table.append(round(2 * math.degrees(math.acos(cos_hour_angle)) / 15, 2))
+    return table
+
+def daylight_hours(date_value, latitude):
+    """Get daylight hours for one date at a latitude."""
+    return daylight_table(float(latitude))[to_date(date_value).timetuple().tm_yday]
+
+def ensure_moon_phases(start_date, end_date):
+    """Bulk-load moon phases for a range into the moon_phases table if any day is missing.
+
+    Costs a single COUNT query when the range is already stored. Returns the
+    number of rows written.
+    """
+    start_date, end_date = to_date(start_date), to_date(end_date)
+    expected = (end_date - start_date).days + 1
+    if database.count_moon_phases(start_date.isoformat(), end_date.isoformat()) >= expected:
+        return 0
+
+    rows = [(date_str, moon['phase_name'], moon['illumination_percent'])
+            for date_str, moon in moon_phases(start_date, end_date)]
+    database.store_moon_phase_data_batch(rows)
+    return len(rows)
+
+def get_range(start_date, end_date, latitude, window=None):
+    """Get moon phase and daylight hours for every day of a range.
+
+    Moon phases are read from the moon_phases table. Only days inside
+    window, a (start, end) pair such as the scheduler's precompute window,
+    are bulk-loaded when missing; other days not yet stored are computed
+    on the fly and not written. Returns [{'date', 'phase_name',
+    'phase_emoji', 'illumination_percent', 'daylight_hours'}] in date order.
+    """
+    start_date, end_date = to_date(start_date), to_date(end_date)
+    if window:
+        stored_start, stored_end = max(start_date, to_date(window[0])), min(end_date, to_date(window[1]))
+        if stored_start <= stored_end:
+            ensure_moon_phases(stored_start, stored_end)
+    table = daylight_table(float(latitude))
+
+    phases = {moon['date']: (moon['phase_name'], moon['illumination_percent'])
+              for moon in database.get_moon_phase_data_range(start_date.isoformat(), end_date.isoformat())}
+    if len(phases) < (end_date - start_date).days + 1:
+        for date_str, moon in moon_phases(start_date, end_date):
+            phases.setdefault(date_str, (moon['phase_name'], moon['illumination_percent']))
+
+    days = []
+    for date_str in sorted(phases):
+        phase_name, illumination = phases[date_str]
+        days.append({
+            'date': date_str,
+            'phase_name': phase_name,
+            'phase_emoji': PHASE_EMOJIS.get(phase_name, '🌙'),
+            'illumination_percent': illumination,
+            'daylight_hours': table[date.fromisoformat(date_str).timetuple().tm_yday]
+        })
+    return days
@@ -1,18 +1,37 @@
 import math
 import os
 from datetime import datetime, date, timedelta
+from functools import lru_cache
 from typing import Dict, List, Any
+import database
+from cache import VersionedCache
+
+# Cycle lengths in days
+CYCLES = {
+    'physical': 23,
+    'emotional': 28,
+    'intellectual': 33
+}
+
+# |value| below this counts as a critical day, see get_biorhythm_status
+CRITICAL_THRESHOLD = 0.1
+
+# Longest range served by the biorhythm events API in one request
+MAX_EVENT_RANGE_DAYS = 3 * 366
+
+# Computed ranges per (birth date, start, end), dropped when settings change
+range_cache = VersionedCache('biorhythm', database.get_config_version, max_entries=64)
 
 def get_birth_date() -> date:
-    """Get birth date from environment variable."""
-    birth_date_str = os.getenv('BIRTH_DATE')
+    """Get birth date from the birth_date setting."""
+    birth_date_str = database.get_birth_date_setting()
     if not birth_date_str:
-        raise ValueError("BIRTH_DATE not set in environment variables")
+        raise ValueError("birth_date setting is not set")
     
     try:
         return datetime.strptime(birth_date_str, '%Y-%m-%d').date()
     except ValueError:
-        raise ValueError("BIRTH_DATE must be in YYYY-MM-DD format")
+        raise ValueError("birth_date must be in YYYY-MM-DD format")
 
 def calculate_days_since_birth(birth_date: date, target_date: date) -> int:
     """Calculate the number of days between birth date and target date."""
@@ -24,7 +43,7 @@ def calculate_biorhythm_value(days_since_birth: int, cycle_length: int) -> float
 
 def get_biorhythm_status(value: float) -> str:
     """Get biorhythm status based on value."""
-    if abs(value) < 0.1:
+    if abs(value) < CRITICAL_THRESHOLD:
         return "critical"
     elif value > 0:
         return "positive"
@@ -35,54 +54,175 @@ def get_biorhythm_percentage(value: float) -> int:
     """Convert biorhythm value to percentage (0-100)."""
     return round((value + 1) * 50)
 
+@lru_cache(maxsize=None)
+def get_cycle_table(cycle_length: int) -> List[Dict[str, Any]]:
+    """Get the value, status and percentage for every day of one cycle.
+    
+    A cycle repeats every cycle_length days, so a whole range is a series of
+    lookups into this table instead of one sine per day.
+    """
+    table = []
+    for day in range(cycle_length):
+        value = calculate_biorhythm_value(day, cycle_length)
+        table.append({
+            'value': round(value, 3),
+            'status': get_biorhythm_status(value),
+            'percentage': get_biorhythm_percentage(value),
+            'cycle_length': cycle_length
+        })
+    return table
+
+def calculate_biorhythm_range(birth_date: date, start_date: date, end_date: date) -> Dict[str, List]:
+    """Calculate all cycles for every day from start_date to end_date inclusive.
+    
+    Returns parallel lists: 'dates', 'days_since_birth' and one list of
+    values per cycle name.
+    """
+    first_day = calculate_days_since_birth(birth_date, start_date)
+    days = list(range(first_day, first_day + (end_date - start_date).days + 1))
+    result = {
+        'dates': [(start_date + timedelta(days=i)).isoformat() for i in range(len(days))],
+        'days_since_birth': days
+    }
+    for cycle_name, cycle_length in CYCLES.items():
+        table = get_cycle_table(cycle_length)
+        result[cycle_name] = [table[day % cycle_length]['value'] for day in days]
+    return result
+
+def _build_biorhythm_range(birth_date: date, start_date: date, end_date: date) -> List[Dict]:
+    """Build the per-day biorhythm dicts for a range."""
+    first_day = calculate_days_since_birth(birth_date, start_date)
+    tables = {cycle_name: get_cycle_table(cycle_length) for cycle_name, cycle_length in CYCLES.items()}
+    
+    data = []
+    for i in range((end_date - start_date).days + 1):
+        day = first_day + i
+        data.append({
+            'date': (start_date + timedelta(days=i)).isoformat(),
+            'biorhythms': {
+                cycle_name: dict(table[day % CYCLES[cycle_name]], days_since_birth=day)
+                for cycle_name, table in tables.items()
+            }
+        })
+    return data
+
+def get_biorhythm_data_range(start_date: date, end_date: date) -> List[Dict]:
+    """Get biorhythm data for a date range.
+    
+    Results are memoized per (birth date, range) until the settings change;
+    treat the returned list as read-only. Returns an empty list when the
+    birth date is not configured.
+    """
+    try:
+        birth_date = get_birth_date()
+    except ValueError:
+        return []
+    
+    return range_cache.get((birth_date, start_date, end_date),
+                           lambda: _build_biorhythm_range(birth_date, start_date, end_date))
+
 def calculate_biorhythms(target_date: date) -> Dict[str, Dict[str, Any]]:
     """Calculate all biorhythm cycles for a given date."""
+    data = get_biorhythm_data_range(target_date, target_date)
+    # Return empty dict if birth date not configured
+    return data[0]['biorhythms'] if data else {}
+
+def cycle_events(cycle_length: int, first_day: int, last_day: int) -> List[tuple]:
+    """Get (days since birth, event) for the critical, peak and trough days of one cycle.
+    
+    sin(2*pi*t/L) crosses zero at t = k*L/2 and is within the critical
+    threshold for |t - k*L/2| < L*asin(threshold)/(2*pi), so critical days
+    follow from k directly. Peaks and troughs are the days nearest to
+    t = L/4 + k*L and t = 3L/4 + k*L.
+    """
+    half_width = cycle_length * math.asin(CRITICAL_THRESHOLD) / (2 * math.pi)
+    events = []
+    
+    for k in range(math.floor((first_day - half_width) * 2 / cycle_length),
+                   math.ceil((last_day + half_width) * 2 / cycle_length) + 1):
+        crossing = k * cycle_length / 2
+        for day in range(math.ceil(crossing - half_width), math.floor(crossing + half_width) + 1):
+            if first_day <= day <= last_day:
+                events.append((day, 'critical'))
+    
+    for k in range(math.floor(first_day / cycle_length) - 1, math.ceil(last_day / cycle_length) + 1):
+        for offset, event in ((cycle_length / 4, 'peak'), (3 * cycle_length / 4, 'trough')):
+            day = round(k * cycle_length + offset)
+            if first_day <= day <= last_day:
+                events.append((day, event))
+    
+    return sorted(events)
+
+def compute_events(birth_date: date, start_date: date, end_date: date) -> List[tuple]:
+    """Get (date, cycle, event, cycle_count) rows for a range, including coincidences.
+    
+    Days on which several cycles have the same event get one extra row whose
+    cycle is the comma-separated cycle names and cycle_count their number.
+    """
+    first_day = calculate_days_since_birth(birth_date, start_date)
+    last_day = calculate_days_since_birth(birth_date, end_date)
+    
+    rows = []
+    by_day_event = {}
+    for cycle_name, cycle_length in CYCLES.items():
+        for day, event in cycle_events(cycle_length, first_day, last_day):
+            date_str = (birth_date + timedelta(days=day)).isoformat()
+            rows.append((date_str, cycle_name, event, 1))
+            by_day_event.setdefault((date_str, event), []).append(cycle_name)
+    
+    for (date_str, event), cycle_names in by_day_event.items():
+        if len(cycle_names) > 1:
+            rows.append((date_str, ','.join(cycle_names), event, len(cycle_names)))
+    
+    return sorted(rows)
+
+def ensure_event_index(birth_date: date) -> tuple:
+    """Make sure the biorhythm_events table covers birth to the event horizon.
+    
+    The horizon is BIORHYTHM_EVENT_HORIZON_DAYS (365 by default) past today.
+    A stored span is only ever extended, never narrowed. Returns the indexed
+    (start, end) dates.
+    """
+    birth_date_str = birth_date.isoformat()
+    span = database.get_biorhythm_event_span(birth_date_str)
+    horizon_days = int(os.getenv('BIORHYTHM_EVENT_HORIZON_DAYS', '365'))
+    index_start, index_end = birth_date, date.today() + timedelta(days=horizon_days)
+    if span:
+        span = date.fromisoformat(span[0]), date.fromisoformat(span[1])
+        if span[0] <= index_start and index_end <= span[1]:
+            return span
+        index_start, index_end = min(index_start, span[0]), max(index_end, span[1])
+    
+    events = compute_events(birth_date, index_start, index_end)
+    database.replace_biorhythm_events(birth_date_str, index_start.isoformat(), index_end.isoformat(), events)
+    print(f"[Biorhythm] Indexed {len(events)} events from {index_start} to {index_end}")
+    return index_start, index_end
+
+def get_biorhythm_events(start_date: date, end_date: date, event: str = None, min_cycles: int = 1) -> List[Dict]:
+    """Get critical, peak and trough days in a range for the configured birth date.
+    
+    Days inside the indexed span are read from biorhythm_events; days
+    before birth or past the horizon are computed and not stored. Returns
+    an empty list when the birth date is not configured.
+    """
     try:
         birth_date = get_birth_date()
-        days_since_birth = calculate_days_since_birth(birth_date, target_date)
-        
-        cycles = {
-            'physical': 23,
-            'emotional': 28,
-            'intellectual': 33
-        }
-        
-        biorhythms = {}
-        
-        for cycle_name, cycle_length in cycles.items():
-            value = calculate_biorhythm_value(days_since_birth, cycle_length)
-            status = get_biorhythm_status(value)
-            percentage = get_biorhythm_percentage(value)
-            
-            biorhythms[cycle_name] = {
-                'value': round(value, 3),
-                'status': status,
-                'percentage': percentage,
-                'cycle_length': cycle_length,
-                'days_since_birth': days_since_birth
-            }
-        
-        return biorhythms
-        
-    except Exception:
-        # Return empty dict if birth date not configured
-        return {}
-
-def get_biorhythm_data_range(start_date: date, end_date: date) -> List[Dict]:
-    """Get biorhythm data for a date range."""
-    data = []
-    current_date = start_date
+    except ValueError:
+        return []
     
-    while current_date <= end_date:
-        biorhythms = calculate_biorhythms(current_date)
-        if biorhythms:  # Only add if birth date is configured
-            data.append({
-                'date': current_date.isoformat(),
-                'biorhythms': biorhythms
-            })
-        current_date = current_date + timedelta(days=1)
+    index_start, index_end = ensure_event_index(birth_date)
+    events = database.get_biorhythm_events(birth_date.isoformat(), max(start_date, index_start).isoformat(),
+                                           min(end_date, index_end).isoformat(), event, min_cycles)
     
-    return data
+    for outside_start, outside_end in ((start_date, min(end_date, index_start - timedelta(days=1))),
+                                       (max(start_date, index_end + timedelta(days=1)), end_date)):
+        if outside_start > outside_end:
+            continue
+        events.extend({'date': date_str, 'cycle': cycle, 'event': row_event, 'cycle_count': cycle_count}
+                      for date_str, cycle, row_event, cycle_count in compute_events(birth_date, outside_start, outside_end)
+                      if cycle_count >= min_cycles and (not event or row_event == event))
+    
+    return sorted(events, key=lambda e: (e['date'], e['cycle_count'], e['cycle']))
 
 def get_biorhythm_emoji(cycle_name: str, status: str) -> str:
     """Get emoji representation for biorhythm status."""
@@ -0,0 +1,60 @@
+import threading
+
+class VersionedCache:
+    """An in-process cache that is dropped whenever a shared version changes.
+
+    The version comes from a callable, so several worker processes can share
+    one invalidation counter (for example a row in the database) while each
+    keeps its own copy of the cached values.
+    """
+
+    def __init__(self, name, get_version, max_entries=None):
+        self.name = name
+        self.max_entries = max_entries
+        self._get_version = get_version
+        self._lock = threading.Lock()
+        self._values = {}
+        self._version = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, loader):
+        """Get a cached value, calling loader() to fill it on a miss."""
+        version = self._get_version()
+        with self._lock:
+            if version != self._version:
+                self._values.clear()
+                self._version = version
+            if key in self._values:
+                self.hits += 1
+                return self._values[key]
+            self.misses += 1
+
+        value = loader()
+        with self._lock:
+            # Don't keep values loaded while someone else bumped the version
+            if self._version == version:
+                self._values[key] = value
+                # Evict the oldest entries beyond the size limit
+                while self.max_entries and len(self._values) > self.max_entries:
+                    del self._values[next(iter(self._values))]
+        return value
+
+    def clear(self):
+        """Drop all cached values in this process."""
+        with self._lock:
+            self._values.clear()
+            self._version = None
+
+    def stats(self):
+        """Get hit/miss counters and the cached version."""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'name': self.name,
+                'version': self._version,
+                'entries': len(self._values),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else None
+            }
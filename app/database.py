@@ -1,188 +1,201 @@
 import sqlite3
 import os
+import queue
+import threading
+import time
 from datetime import datetime, timedelta
+from flask import g, has_app_context
+import migrations
+import aggregates
+from cache import VersionedCache
 
 # Define the database path
 DB_PATH = os.path.join(os.path.dirname(__file__), '../data/health.db')
 
-def get_db_connection():
-    """Create a connection to the SQLite database."""
-    conn = sqlite3.connect(DB_PATH)
+# Pragma profiles applied to every new connection, selected with DB_PRAGMA_PROFILE.
+# busy_timeout comes first so the remaining pragmas wait out concurrent writers.
+PRAGMA_PROFILES = {
+    'wal': {
+        'busy_timeout': 5000,
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -16000,  # KiB
+        'mmap_size': 134217728,
+        'temp_store': 'MEMORY',
+        'wal_autocheckpoint': 10000  # Backstop, regular checkpoints run in close_db
+    },
+    'rollback': {
+        'busy_timeout': 5000,
+        'journal_mode': 'DELETE',
+        'synchronous': 'FULL',
+        'cache_size': -2000,
+        'mmap_size': 0,
+        'temp_store': 'DEFAULT'
+    }
+}
+
+_last_checkpoint = time.monotonic()
+_checkpoint_lock = threading.Lock()
+
+def get_pragma_profile():
+    """Get the pragmas for the configured profile.
+
+    Individual values can be overridden with DB_PRAGMA_<NAME>, for example
+    DB_PRAGMA_BUSY_TIMEOUT=10000.
+    """
+    profile_name = os.getenv('DB_PRAGMA_PROFILE', 'wal')
+    if profile_name not in PRAGMA_PROFILES:
+        raise ValueError(f"Unknown DB_PRAGMA_PROFILE '{profile_name}', expected one of: {', '.join(PRAGMA_PROFILES)}")
+
+    pragmas = dict(PRAGMA_PROFILES[profile_name])
+    for name in pragmas:
+        override = os.getenv(f'DB_PRAGMA_{name.upper()}')
+        if override:
+            pragmas[name] = override
+    return pragmas
+
+def _connect():
+    """Open a new long-lived connection to the SQLite database."""
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+    for name, value in get_pragma_profile().items():
+        conn.execute(f'PRAGMA {name} = {value}')
     return conn
 
-def init_db():
-    """Initialize the database with required tables."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+def checkpoint_wal(mode='PASSIVE', conn=None):
+    """Run a WAL checkpoint and return (busy, wal_frames, checkpointed_frames)."""
+    if conn is None:
+        conn = get_db_connection()
+    result = conn.execute(f'PRAGMA wal_checkpoint({mode})').fetchone()
+    return tuple(result)
 
-    # Table for timeline entries (hourly slots)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS timeline_entries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            datetime TEXT NOT NULL,
-            entry_type TEXT NOT NULL,
-            numeric_value REAL,
-            text_value TEXT,
-            notes TEXT,
-            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(datetime, entry_type)
-        )
-    ''')
-
-    # Table for entry types configuration
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS entry_types (
-            type_name TEXT PRIMARY KEY,
-            display_name TEXT NOT NULL,
-            emoji TEXT,
-            value_type TEXT NOT NULL, -- 'numeric', 'text', 'boolean'
-            min_value REAL,
-            max_value REAL,
-            default_value TEXT,
-            description TEXT
-        )
-    ''')
-
-    # Table for weather data (daily)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS weather (
-            date TEXT PRIMARY KEY,
-            temp_min REAL,
-            temp_max REAL,
-            humidity REAL,
-            pressure REAL,
-            precipitation REAL,
-            air_pressure REAL,
-            weather_main TEXT,
-            weather_description TEXT,
-            aqi INTEGER,
-            aqi_description TEXT,
-            pm2_5 REAL,
-            pm10 REAL,
-            no2 REAL,
-            o3 REAL,
-            co REAL,
-            daylight_hours REAL
-        )
-    ''')
-    
-    # Add new columns to existing weather table if they don't exist
-    try:
-        cursor.execute('ALTER TABLE weather ADD COLUMN air_pressure REAL')
-    except:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE weather ADD COLUMN weather_main TEXT')
-    except:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE weather ADD COLUMN weather_description TEXT')
-    except:
-        pass  # Column already exists
-    
-    # Add air pollution columns
-    try:
-        cursor.execute('ALTER TABLE weather ADD COLUMN aqi INTEGER')
-    except:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE weather ADD COLUMN aqi_description TEXT')
-    except:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE weather ADD COLUMN pm2_5 REAL')
-    except:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE weather ADD COLUMN pm10 REAL')
-    except:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE weather ADD COLUMN no2 REAL')
-    except:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE weather ADD COLUMN o3 REAL')
-    except:
-        pass  # Column already exists
-    
-    try:
-        cursor.execute('ALTER TABLE weather ADD COLUMN co REAL')
-    except:
-        pass  # Column already exists
-    
+def _maybe_checkpoint(conn):
+    """Checkpoint the WAL if WAL_CHECKPOINT_INTERVAL seconds have elapsed."""
+    global _last_checkpoint
+    if time.monotonic() - _last_checkpoint < float(os.getenv('WAL_CHECKPOINT_INTERVAL', '300')):
+        return
+    if not _checkpoint_lock.acquire(blocking=False):
+        return  # Another request is already checkpointing
     try:
-        cursor.execute('ALTER TABLE weather ADD COLUMN daylight_hours REAL')
-    except:
-        pass  # Column already exists
+        _last_checkpoint = time.monotonic()
+        checkpoint_wal('PASSIVE', conn)
+    except sqlite3.Error as e:
+        print(f"[DB] WAL checkpoint failed: {e}")
+    finally:
+        _checkpoint_lock.release()
 
-    # Table for moon phases (daily)
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS moon_phases (
-            date TEXT PRIMARY KEY,
-            phase_name TEXT,
-            illumination_percent REAL
-        )
-    ''')
-
-    # Table for user settings
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS settings (
-            key TEXT PRIMARY KEY,
-            value TEXT,
-            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-
-    # Initialize default settings from .env if they don't exist
-    default_settings = {
-        'location_mode': 'auto',  # 'auto' or 'manual'
-        'latitude': os.getenv('LATITUDE', '52.4064'),
-        'longitude': os.getenv('LONGITUDE', '16.9252'),
-        'birth_date': os.getenv('BIRTH_DATE', '1995-04-17')
-    }
-    
-    for key, value in default_settings.items():
-        cursor.execute('''
-            INSERT OR IGNORE INTO settings (key, value)
-            VALUES (?, ?)
-        ''', (key, value))
-
-    # Insert default entry types
-    default_entry_types = [
-        ('mood', 'Mood', '😊', 'mood_select', 1, 5, '3', 'How are you feeling overall?'),
-        ('energy', 'Energy Level', '⚡', 'energy_select', 1, 5, '3', 'Rate your energy level'),
-        ('sleep_quality', 'Sleep Quality', '😴', 'sleep_select', 1, 5, '3', 'Rate your sleep quality'),
-        ('caffeine', 'Caffeine', '☕', 'caffeine_select', 0, 10, '1', 'Number of caffeine servings'),
-        ('meal', 'Meal', '🍽️', 'text', None, None, '', 'What did you eat?'),
-        ('wake_up', 'Wake Up', '🌅', 'boolean', None, None, 'true', 'Mark when you woke up'),
-        ('sleep_start', 'Bedtime', '🌙', 'boolean', None, None, 'true', 'Mark when you went to bed'),
-        ('exercise', 'Exercise', '🏃', 'text', None, None, '', 'Type of exercise or activity'),
-        ('water', 'Water Intake', '💧', 'water_select', 0, 20, '8', 'Glasses of water'),
-
-        ('notes', 'General Notes', '📝', 'text', None, None, '', 'Any observations or notes'),
-        ('alcohol', 'Alcohol', '🍷', 'alcohol_select', 0, 10, '0', 'Number of alcoholic drinks'),
-        ('medication', 'Medication', '💊', 'text', None, None, '', 'Medications taken'),
-        ('vitamins', 'Vitamins/Supplements', '🌿', 'text', None, None, '', 'Vitamins or supplements taken'),
-        ('weight', 'Weight', '⚖️', 'numeric', 50, 300, '70', 'Weight in kg')
-    ]
+class ConnectionPool:
+    """A bounded pool of reusable SQLite connections."""
 
-    cursor.executemany('''
-        INSERT OR IGNORE INTO entry_types 
-        (type_name, display_name, emoji, value_type, min_value, max_value, default_value, description)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', default_entry_types)
+    def __init__(self, size):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
 
-    conn.commit()
-    conn.close()
+    def acquire(self, timeout=None):
+        """Take an idle connection, opening a new one while under the size limit."""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._created < self.size:
+                self._created += 1
+                try:
+                    return _connect()
+                except Exception:
+                    self._created -= 1
+                    raise
+
+        try:
+            return self._idle.get(timeout=timeout)
+        except queue.Empty:
+            raise RuntimeError(f"No database connection available within {timeout}s (pool size {self.size})")
+
+    def release(self, conn):
+        """Return a connection to the pool, discarding any uncommitted work."""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            self.discard(conn)
+            return
+        self._idle.put(conn)
+
+    def discard(self, conn):
+        """Close a broken connection and free its slot."""
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def close_all(self):
+        """Close every idle connection in the pool."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self.discard(conn)
+
+_pool = None
+_pool_lock = threading.Lock()
+_thread_local = threading.local()
+
+def get_pool():
+    """Get the shared connection pool, sized from DB_POOL_SIZE on first use."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(int(os.getenv('DB_POOL_SIZE', '5')))
+    return _pool
+
+def get_db_connection():
+    """Get a reusable connection to the SQLite database.
+
+    Inside a Flask app context the connection is checked out of the pool once
+    and shared by every helper until the context is torn down. Outside of it
+    (startup code, background threads) each thread keeps its own connection.
+    """
+    if has_app_context():
+        if 'db_conn' not in g:
+            g.db_conn = get_pool().acquire(timeout=float(os.getenv('DB_POOL_TIMEOUT', '30')))
+        return g.db_conn
+
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is None:
+        conn = _connect()
+        _thread_local.conn = conn
+    return conn
+
+def close_db(exception=None):
+    """Return the request-scoped connection to the pool."""
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        if not conn.in_transaction:
+            _maybe_checkpoint(conn)
+        get_pool().release(conn)
+
+def close_thread_connection():
+    """Close the connection owned by the current (non-request) thread."""
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _thread_local.conn = None
+
+def init_app(app):
+    """Register the connection teardown with a Flask app."""
+    app.teardown_appcontext(close_db)
+
+def init_db():
+    """Initialize the database, applying any pending schema migrations."""
+    conn = get_db_connection()
+    migrations.migrate(conn)
 
 def get_timeline_data(start_date, end_date):
     """Get timeline entries for a date range."""
@@ -194,12 +207,11 @@ def get_timeline_data(start_date, end_date):
                et.display_name, et.emoji, et.value_type
         FROM timeline_entries te
         JOIN entry_types et ON te.entry_type = et.type_name
-        WHERE date(te.datetime) BETWEEN ? AND ?
+        WHERE te.entry_date BETWEEN ? AND ?
         ORDER BY te.datetime ASC
     ''', (start_date, end_date))
     
     entries = cursor.fetchall()
-    conn.close()
     return entries
 
 def add_timeline_entry(datetime_str, entry_type, numeric_value=None, text_value=None, notes=None):
@@ -207,23 +219,51 @@ def add_timeline_entry(datetime_str, entry_type, numeric_value=None, text_value=
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        INSERT OR REPLACE INTO timeline_entries 
-        (datetime, entry_type, numeric_value, text_value, notes)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (datetime_str, entry_type, numeric_value, text_value, notes))
-    
-    conn.commit()
-    conn.close()
+    try:
+        cursor.execute('''
+            INSERT OR REPLACE INTO timeline_entries 
+            (datetime, entry_type, numeric_value, text_value, notes)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (datetime_str, entry_type, numeric_value, text_value, notes))
+        aggregates.refresh(cursor, [(datetime_str[:10], entry_type)])
+        bump_data_version(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def add_timeline_entries(rows):
+    """Add or update many timeline entries in a single transaction.
+
+    Each row is a (datetime_str, entry_type, numeric_value, text_value, notes) tuple.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+
+    try:
+        cursor.executemany('''
+            INSERT OR REPLACE INTO timeline_entries
+            (datetime, entry_type, numeric_value, text_value, notes)
+            VALUES (?, ?, ?, ?, ?)
+        ''', rows)
+        aggregates.refresh(cursor, [(row[0][:10], row[1]) for row in rows])
+        bump_data_version(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 def get_entry_types():
     """Get all available entry types."""
+    return config_cache.get('entry_types', _load_entry_types)
+
+def _load_entry_types():
+    """Read all entry types from the database."""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('SELECT * FROM entry_types ORDER BY display_name')
     entry_types = cursor.fetchall()
-    conn.close()
     return entry_types
 
 def delete_timeline_entry(datetime_str, entry_type):
@@ -231,13 +271,98 @@ def delete_timeline_entry(datetime_str, entry_type):
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
-        DELETE FROM timeline_entries 
-        WHERE datetime = ? AND entry_type = ?
-    ''', (datetime_str, entry_type))
+    try:
+        cursor.execute('''
+            DELETE FROM timeline_entries 
+            WHERE datetime = ? AND entry_type = ?
+        ''', (datetime_str, entry_type))
+        aggregates.refresh(cursor, [(datetime_str[:10], entry_type)])
+        bump_data_version(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def rebuild_daily_aggregates():
+    """Recompute the daily_aggregates table from all timeline entries."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
     
-    conn.commit()
-    conn.close()
+    try:
+        aggregates.rebuild(cursor)
+        bump_data_version(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def get_daily_aggregates(start_date, end_date, entry_types=None):
+    """Get pre-aggregated numeric values for a date range.
+    
+    Returns {date: {entry_type: {'count', 'sum', 'min', 'max', 'first_value', 'last_value', 'avg'}}}.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    query = 'SELECT * FROM daily_aggregates WHERE date BETWEEN ? AND ?'
+    params = [start_date, end_date]
+    if entry_types:
+        query += f" AND entry_type IN ({', '.join('?' for _ in entry_types)})"
+        params.extend(entry_types)
+    cursor.execute(query, params)
+    
+    daily = {}
+    for row in cursor.fetchall():
+        values = dict(row)
+        values['avg'] = values['sum'] / values['count'] if values['count'] else None
+        daily.setdefault(row['date'], {})[row['entry_type']] = values
+    return daily
+
+# Timeline entries with their type and the weather and moon phase of their
+# day, in (datetime, entry_type) order so a page can resume after the last
+# row of the previous one through the UNIQUE(datetime, entry_type) index.
+EXPORT_SELECT = '''
+    SELECT te.datetime, te.entry_date AS date, te.entry_type, et.display_name, et.value_type,
+           te.numeric_value, te.text_value, te.notes,
+           w.temp_min, w.temp_max, w.humidity, w.precipitation, w.air_pressure,
+           w.weather_main, w.weather_description, w.aqi, w.aqi_description, w.daylight_hours,
+           m.phase_name AS moon_phase, m.illumination_percent AS moon_illumination
+    FROM timeline_entries te
+    LEFT JOIN entry_types et ON et.type_name = te.entry_type
+    LEFT JOIN weather w ON w.date = te.entry_date
+    LEFT JOIN moon_phases m ON m.date = te.entry_date
+    WHERE te.datetime BETWEEN ? AND ? || ' 23:59:59'
+      AND (te.datetime, te.entry_type) > (?, ?) {types}
+    ORDER BY te.datetime, te.entry_type
+    LIMIT ?
+'''
+
+def iter_export_rows(start_date, end_date, entry_types=None, page_size=500):
+    """Yield timeline entries joined with weather and moon phases, page by page.
+
+    Each page is a separate keyset query, so no read transaction stays open
+    between pages and memory holds a single page however long the range.
+    """
+    types_filter = f"AND te.entry_type IN ({', '.join('?' for _ in entry_types)})" if entry_types else ''
+    query = EXPORT_SELECT.format(types=types_filter)
+    after = ('', '')
+    while True:
+        cursor = get_db_connection().cursor()
+        cursor.execute(query, [start_date, end_date, *after, *(entry_types or []), page_size])
+        rows = cursor.fetchall()
+        yield from rows
+        if len(rows) < page_size:
+            return
+        after = (rows[-1]['datetime'], rows[-1]['entry_type'])
+
+def get_daily_aggregates_span():
+    """Get the first and last date with aggregated entries, or (None, None)."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT MIN(date), MAX(date) FROM daily_aggregates')
+    first_date, last_date = cursor.fetchone()
+    return first_date, last_date
 
 def get_day_entries(date_str):
     """Get all entries for a specific day."""
@@ -249,12 +374,11 @@ def get_day_entries(date_str):
                et.display_name, et.emoji, et.value_type
         FROM timeline_entries te
         JOIN entry_types et ON te.entry_type = et.type_name
-        WHERE date(te.datetime) = ?
+        WHERE te.entry_date = ?
         ORDER BY te.datetime ASC
     ''', (date_str,))
     
     entries = cursor.fetchall()
-    conn.close()
     return entries
 
 def get_mood_options():
@@ -267,17 +391,11 @@ def get_mood_options():
         {'value': 5, 'label': 'Excellent 😄', 'emoji': '😄'}
     ]
 
-def store_weather_data(date_str, weather_data):
-    """Store weather data for a specific date."""
-    if not weather_data:
-        return
-        
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Handle None values properly
-    temp_min = weather_data.get('temp_min') or 0
-    temp_max = weather_data.get('temp_max') or 0
+def _weather_row(date_str, weather_data):
+    """Convert a weather data dict into a row for the weather table."""
+    # Handle None values properly; an absent temperature stays NULL, since 0 is a valid reading
+    temp_min = weather_data.get('temp_min')
+    temp_max = weather_data.get('temp_max')
     humidity = weather_data.get('humidity') or 0
     pressure = weather_data.get('pressure') or 0
     precipitation = weather_data.get('precipitation') or 0
@@ -287,6 +405,7 @@ def store_weather_data(date_str, weather_data):
     
     # Air pollution data
     aqi = weather_data.get('aqi')
+    aqi_mean = weather_data.get('aqi_mean')
     aqi_description = weather_data.get('aqi_description') or ''
     pm2_5 = weather_data.get('pm2_5')
     pm10 = weather_data.get('pm10')
@@ -297,12 +416,11 @@ def store_weather_data(date_str, weather_data):
     # Daylight hours
     daylight_hours = weather_data.get('daylight_hours')
     
-    cursor.execute('''
-        INSERT OR REPLACE INTO weather 
-        (date, temp_min, temp_max, humidity, pressure, precipitation, air_pressure, weather_main, weather_description,
-         aqi, aqi_description, pm2_5, pm10, no2, o3, co, daylight_hours)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+    # Source ('current', 'forecast', 'historical') and fetch time, used to refresh forecasts
+    data_type = weather_data.get('data_type')
+    fetched_at = weather_data.get('fetched_at') or datetime.now().isoformat(timespec='seconds')
+    
+    return (
         date_str,
         temp_min,
         temp_max,
@@ -313,17 +431,73 @@ def store_weather_data(date_str, weather_data):
         weather_main,
         weather_description,
         aqi,
+        aqi_mean,
         aqi_description,
         pm2_5,
         pm10,
         no2,
         o3,
         co,
-        daylight_hours
-    ))
+        daylight_hours,
+        data_type,
+        fetched_at
+    )
+
+def store_weather_data(date_str, weather_data):
+    """Store weather data for a specific date."""
+    store_weather_data_batch({date_str: weather_data})
+
+def store_weather_data_batch(weather_by_date):
+    """Store weather data for many dates in a single transaction."""
+    rows = [_weather_row(date_str, weather_data)
+            for date_str, weather_data in weather_by_date.items() if weather_data]
+    if not rows:
+        return
+        
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.executemany('''
+        INSERT OR REPLACE INTO weather 
+        (date, temp_min, temp_max, humidity, pressure, precipitation, air_pressure, weather_main, weather_description,
+         aqi, aqi_mean, aqi_description, pm2_5, pm10, no2, o3, co, daylight_hours, data_type, fetched_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    bump_data_version(cursor)
     
     conn.commit()
-    conn.close()
+
+def store_air_pollution_batch(air_by_date):
+    """Store daily air pollution for many dates in a single transaction.
+    
+    Only the air pollution columns of existing weather rows are updated.
+    Dates without a weather row get an air-pollution-only row (data_type
+    'air_pollution') that a later weather fetch fills in.
+    """
+    fetched_at = datetime.now().isoformat(timespec='seconds')
+    rows = [(date_str, air['aqi'], air.get('aqi_mean'), air['aqi_description'], air['pm2_5'], air['pm10'],
+             air['no2'], air['o3'], air['co'], fetched_at)
+            for date_str, air in air_by_date.items()]
+    if not rows:
+        return
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.executemany('''
+            INSERT INTO weather (date, aqi, aqi_mean, aqi_description, pm2_5, pm10, no2, o3, co,
+                                 data_type, fetched_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'air_pollution', ?)
+            ON CONFLICT(date) DO UPDATE SET
+                aqi = excluded.aqi, aqi_mean = excluded.aqi_mean, aqi_description = excluded.aqi_description,
+                pm2_5 = excluded.pm2_5, pm10 = excluded.pm10, no2 = excluded.no2, o3 = excluded.o3, co = excluded.co
+        ''', rows)
+        bump_data_version(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 def get_weather_data(date_str):
     """Get weather data for a specific date."""
@@ -332,7 +506,6 @@ def get_weather_data(date_str):
     
     cursor.execute('SELECT * FROM weather WHERE date = ?', (date_str,))
     weather = cursor.fetchone()
-    conn.close()
     
     if weather:
         return dict(weather)
@@ -350,7 +523,6 @@ def get_weather_data_range(start_date, end_date):
     ''', (start_date, end_date))
     
     weather_data = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in weather_data]
 
@@ -359,8 +531,9 @@ def get_daily_summary_with_weather(date_str):
     # Get all entries for the day
     entries = get_day_entries(date_str)
     
-    # Get weather data
+    # Get weather data and pre-aggregated values
     weather = get_weather_data(date_str)
+    day_aggregates = get_daily_aggregates(date_str, date_str).get(date_str, {})
     
     # Process entries into summary
     summary = {
@@ -368,7 +541,9 @@ def get_daily_summary_with_weather(date_str):
         'weather': weather,
         'mood_entries': [],
         'energy_entries': [],
-        'sleep_quality': None,
+        'avg_mood': day_aggregates.get('mood', {}).get('avg'),
+        'avg_energy': day_aggregates.get('energy', {}).get('avg'),
+        'sleep_quality': day_aggregates.get('sleep_quality', {}).get('last_value'),
 
         'notes': [],
         'activities': []
@@ -388,7 +563,7 @@ def get_daily_summary_with_weather(date_str):
                 'notes': entry['notes']
             })
         elif entry['entry_type'] == 'sleep_quality' and entry['numeric_value']:
-            summary['sleep_quality'] = entry['numeric_value']
+            pass  # Taken from daily_aggregates above
 
         elif entry['notes']:
             summary['notes'].append({
@@ -461,45 +636,44 @@ def get_alcohol_options():
         {'value': 5, 'label': '5+ drinks 🍷🍷🍷🍷🍷', 'emoji': '🍷🍷🍷🍷🍷'}
     ]
 
-def update_entry_types_for_integers():
-    """Update existing entry types to use dropdown selects and proper defaults."""
+def store_moon_phase_data(date_str, phase_name, illumination_percent):
+    """Store moon phase data for a specific date."""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    # Update existing entry types to use dropdown selects
-    updates = [
-        ('caffeine', 'Caffeine', '☕', 'caffeine_select', 0, 10, '1', 'Number of caffeine servings'),
-        ('water', 'Water Intake', '💧', 'water_select', 0, 20, '8', 'Glasses of water'),
-        ('energy', 'Energy Level', '⚡', 'energy_select', 1, 5, '3', 'Rate your energy level'),
-        ('sleep_quality', 'Sleep Quality', '😴', 'sleep_select', 1, 5, '3', 'Rate your sleep quality'),
-
-        ('mood', 'Mood', '😊', 'mood_select', 1, 5, '3', 'How are you feeling overall?'),
-        ('alcohol', 'Alcohol', '🍷', 'alcohol_select', 0, 10, '0', 'Number of alcoholic drinks')
-    ]
-    
-    for entry_type, display_name, emoji, value_type, min_val, max_val, default_val, description in updates:
-        cursor.execute('''
-            UPDATE entry_types 
-            SET display_name = ?, emoji = ?, value_type = ?, min_value = ?, max_value = ?, default_value = ?, description = ?
-            WHERE type_name = ?
-        ''', (display_name, emoji, value_type, min_val, max_val, default_val, description, entry_type))
+    cursor.execute('''
+        INSERT OR REPLACE INTO moon_phases 
+        (date, phase_name, illumination_percent)
+        VALUES (?, ?, ?)
+    ''', (date_str, phase_name, illumination_percent))
+    bump_data_version(cursor)
     
     conn.commit()
-    conn.close()
 
-def store_moon_phase_data(date_str, phase_name, illumination_percent):
-    """Store moon phase data for a specific date."""
+def store_moon_phase_data_batch(moon_phases):
+    """Store many (date, phase_name, illumination_percent) rows in a single transaction."""
+    if not moon_phases:
+        return
+    
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('''
+    cursor.executemany('''
         INSERT OR REPLACE INTO moon_phases 
         (date, phase_name, illumination_percent)
         VALUES (?, ?, ?)
-    ''', (date_str, phase_name, illumination_percent))
+    ''', moon_phases)
+    bump_data_version(cursor)
     
     conn.commit()
-    conn.close()
+
+def count_moon_phases(start_date, end_date):
+    """Count the stored moon phases in a date range."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT COUNT(*) FROM moon_phases WHERE date BETWEEN ? AND ?', (start_date, end_date))
+    return cursor.fetchone()[0]
 
 def get_moon_phase_data(date_str):
     """Get moon phase data for a specific date."""
@@ -508,7 +682,6 @@ def get_moon_phase_data(date_str):
     
     cursor.execute('SELECT * FROM moon_phases WHERE date = ?', (date_str,))
     moon_phase = cursor.fetchone()
-    conn.close()
     
     if moon_phase:
         return dict(moon_phase)
@@ -522,45 +695,354 @@ def get_moon_phase_data_range(start_date, end_date):
     cursor.execute('SELECT * FROM moon_phases WHERE date BETWEEN ? AND ? ORDER BY date', 
                    (start_date, end_date))
     moon_phases = cursor.fetchall()
-    conn.close()
     
     return [dict(row) for row in moon_phases]
 
-# Settings functions
-def get_setting(key, default=None):
-    """Get a setting value by key."""
+def get_weather_fetch_block(date_str, endpoint):
+    """Get the failure record blocking a weather fetch, or None if it may run now."""
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute('SELECT value FROM settings WHERE key = ?', (key,))
-    result = cursor.fetchone()
-    conn.close()
+    cursor.execute('''
+        SELECT * FROM weather_fetch_status
+        WHERE date = ? AND endpoint = ? AND next_retry_at > ?
+        ORDER BY next_retry_at DESC LIMIT 1
+    ''', (date_str, endpoint, datetime.now().isoformat(timespec='seconds')))
+    block = cursor.fetchone()
     
-    if result:
-        return result['value']
-    return default
+    if block:
+        return dict(block)
+    return None
 
-def set_setting(key, value):
-    """Set a setting value."""
+def record_weather_fetch_failure(date_str, endpoint, reason, base_delay, max_delay):
+    """Record a failed weather fetch and schedule the next retry with exponential back-off.
+    
+    Delays are in seconds. Returns the next retry time as an ISO string.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('''
+            SELECT failures FROM weather_fetch_status
+            WHERE date = ? AND endpoint = ? AND reason = ?
+        ''', (date_str, endpoint, reason))
+        previous = cursor.fetchone()
+        failures = (previous['failures'] if previous else 0) + 1
+        
+        now = datetime.now()
+        delay = min(base_delay * 2 ** (failures - 1), max_delay)
+        next_retry_at = (now + timedelta(seconds=delay)).isoformat(timespec='seconds')
+        
+        cursor.execute('''
+            INSERT OR REPLACE INTO weather_fetch_status
+            (date, endpoint, reason, failures, last_failure_at, next_retry_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (date_str, endpoint, reason, failures, now.isoformat(timespec='seconds'), next_retry_at))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    return next_retry_at
+
+def clear_weather_fetch_failures(date_str, endpoint):
+    """Forget recorded failures after a successful weather fetch."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('''
+        DELETE FROM weather_fetch_status WHERE date = ? AND endpoint = ?
+    ''', (date_str, endpoint))
+    
+    conn.commit()
+
+def claim_scheduler_job(name, interval):
+    """Claim a background job if it is due and push its next run interval seconds out.
+    
+    The claim is a single conditional UPDATE, so when several processes run
+    the scheduler only one of them runs each due job. Returns True when this
+    caller should run the job.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    now = datetime.now()
+    now_str = now.isoformat(timespec='seconds')
+    try:
+        # New jobs are due immediately
+        cursor.execute('''
+            INSERT OR IGNORE INTO scheduler_jobs (name, next_run_at) VALUES (?, ?)
+        ''', (name, now_str))
+        cursor.execute('''
+            UPDATE scheduler_jobs SET last_started_at = ?, next_run_at = ?
+            WHERE name = ? AND next_run_at <= ?
+        ''', (now_str, (now + timedelta(seconds=interval)).isoformat(timespec='seconds'), name, now_str))
+        claimed = cursor.rowcount == 1
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    return claimed
+
+def finish_scheduler_job(name, status, error=None):
+    """Record the outcome of a background job run."""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('''
-        INSERT OR REPLACE INTO settings (key, value, updated_at)
-        VALUES (?, ?, CURRENT_TIMESTAMP)
-    ''', (key, value))
+        UPDATE scheduler_jobs
+        SET last_finished_at = ?, last_status = ?, last_error = ?, runs = runs + 1
+        WHERE name = ?
+    ''', (datetime.now().isoformat(timespec='seconds'), status, error, name))
     
     conn.commit()
-    conn.close()
+
+def get_scheduler_jobs():
+    """Get the stored state of all background jobs."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT * FROM scheduler_jobs ORDER BY name')
+    jobs = cursor.fetchall()
+    
+    return [dict(row) for row in jobs]
+
+def acquire_fetch_lease(key, owner, ttl):
+    """Take the fetch lease for key unless another owner holds an unexpired one.
+    
+    Returns True when owner now holds the lease for the next ttl seconds.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    now = datetime.now()
+    try:
+        cursor.execute('''
+            INSERT INTO fetch_leases (key, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE fetch_leases.expires_at <= ?
+        ''', (key, owner, (now + timedelta(seconds=ttl)).isoformat(), now.isoformat()))
+        acquired = cursor.rowcount == 1
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    return acquired
+
+def release_fetch_lease(key, owner):
+    """Give up a fetch lease held by owner."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('DELETE FROM fetch_leases WHERE key = ? AND owner = ?', (key, owner))
+    
+    conn.commit()
+
+def get_rate_limit_calls(since):
+    """Get the sorted times of API calls made at or after since."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT called_at FROM rate_limit_calls WHERE called_at >= ? ORDER BY called_at', (since,))
+    return [row['called_at'] for row in cursor.fetchall()]
+
+def update_rate_limit_calls(since, update):
+    """Read and extend the API call log under the database write lock.
+    
+    update(calls) gets the sorted times of calls since the given time and
+    returns (time of a new call or None, result). Older calls are dropped
+    and the result is returned once the new call is committed.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        called_at, result = update(get_rate_limit_calls(since))
+        cursor.execute('DELETE FROM rate_limit_calls WHERE called_at < ?', (since,))
+        if called_at is not None:
+            cursor.execute('INSERT INTO rate_limit_calls (called_at) VALUES (?)', (called_at,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    
+    return result
+
+def get_biorhythm_event_span(birth_date):
+    """Get the (start_date, end_date) indexed for a birth date, or None."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    cursor.execute('SELECT start_date, end_date FROM biorhythm_event_index WHERE birth_date = ?', (birth_date,))
+    span = cursor.fetchone()
+    
+    if span:
+        return span['start_date'], span['end_date']
+    return None
+
+def replace_biorhythm_events(birth_date, start_date, end_date, events):
+    """Replace the indexed events of a birth date in a single transaction.
+    
+    events are (date, cycle, event, cycle_count) rows covering start_date
+    to end_date. Events of other birth dates are dropped too, since only
+    the current setting is ever queried.
+    """
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.execute('DELETE FROM biorhythm_events')
+        cursor.execute('DELETE FROM biorhythm_event_index')
+        cursor.executemany('''
+            INSERT INTO biorhythm_events (birth_date, date, cycle, event, cycle_count)
+            VALUES (?, ?, ?, ?, ?)
+        ''', [(birth_date,) + tuple(event) for event in events])
+        cursor.execute('''
+            INSERT INTO biorhythm_event_index (birth_date, start_date, end_date) VALUES (?, ?, ?)
+        ''', (birth_date, start_date, end_date))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def get_biorhythm_events(birth_date, start_date, end_date, event=None, min_cycles=1):
+    """Get indexed biorhythm events in a date range, optionally of one event type."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    query = '''
+        SELECT date, cycle, event, cycle_count FROM biorhythm_events
+        WHERE birth_date = ? AND date BETWEEN ? AND ? AND cycle_count >= ?
+    '''
+    params = [birth_date, start_date, end_date, min_cycles]
+    if event:
+        query += ' AND event = ?'
+        params.append(event)
+    cursor.execute(query + ' ORDER BY date, cycle_count, cycle', params)
+    events = cursor.fetchall()
+    
+    return [dict(row) for row in events]
+
+def get_range_context(start_date, end_date):
+    """Get entries, weather and moon phases for a date range in three queries.
+    
+    Returns a dict with:
+      'entries': {date: [entry dicts in time order]}
+      'timeline': {date: {hour: [timeline cell dicts]}}
+      'weather': {date: weather dict}
+      'moon_phases': {date: moon phase dict}
+    """
+    context = {
+        'entries': {},
+        'timeline': {},
+        'weather': {w['date']: w for w in get_weather_data_range(start_date, end_date)},
+        'moon_phases': {m['date']: m for m in get_moon_phase_data_range(start_date, end_date)}
+    }
+    
+    for entry in get_timeline_data(start_date, end_date):
+        entry_datetime = datetime.fromisoformat(entry['datetime'])
+        date_key = entry_datetime.date().isoformat()
+        hour_key = entry_datetime.hour
+        
+        context['entries'].setdefault(date_key, []).append(dict(entry))
+        context['timeline'].setdefault(date_key, {}).setdefault(hour_key, []).append({
+            'type': entry['entry_type'],
+            'display_name': entry['display_name'],
+            'emoji': entry['emoji'],
+            'value_type': entry['value_type'],
+            'numeric_value': entry['numeric_value'],
+            'text_value': entry['text_value'],
+            'notes': entry['notes']
+        })
+    
+    return context
+
+# Settings and entry types rarely change, so every worker caches them until
+# the shared config version in the cache_versions table is bumped.
+def _get_cache_version(name):
+    """Get a shared cache version counter, read at most once per request."""
+    key = f'{name}_version'
+    if has_app_context() and key in g:
+        return g.get(key)
+    
+    conn = get_db_connection()
+    try:
+        result = conn.execute('SELECT version FROM cache_versions WHERE name = ?', (name,)).fetchone()
+        version = result['version'] if result else 0
+    except sqlite3.OperationalError:
+        version = 0  # Migrations have not run yet
+    
+    if has_app_context():
+        setattr(g, key, version)
+    return version
+
+def get_config_version():
+    """Get the shared config cache version, read at most once per request."""
+    return _get_cache_version('config')
+
+def bump_config_version(cursor):
+    """Invalidate cached settings and entry types in every worker."""
+    cursor.execute("UPDATE cache_versions SET version = version + 1 WHERE name = 'config'")
+    if has_app_context():
+        g.pop('config_version', None)
+    config_cache.clear()
+
+def get_data_version():
+    """Get the shared version of entries, weather and moon data, read at most once per request."""
+    return _get_cache_version('data')
+
+def bump_data_version(cursor):
+    """Invalidate results derived from entries, weather or moon data in every worker."""
+    cursor.execute("UPDATE cache_versions SET version = version + 1 WHERE name = 'data'")
+    if has_app_context():
+        g.pop('data_version', None)
+
+config_cache = VersionedCache('config', get_config_version)
+
+def get_cache_stats():
+    """Get hit/miss counters of the in-process caches."""
+    return {config_cache.name: config_cache.stats()}
+
+# Settings functions
+def get_setting(key, default=None):
+    """Get a setting value by key."""
+    return get_all_settings().get(key, default)
+
+def set_setting(key, value):
+    """Set a setting value."""
+    set_settings({key: value})
+
+def set_settings(values):
+    """Set several setting values in a single transaction."""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    try:
+        cursor.executemany('''
+            INSERT OR REPLACE INTO settings (key, value, updated_at)
+            VALUES (?, ?, CURRENT_TIMESTAMP)
+        ''', list(values.items()))
+        bump_config_version(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
 def get_all_settings():
     """Get all settings as a dictionary."""
+    return dict(config_cache.get('settings', _load_settings))
+
+def _load_settings():
+    """Read all settings from the database."""
     conn = get_db_connection()
     cursor = conn.cursor()
     
     cursor.execute('SELECT key, value FROM settings')
     results = cursor.fetchall()
-    conn.close()
     
     return {row['key']: row['value'] for row in results}
 
@@ -0,0 +1,50 @@
+import csv
+import io
+import json
+import database
+
+# Column order of exported rows
+EXPORT_COLUMNS = ('datetime', 'date', 'entry_type', 'display_name', 'value_type',
+                  'numeric_value', 'text_value', 'notes',
+                  'temp_min', 'temp_max', 'humidity', 'precipitation', 'air_pressure',
+                  'weather_main', 'weather_description', 'aqi', 'aqi_description', 'daylight_hours',
+                  'moon_phase', 'moon_illumination')
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv'
+}
+
+# Rows serialized per chunk sent to the client
+CHUNK_ROWS = 200
+
+def iter_ndjson(rows):
+    """Serialize rows as newline-delimited JSON, a chunk of lines at a time."""
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(EXPORT_COLUMNS, row)), ensure_ascii=False))
+        if len(lines) >= CHUNK_ROWS:
+            yield '\n'.join(lines) + '\n'
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n'
+
+def iter_csv(rows):
+    """Serialize rows as CSV with a header line, a chunk of lines at a time."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def stream_export(export_format, start_date, end_date, entry_types=None):
+    """Get a generator of the serialized export of a date range in ndjson or csv."""
+    if export_format not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    rows = database.iter_export_rows(start_date, end_date, entry_types)
+    return iter_ndjson(rows) if export_format == 'ndjson' else iter_csv(rows)
@@ -0,0 +1,125 @@
+"""A local stand-in for the OpenWeather API, for benchmarks and offline runs.
+
+Replays the recorded responses in fixtures/openweather with their
+timestamps moved to the requested time, optionally slowed down and failing
+at a configurable rate. Point the app at it with
+
+    python app/fake_openweather.py --port 8090 --latency-ms 80 --error-rate 0.05
+    OPENWEATHER_BASE_URL=http://127.0.0.1:8090 OPENWEATHER_API_KEY=fake python app/app.py
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import time
+from flask import Flask, jsonify, request
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), 'fixtures', 'openweather')
+
+def load_fixture(name):
+    """Load a recorded response from the fixtures directory."""
+    with open(os.path.join(FIXTURES_DIR, f'{name}.json')) as f:
+        return json.load(f)
+
+def replay_list(samples, start, end, step):
+    """Repeat recorded list samples every step seconds from start to end, rewriting their timestamps."""
+    entries = []
+    for i, dt in enumerate(range(start, end + 1, step)):
+        entry = copy.deepcopy(samples[i % len(samples)])
+        entry['dt'] = dt
+        entries.append(entry)
+    return entries
+
+def create_app(latency_ms=0, jitter_ms=0, error_rate=0.0, error_status=503, seed=None):
+    """Create the fake API app.
+
+    Every response is delayed by latency_ms plus up to jitter_ms, and a
+    fraction error_rate of requests fail with error_status.
+    """
+    app = Flask(__name__)
+    rng = random.Random(seed)
+    fixtures = {name: load_fixture(name) for name in ('weather', 'forecast', 'timemachine', 'air_pollution')}
+
+    @app.before_request
+    def simulate_network():
+        """Inject latency and errors, and reject requests without an API key like the real API."""
+        delay = latency_ms + rng.uniform(0, jitter_ms)
+        if delay:
+            time.sleep(delay / 1000)
+        if not request.args.get('appid'):
+            return jsonify({'cod': 401, 'message': 'Invalid API key.'}), 401
+        if error_rate and rng.random() < error_rate:
+            return jsonify({'cod': error_status, 'message': 'Injected failure'}), error_status
+
+    @app.route('/data/2.5/weather')
+    def current_weather():
+        """Replay the current weather, timestamped now."""
+        data = copy.deepcopy(fixtures['weather'])
+        now = int(time.time())
+        shift = now - data['dt']
+        data['dt'] = now
+        data['sys']['sunrise'] += shift
+        data['sys']['sunset'] += shift
+        return jsonify(data)
+
+    @app.route('/data/2.5/forecast')
+    def forecast():
+        """Replay the 5-day / 3-hour forecast starting at the next 3-hour slot."""
+        data = copy.deepcopy(fixtures['forecast'])
+        start = int(time.time()) // 10800 * 10800 + 10800
+        data['list'] = replay_list(data['list'], start, start + 39 * 10800, 10800)
+        data['cnt'] = len(data['list'])
+        return jsonify(data)
+
+    @app.route('/data/2.5/onecall/timemachine')
+    @app.route('/data/3.0/onecall/timemachine')
+    def timemachine():
+        """Replay a historical data point at the requested time."""
+        data = copy.deepcopy(fixtures['timemachine'])
+        dt = int(request.args.get('dt', time.time()))
+        shift = dt - data['data'][0]['dt']
+        for entry in data['data']:
+            entry['dt'] += shift
+            entry['sunrise'] += shift
+            entry['sunset'] += shift
+        return jsonify(data)
+
+    @app.route('/data/2.5/air_pollution')
+    def air_pollution():
+        """Replay the current air pollution."""
+        data = copy.deepcopy(fixtures['air_pollution'])
+        data['list'] = replay_list(data['list'], int(time.time()), int(time.time()), 3600)
+        return jsonify(data)
+
+    @app.route('/data/2.5/air_pollution/forecast')
+    def air_pollution_forecast():
+        """Replay 4 days of hourly air pollution forecast."""
+        data = copy.deepcopy(fixtures['air_pollution'])
+        start = int(time.time()) // 3600 * 3600
+        data['list'] = replay_list(data['list'], start, start + 96 * 3600, 3600)
+        return jsonify(data)
+
+    @app.route('/data/2.5/air_pollution/history')
+    def air_pollution_history():
+        """Replay hourly air pollution for the requested range."""
+        data = copy.deepcopy(fixtures['air_pollution'])
+        start = int(request.args['start']) // 3600 * 3600
+        data['list'] = replay_list(data['list'], start, int(request.args['end']), 3600)
+        return jsonify(data)
+
+    return app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the OpenWeather API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=int(os.getenv('FAKE_OPENWEATHER_PORT', '8090')))
+    parser.add_argument('--latency-ms', type=float, default=float(os.getenv('FAKE_OPENWEATHER_LATENCY_MS', '0')))
+    parser.add_argument('--jitter-ms', type=float, default=float(os.getenv('FAKE_OPENWEATHER_JITTER_MS', '0')))
+    parser.add_argument('--error-rate', type=float, default=float(os.getenv('FAKE_OPENWEATHER_ERROR_RATE', '0')))
+    parser.add_argument('--error-status', type=int, default=int(os.getenv('FAKE_OPENWEATHER_ERROR_STATUS', '503')))
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    fake_app = create_app(args.latency_ms, args.jitter_ms, args.error_rate, args.error_status, args.seed)
+    fake_app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,331 @@
+import os
+import aggregates
+
+# Columns added to the weather table after its first release
+WEATHER_COLUMNS = [
+    ('air_pressure', 'REAL'),
+    ('weather_main', 'TEXT'),
+    ('weather_description', 'TEXT'),
+    ('aqi', 'INTEGER'),
+    ('aqi_description', 'TEXT'),
+    ('pm2_5', 'REAL'),
+    ('pm10', 'REAL'),
+    ('no2', 'REAL'),
+    ('o3', 'REAL'),
+    ('co', 'REAL'),
+    ('daylight_hours', 'REAL')
+]
+
+def get_columns(cursor, table_name):
+    """Get the names of all columns (including generated ones) of a table."""
+    cursor.execute(f'PRAGMA table_xinfo({table_name})')
+    return {row[1] for row in cursor.fetchall()}
+
+def add_column_if_missing(cursor, table_name, column_name, definition):
+    """Add a column to a table unless it is already there."""
+    if column_name not in get_columns(cursor, table_name):
+        cursor.execute(f'ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}')
+
+def create_base_schema(cursor):
+    """Create the core tables and bring pre-migration weather tables up to date."""
+    # Table for timeline entries (hourly slots)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS timeline_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            datetime TEXT NOT NULL,
+            entry_type TEXT NOT NULL,
+            numeric_value REAL,
+            text_value TEXT,
+            notes TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(datetime, entry_type)
+        )
+    ''')
+
+    # Table for entry types configuration
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS entry_types (
+            type_name TEXT PRIMARY KEY,
+            display_name TEXT NOT NULL,
+            emoji TEXT,
+            value_type TEXT NOT NULL, -- 'numeric', 'text', 'boolean'
+            min_value REAL,
+            max_value REAL,
+            default_value TEXT,
+            description TEXT
+        )
+    ''')
+
+    # Table for weather data (daily)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS weather (
+            date TEXT PRIMARY KEY,
+            temp_min REAL,
+            temp_max REAL,
+            humidity REAL,
+            pressure REAL,
+            precipitation REAL,
+            air_pressure REAL,
+            weather_main TEXT,
+            weather_description TEXT,
+            aqi INTEGER,
+            aqi_description TEXT,
+            pm2_5 REAL,
+            pm10 REAL,
+            no2 REAL,
+            o3 REAL,
+            co REAL,
+            daylight_hours REAL
+        )
+    ''')
+
+    # Databases created before these columns existed
+    for column_name, definition in WEATHER_COLUMNS:
+        add_column_if_missing(cursor, 'weather', column_name, definition)
+
+    # Table for moon phases (daily)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS moon_phases (
+            date TEXT PRIMARY KEY,
+            phase_name TEXT,
+            illumination_percent REAL
+        )
+    ''')
+
+    # Table for user settings
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS settings (
+            key TEXT PRIMARY KEY,
+            value TEXT,
+            updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def add_entry_date_index(cursor):
+    """Add the indexable entry_date column to timeline_entries."""
+    add_column_if_missing(cursor, 'timeline_entries', 'entry_date',
+                          'TEXT GENERATED ALWAYS AS (substr(datetime, 1, 10)) VIRTUAL')
+
+    # Covering index for date-range lookups and per-day aggregates
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_timeline_entries_date_type
+        ON timeline_entries (entry_date, entry_type, numeric_value)
+    ''')
+
+def seed_defaults(cursor):
+    """Insert default settings and entry types."""
+    # Initialize default settings from .env if they don't exist
+    default_settings = {
+        'location_mode': 'auto',  # 'auto' or 'manual'
+        'latitude': os.getenv('LATITUDE', '52.4064'),
+        'longitude': os.getenv('LONGITUDE', '16.9252'),
+        'birth_date': os.getenv('BIRTH_DATE', '1995-04-17')
+    }
+
+    for key, value in default_settings.items():
+        cursor.execute('''
+            INSERT OR IGNORE INTO settings (key, value)
+            VALUES (?, ?)
+        ''', (key, value))
+
+    default_entry_types = [
+        ('mood', 'Mood', '😊', 'mood_select', 1, 5, '3', 'How are you feeling overall?'),
+        ('energy', 'Energy Level', '⚡', 'energy_select', 1, 5, '3', 'Rate your energy level'),
+        ('sleep_quality', 'Sleep Quality', '😴', 'sleep_select', 1, 5, '3', 'Rate your sleep quality'),
+        ('caffeine', 'Caffeine', '☕', 'caffeine_select', 0, 10, '1', 'Number of caffeine servings'),
+        ('meal', 'Meal', '🍽️', 'text', None, None, '', 'What did you eat?'),
+        ('wake_up', 'Wake Up', '🌅', 'boolean', None, None, 'true', 'Mark when you woke up'),
+        ('sleep_start', 'Bedtime', '🌙', 'boolean', None, None, 'true', 'Mark when you went to bed'),
+        ('exercise', 'Exercise', '🏃', 'text', None, None, '', 'Type of exercise or activity'),
+        ('water', 'Water Intake', '💧', 'water_select', 0, 20, '8', 'Glasses of water'),
+
+        ('notes', 'General Notes', '📝', 'text', None, None, '', 'Any observations or notes'),
+        ('alcohol', 'Alcohol', '🍷', 'alcohol_select', 0, 10, '0', 'Number of alcoholic drinks'),
+        ('medication', 'Medication', '💊', 'text', None, None, '', 'Medications taken'),
+        ('vitamins', 'Vitamins/Supplements', '🌿', 'text', None, None, '', 'Vitamins or supplements taken'),
+        ('weight', 'Weight', '⚖️', 'numeric', 50, 300, '70', 'Weight in kg')
+    ]
+
+    cursor.executemany('''
+        INSERT OR IGNORE INTO entry_types
+        (type_name, display_name, emoji, value_type, min_value, max_value, default_value, description)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', default_entry_types)
+
+def update_entry_types_for_integers(cursor):
+    """Update existing entry types to use dropdown selects and proper defaults."""
+    updates = [
+        ('caffeine', 'Caffeine', '☕', 'caffeine_select', 0, 10, '1', 'Number of caffeine servings'),
+        ('water', 'Water Intake', '💧', 'water_select', 0, 20, '8', 'Glasses of water'),
+        ('energy', 'Energy Level', '⚡', 'energy_select', 1, 5, '3', 'Rate your energy level'),
+        ('sleep_quality', 'Sleep Quality', '😴', 'sleep_select', 1, 5, '3', 'Rate your sleep quality'),
+
+        ('mood', 'Mood', '😊', 'mood_select', 1, 5, '3', 'How are you feeling overall?'),
+        ('alcohol', 'Alcohol', '🍷', 'alcohol_select', 0, 10, '0', 'Number of alcoholic drinks')
+    ]
+
+    for entry_type, display_name, emoji, value_type, min_val, max_val, default_val, description in updates:
+        cursor.execute('''
+            UPDATE entry_types
+            SET display_name = ?, emoji = ?, value_type = ?, min_value = ?, max_value = ?, default_value = ?, description = ?
+            WHERE type_name = ?
+        ''', (display_name, emoji, value_type, min_val, max_val, default_val, description, entry_type))
+
+def add_daily_aggregates(cursor):
+    """Create the daily_aggregates table and fill it from existing entries."""
+    aggregates.create_table(cursor)
+    aggregates.rebuild(cursor)
+
+def add_cache_versions(cursor):
+    """Create the shared version counters used to invalidate worker caches."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS cache_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('config', 0)")
+
+def add_weather_fetch_status(cursor):
+    """Create the table tracking failed weather API fetches."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS weather_fetch_status (
+            date TEXT NOT NULL,
+            endpoint TEXT NOT NULL,
+            reason TEXT NOT NULL,
+            failures INTEGER NOT NULL DEFAULT 1,
+            last_failure_at TEXT NOT NULL,
+            next_retry_at TEXT NOT NULL,
+            PRIMARY KEY (date, endpoint, reason)
+        )
+    ''')
+
+def add_weather_freshness(cursor):
+    """Record where stored weather came from and when it was fetched."""
+    add_column_if_missing(cursor, 'weather', 'data_type', 'TEXT')
+    add_column_if_missing(cursor, 'weather', 'fetched_at', 'TEXT')
+
+def add_scheduler_jobs(cursor):
+    """Create the table holding background job state across restarts."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS scheduler_jobs (
+            name TEXT PRIMARY KEY,
+            next_run_at TEXT NOT NULL,
+            last_started_at TEXT,
+            last_finished_at TEXT,
+            last_status TEXT,
+            last_error TEXT,
+            runs INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+
+def add_fetch_leases(cursor):
+    """Create the table of leases coalescing fetches across processes."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS fetch_leases (
+            key TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at TEXT NOT NULL
+        )
+    ''')
+
+def add_aqi_mean(cursor):
+    """Store the mean AQI of a day next to its worst (max) AQI."""
+    add_column_if_missing(cursor, 'weather', 'aqi_mean', 'REAL')
+
+def add_rate_limit_calls(cursor):
+    """Create the log of recent API calls that shares the call budget across processes."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limit_calls (
+            called_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_rate_limit_calls_called_at ON rate_limit_calls (called_at)')
+
+def add_biorhythm_events(cursor):
+    """Create the index of biorhythm critical, peak and trough days."""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS biorhythm_events (
+            birth_date TEXT NOT NULL,
+            date TEXT NOT NULL,
+            cycle TEXT NOT NULL,
+            event TEXT NOT NULL,
+            cycle_count INTEGER NOT NULL DEFAULT 1,
+            PRIMARY KEY (birth_date, date, cycle, event)
+        )
+    ''')
+
+    # Date span indexed so far per birth date
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS biorhythm_event_index (
+            birth_date TEXT PRIMARY KEY,
+            start_date TEXT NOT NULL,
+            end_date TEXT NOT NULL
+        )
+    ''')
+
+def add_data_version(cursor):
+    """Add the version counter of entries, weather and moon data."""
+    cursor.execute("INSERT OR IGNORE INTO cache_versions (name, version) VALUES ('data', 0)")
+
+def clear_zero_temperatures(cursor):
+    """Turn the 0/0 placeholders once stored for an absent temperature into NULLs."""
+    cursor.execute('UPDATE weather SET temp_min = NULL, temp_max = NULL WHERE temp_min = 0 AND temp_max = 0')
+
+# Numbered schema steps, applied in order. Never edit a released step;
+# append a new one instead.
+MIGRATIONS = [
+    (1, 'Create base schema', create_base_schema),
+    (2, 'Index timeline entries by date', add_entry_date_index),
+    (3, 'Seed default settings and entry types', seed_defaults),
+    (4, 'Switch integer entry types to dropdown selects', update_entry_types_for_integers),
+    (5, 'Add daily aggregates', add_daily_aggregates),
+    (6, 'Add cache version counters', add_cache_versions),
+    (7, 'Track failed weather fetches', add_weather_fetch_status),
+    (8, 'Add weather data type and fetch time', add_weather_freshness),
+    (9, 'Add background job state', add_scheduler_jobs),
+    (10, 'Add cross-process fetch leases', add_fetch_leases),
+    (11, 'Add daily mean AQI', add_aqi_mean),
+    (12, 'Add shared rate limit call log', add_rate_limit_calls),
+    (13, 'Add biorhythm event index', add_biorhythm_events),
+    (14, 'Add data cache version', add_data_version),
+    (15, 'Store absent temperatures as NULL', clear_zero_temperatures)
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+def get_schema_version(conn):
+    """Get the schema version stored in the database header."""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    """Apply all pending migrations in a single transaction.
+
+    Returns the list of applied version numbers. When the schema is already
+    current this costs a single pragma read.
+    """
+    if get_schema_version(conn) >= LATEST_VERSION:
+        return []
+
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        # Another worker may have migrated while we waited for the write lock
+        current_version = get_schema_version(conn)
+        applied = []
+        for version, description, step in MIGRATIONS:
+            if version <= current_version:
+                continue
+            print(f"[DB] Applying migration {version}: {description}")
+            step(cursor)
+            applied.append(version)
+
+        cursor.execute(f'PRAGMA user_version = {LATEST_VERSION}')
+
+        # Settings and entry types may have changed, drop every worker's cache
+        cursor.execute("UPDATE cache_versions SET version = version + 1 WHERE name = 'config'")
+        conn.commit()
+        return applied
+    except Exception:
+        conn.rollback()
+        raise
@@ -0,0 +1,150 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import ratelimit
+
+BASE_URL = 'https://api.openweathermap.org'
+
+# Status codes worth retrying: rate limited or a server-side failure
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Latency samples kept per endpoint for the percentile stats
+LATENCY_SAMPLES = 500
+
+class OpenWeatherClient:
+    """A shared OpenWeather HTTP client.
+
+    Reuses pooled keep-alive connections through one requests.Session and
+    retries rate-limited (429) and 5xx responses as well as connection errors
+    with jittered exponential back-off. Every attempt first takes a token from
+    the optional rate limiter.
+    """
+
+    def __init__(self, base_url=BASE_URL, connect_timeout=3.05, read_timeout=10,
+                 max_retries=3, backoff_base=0.5, backoff_max=10, pool_size=10, rate_limiter=None):
+        self.base_url = base_url.rstrip('/')
+        self.rate_limiter = rate_limiter
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def get(self, path, params, endpoint):
+        """GET a JSON document from the API, retrying transient failures.
+
+        endpoint names the call in the latency stats. Raises a
+        requests.RequestException once retries are exhausted, or
+        ratelimit.RateLimitExceeded when the call budget is used up.
+        """
+        url = f'{self.base_url}{path}'
+
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire(endpoint)
+            started = time.monotonic()
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._record(endpoint, time.monotonic() - started, error=True)
+                if attempt >= self.max_retries:
+                    raise
+                self._sleep_before_retry(endpoint, attempt, None, e)
+                attempt += 1
+                continue
+
+            failed = response.status_code >= 400
+            self._record(endpoint, time.monotonic() - started, error=failed)
+            if response.status_code in RETRY_STATUS_CODES and attempt < self.max_retries:
+                self._sleep_before_retry(endpoint, attempt, response, None)
+                attempt += 1
+                continue
+
+            response.raise_for_status()
+            return response.json()
+
+    def _sleep_before_retry(self, endpoint, attempt, response, error):
+        """Wait before the next attempt, honouring Retry-After when the server sends one."""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = min(float(retry_after), self.backoff_max)
+
+        reason = f'HTTP {response.status_code}' if response is not None else str(error)
+        print(f"[OpenWeather] {endpoint} failed ({reason}), retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+        with self._stats_lock:
+            self._stats[endpoint]['retries'] += 1
+        time.sleep(delay)
+
+    def _record(self, endpoint, elapsed, error):
+        """Record one request attempt in the per-endpoint stats."""
+        with self._stats_lock:
+            stats = self._stats.setdefault(endpoint, {
+                'requests': 0,
+                'errors': 0,
+                'retries': 0,
+                'latencies': deque(maxlen=LATENCY_SAMPLES)
+            })
+            stats['requests'] += 1
+            if error:
+                stats['errors'] += 1
+            stats['latencies'].append(elapsed * 1000)
+
+    def stats(self):
+        """Get request counts and latency percentiles (ms) per endpoint."""
+        with self._stats_lock:
+            result = {}
+            for endpoint, stats in self._stats.items():
+                latencies = sorted(stats['latencies'])
+                result[endpoint] = {
+                    'requests': stats['requests'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'avg_ms': round(sum(latencies) / len(latencies), 1),
+                    'p50_ms': _percentile(latencies, 0.5),
+                    'p95_ms': _percentile(latencies, 0.95),
+                    'max_ms': round(latencies[-1], 1)
+                }
+            return result
+
+def _percentile(sorted_values, p):
+    """Get the p-th percentile (0-1) of an already sorted list."""
+    return round(sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))], 1)
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Get the shared client, configured from the environment on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = OpenWeatherClient(
+                    base_url=os.getenv('OPENWEATHER_BASE_URL', BASE_URL),
+                    connect_timeout=float(os.getenv('OPENWEATHER_CONNECT_TIMEOUT', '3.05')),
+                    read_timeout=float(os.getenv('OPENWEATHER_READ_TIMEOUT', '10')),
+                    max_retries=int(os.getenv('OPENWEATHER_MAX_RETRIES', '3')),
+                    pool_size=int(os.getenv('OPENWEATHER_POOL_SIZE', '10')),
+                    rate_limiter=ratelimit.RateLimiter(
+                        per_minute=int(os.getenv('OPENWEATHER_CALLS_PER_MINUTE', '60')),
+                        per_day=int(os.getenv('OPENWEATHER_CALLS_PER_DAY', '1000')),
+                        max_wait=float(os.getenv('OPENWEATHER_RATE_LIMIT_MAX_WAIT', '10')),
+                        shared=os.getenv('OPENWEATHER_RATE_LIMIT_SHARED', 'false').lower() == 'true'
+                    )
+                )
+    return _client
@@ -0,0 +1,152 @@
+import math
+import threading
+import time
+from bisect import bisect_left
+
+import requests
+
+import database
+
+class RateLimitExceeded(requests.RequestException):
+    """Raised when a request cannot fit in the call budget within the allowed wait."""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def window_start(length, sliding, now):
+    """Get the start of the window containing now.
+
+    A sliding window covers the last length seconds; a calendar window is
+    aligned to the Unix epoch, so a day-long one starts at midnight UTC,
+    when the OpenWeather daily quota resets.
+    """
+    return now - length if sliding else math.floor(now / length) * length
+
+def get_horizon(limits, now):
+    """Get the time before which past calls no longer count against any window."""
+    return min(window_start(length, sliding, now) for length, _, sliding in limits.values())
+
+def time_until_call(calls, limits, now):
+    """Get the seconds until one more call fits in every window, 0 if it fits now.
+
+    calls holds the sorted times of past calls and limits is {name: (window
+    length in seconds, max calls per window, sliding)}.
+    """
+    wait = 0
+    for length, limit, sliding in limits.values():
+        start = window_start(length, sliding, now)
+        first = bisect_left(calls, start)
+        if len(calls) - first < limit:
+            continue
+        if sliding:
+            # Room frees up when enough of the oldest calls leave the window
+            wait = max(wait, calls[len(calls) - limit] + length - now)
+        else:
+            wait = max(wait, start + length - now)
+    return wait
+
+def take_call(calls, limits, now):
+    """Record a call at now if it fits in every window.
+
+    Returns (calls still counting against a window, including the new one
+    when taken; wait) where wait is 0 when the call was taken.
+    """
+    calls = calls[bisect_left(calls, get_horizon(limits, now)):]
+    wait = time_until_call(calls, limits, now)
+    if wait == 0:
+        calls.append(now)
+    return calls, wait
+
+class RateLimiter:
+    """Per-minute and per-day call budgets shared by all API calls.
+
+    The per-minute budget holds for any 60 seconds and the per-day budget
+    for each UTC day, matching how OpenWeather counts calls. A call that
+    finds a budget used up waits for room if it frees up within max_wait
+    seconds and raises RateLimitExceeded otherwise. With shared=True the
+    call log lives in SQLite so every worker process draws from the same
+    budget.
+    """
+
+    def __init__(self, per_minute=60, per_day=1000, max_wait=10, shared=False):
+        self.limits = {
+            'per_minute': (60, per_minute, True),
+            'per_day': (86400, per_day, False)
+        }
+        self.max_wait = max_wait
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._calls = []
+        self.granted = 0
+        self.delayed = 0
+        self.rejected = 0
+        self.waited_seconds = 0.0
+
+    def _try_take(self):
+        """Try to take a call now; returns the seconds to wait (0 when taken)."""
+        now = time.time()
+        if self.shared:
+            def update(calls):
+                wait = time_until_call(calls, self.limits, now)
+                return (now if wait == 0 else None), wait
+            return database.update_rate_limit_calls(get_horizon(self.limits, now), update)
+
+        with self._lock:
+            self._calls, wait = take_call(self._calls, self.limits, now)
+            return wait
+
+    def acquire(self, endpoint):
+        """Block until a request to endpoint fits in the budget.
+
+        Raises RateLimitExceeded when that would take longer than max_wait.
+        """
+        started = time.monotonic()
+        delayed = False
+        while True:
+            wait = self._try_take()
+            waited = time.monotonic() - started
+            if wait == 0:
+                with self._lock:
+                    self.granted += 1
+                    self.delayed += delayed
+                    self.waited_seconds += waited
+                return
+
+            if waited + wait > self.max_wait:
+                with self._lock:
+                    self.rejected += 1
+                print(f"[RateLimit] Budget exhausted, deferring {endpoint} call (room in {wait:.0f}s)")
+                raise RateLimitExceeded(f'OpenWeather call budget exhausted for {endpoint}', wait)
+
+            delayed = True
+            time.sleep(wait)
+
+    def stats(self):
+        """Get the configured budgets, calls used in the current windows and call counters."""
+        now = time.time()
+        if self.shared:
+            calls = database.get_rate_limit_calls(get_horizon(self.limits, now))
+        else:
+            with self._lock:
+                calls = list(self._calls)
+
+        budgets = {}
+        for name, (length, limit, sliding) in self.limits.items():
+            used = len(calls) - bisect_left(calls, window_start(length, sliding, now))
+            budgets[name] = {
+                'limit': limit,
+                'used': used,
+                'available': max(limit - used, 0)
+            }
+
+        with self._lock:
+            return {
+                'shared': self.shared,
+                'max_wait': self.max_wait,
+                'budgets': budgets,
+                'granted': self.granted,
+                'delayed': self.delayed,
+                'rejected': self.rejected,
+                'waited_seconds': round(self.waited_seconds, 2)
+            }
@@ -0,0 +1,178 @@
+import os
+import threading
+from datetime import datetime, timedelta
+import astronomy
+import database
+import weather
+
+_thread = None
+_stop_event = threading.Event()
+_start_lock = threading.Lock()
+_start_attempted = False
+
+# Settings are read on every use rather than at import time, so values
+# loaded from .env after this module is imported still apply.
+
+def get_window():
+    """Get the (start, end) dates the scheduler keeps filled with weather and moon phases."""
+    today = datetime.now().date()
+    return (today - timedelta(days=int(os.getenv('BACKFILL_DAYS_BACK', '60'))),
+            today + timedelta(days=int(os.getenv('BACKFILL_DAYS_FORWARD', '5'))))
+
+def get_batch_size():
+    """Get the most missing weather days fetched per backfill run."""
+    return int(os.getenv('BACKFILL_BATCH_SIZE', '10'))
+
+def get_tick():
+    """Get how often the scheduler checks for due jobs, in seconds."""
+    return float(os.getenv('SCHEDULER_TICK', '30'))
+
+def get_backfill_interval():
+    """Get how often the weather backfill runs, in seconds."""
+    return int(os.getenv('BACKFILL_INTERVAL', '900'))
+
+def iter_dates(start_date, end_date):
+    """Yield ISO date strings from start_date to end_date inclusive."""
+    current_date = start_date
+    while current_date <= end_date:
+        yield current_date.isoformat()
+        current_date += timedelta(days=1)
+
+def refresh_current_weather():
+    """Refetch today's weather from the current endpoint once its row is stale."""
+    today = datetime.now().date().isoformat()
+    stored = database.get_weather_data(today)
+    if stored and not weather.is_weather_stale(stored, today):
+        return
+
+    if weather.fetch_and_store_weather(today):
+        print(f"[Scheduler] Refreshed current weather for {today}")
+
+def refresh_forecast():
+    """Fetch the forecast and store every future day it covers."""
+    if not weather.get_api_key():
+        return
+    days = weather.ingest_forecast()
+    print(f"[Scheduler] Forecast covers {len(days)} days")
+
+def backfill_weather():
+    """Fetch weather for days in the window that have no stored row yet.
+
+    Newest days go first and at most get_batch_size() are fetched per run;
+    days still backing off after a failure are skipped by the fetch itself.
+    """
+    start_date, end_date = get_window()
+    stored = {w['date']: w for w in database.get_weather_data_range(start_date.isoformat(), end_date.isoformat())}
+    missing = [d for d in iter_dates(start_date, end_date)
+               if d not in stored or stored[d].get('data_type') == 'air_pollution']
+    if not missing:
+        return
+
+    batch = sorted(missing, reverse=True)[:get_batch_size()]
+    new_weather = weather.get_weather_for_dates(batch)
+    print(f"[Scheduler] Backfilled weather for {len(new_weather)}/{len(batch)} days "
+          f"({len(missing)} missing in window)")
+
+def backfill_air_pollution():
+    """Fill air pollution for past days in the window with one request per month."""
+    start_date, _ = get_window()
+    end_date = datetime.now().date() - timedelta(days=1)
+    stored = {w['date']: w for w in database.get_weather_data_range(start_date.isoformat(), end_date.isoformat())}
+    missing = [d for d in iter_dates(start_date, end_date) if d not in stored or stored[d].get('aqi') is None]
+    if not missing:
+        return
+
+    days = weather.ingest_air_pollution_history(datetime.strptime(missing[0], '%Y-%m-%d').date(),
+                                                datetime.strptime(missing[-1], '%Y-%m-%d').date())
+    print(f"[Scheduler] Backfilled air pollution for {len(days)}/{len(missing)} days")
+
+def backfill_moon_phases():
+    """Bulk-load moon phases for the window if any day is missing."""
+    stored = astronomy.ensure_moon_phases(*get_window())
+    if stored:
+        print(f"[Scheduler] Stored moon phases for {stored} days")
+
+# Background jobs: (name, function getting the interval in seconds, job function)
+JOBS = [
+    ('current_weather', lambda: weather.get_weather_ttl('current'), refresh_current_weather),
+    ('forecast', lambda: weather.get_weather_ttl('forecast'), refresh_forecast),
+    ('weather_backfill', get_backfill_interval, backfill_weather),
+    ('air_pollution_backfill', lambda: 24 * 3600, backfill_air_pollution),
+    ('moon_phases', lambda: 6 * 3600, backfill_moon_phases)
+]
+
+def run_due_jobs():
+    """Run every job whose next run time has passed.
+
+    Job state lives in the scheduler_jobs table, so a restarted app picks up
+    the schedule where it left off instead of refetching everything.
+    """
+    for name, get_interval, job in JOBS:
+        if _stop_event.is_set():
+            return
+        try:
+            if not database.claim_scheduler_job(name, get_interval()):
+                continue
+        except Exception as e:
+            print(f"[Scheduler] Could not claim job {name}: {e}")
+            continue
+
+        try:
+            job()
+            database.finish_scheduler_job(name, 'ok')
+        except Exception as e:
+            print(f"[Scheduler] Job {name} failed: {e}")
+            try:
+                database.finish_scheduler_job(name, 'error', str(e))
+            except Exception as record_error:
+                print(f"[Scheduler] Could not record failure of job {name}: {record_error}")
+
+def _run():
+    """Scheduler thread main loop."""
+    start_date, end_date = get_window()
+    print(f"[Scheduler] Started, keeping {start_date} to {end_date} filled")
+    try:
+        while not _stop_event.is_set():
+            run_due_jobs()
+            _stop_event.wait(get_tick())
+    finally:
+        database.close_thread_connection()
+        print("[Scheduler] Stopped")
+
+def start():
+    """Start the scheduler thread unless it is disabled or already running."""
+    global _thread
+    if os.getenv('SCHEDULER_ENABLED', 'true').lower() != 'true':
+        print("[Scheduler] Disabled by SCHEDULER_ENABLED")
+        return
+    if is_running():
+        return
+
+    _stop_event.clear()
+    _thread = threading.Thread(target=_run, name='scheduler', daemon=True)
+    _thread.start()
+
+def ensure_started():
+    """Start the scheduler once per process; later calls return at once.
+
+    Meant for hooks that run on every request, so that whichever process
+    serves requests (debug reloader child, flask run, a WSGI worker) also
+    keeps the data filled.
+    """
+    global _start_attempted
+    if _start_attempted:
+        return
+    with _start_lock:
+        if not _start_attempted:
+            _start_attempted = True
+            start()
+
+def stop(timeout=None):
+    """Ask the scheduler thread to stop and wait for it."""
+    _stop_event.set()
+    if _thread is not None:
+        _thread.join(timeout)
+
+def is_running():
+    """Check whether the scheduler thread is alive in this process."""
+    return _thread is not None and _thread.is_alive()
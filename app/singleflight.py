@@ -0,0 +1,132 @@
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+import database
+
+class _Call:
+    """One in-flight call that other callers can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """Coalesce concurrent calls for the same key into one.
+
+    The first caller for a key runs the function and every caller that
+    arrives while it is running waits for and shares its result. An optional
+    process lock extends this across processes: only one process runs the
+    function at a time and the others re-check the shared store once they
+    get the lock.
+    """
+
+    def __init__(self, process_lock=None):
+        self._process_lock = process_lock
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.leaders = 0
+        self.shared = 0
+        self.rechecked = 0
+
+    def do(self, key, fn, recheck=None):
+        """Run fn() once for all concurrent callers of key and return its result.
+
+        recheck() runs after the process lock is taken; when it returns
+        something other than None, that is used instead of calling fn().
+        Errors raised by fn() are raised in every waiting caller.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            lock = self._process_lock(key) if self._process_lock else nullcontext()
+            with lock:
+                result = recheck() if recheck else None
+                if result is not None:
+                    with self._lock:
+                        self.rechecked += 1
+                else:
+                    result = fn()
+            call.result = result
+            return result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self):
+        """Get counters for led, shared and re-checked calls."""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'leaders': self.leaders,
+                'shared': self.shared,
+                'rechecked': self.rechecked
+            }
+
+def _key_name(key):
+    """Turn a key tuple into a short string usable as a file or lease name."""
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+def file_lock(directory):
+    """Process lock holding an exclusive flock on one file per key (POSIX only)."""
+    import fcntl
+    os.makedirs(directory, exist_ok=True)
+
+    @contextmanager
+    def lock(key):
+        with open(os.path.join(directory, f'{_key_name(key)}.lock'), 'w') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    return lock
+
+def db_lease(ttl=30, poll_interval=0.1):
+    """Process lock holding a row in the fetch_leases table.
+
+    A lease left behind by a crashed process expires after ttl seconds.
+    """
+    @contextmanager
+    def lock(key):
+        name = _key_name(key)
+        owner = f'{os.getpid()}:{threading.get_ident()}'
+        while not database.acquire_fetch_lease(name, owner, ttl):
+            time.sleep(poll_interval)
+        try:
+            yield
+        finally:
+            database.release_fetch_lease(name, owner)
+    return lock
+
+def get_process_lock(mode):
+    """Get the process lock for SINGLE_FLIGHT_MODE: 'thread' (none), 'file' or 'db'."""
+    if mode == 'file':
+        directory = os.getenv('SINGLE_FLIGHT_LOCK_DIR',
+                              os.path.join(os.path.dirname(database.DB_PATH), 'locks'))
+        return file_lock(directory)
+    if mode == 'db':
+        return db_lease(ttl=float(os.getenv('SINGLE_FLIGHT_LEASE_TTL', '30')))
+    if mode != 'thread':
+        print(f"[SingleFlight] Unknown mode '{mode}', coalescing within this process only")
+    return None
@@ -1,25 +1,110 @@
 import requests
 import os
-import math
 from datetime import datetime, timedelta
 import time
 import calendar
-
-API_KEY = os.getenv('OPENWEATHER_API_KEY')
-LAT = os.getenv('LATITUDE', '52.4064')  # Poznań, Poland
-LON = os.getenv('LONGITUDE', '16.9252')
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+import astronomy
+import database
+import openweather
+import ratelimit
+import singleflight
+
+def get_api_key():
+    """Get the OpenWeather API key.
+
+    Configuration is read on every call rather than at import time, so
+    values loaded from .env after this module is imported still apply.
+    """
+    return os.getenv('OPENWEATHER_API_KEY')
+
+def get_latitude():
+    """Get the configured latitude (Poznań, Poland by default)."""
+    return os.getenv('LATITUDE', '52.4064')
+
+def get_longitude():
+    """Get the configured longitude."""
+    return os.getenv('LONGITUDE', '16.9252')
+
+# Back-off after a failed fetch, per failure reason: (first delay, maximum delay) in seconds
+RETRY_BACKOFF = {
+    'unauthorized': (24 * 3600, 30 * 24 * 3600),  # Endpoint not included in the subscription
+    'no_data': (6 * 3600, 7 * 24 * 3600),
+    'rate_limited': (15 * 60, 6 * 3600)  # Call budget used up, defer until there is room again
+}
+DEFAULT_RETRY_BACKOFF = (5 * 60, 24 * 3600)
+
+# TTL settings for today and future dates, per data type: (variable, default seconds)
+WEATHER_TTL_SETTINGS = {
+    'forecast': ('FORECAST_TTL', 3 * 3600),
+    'current': ('CURRENT_WEATHER_TTL', 3600)
+}
+
+def get_weather_ttl(data_type):
+    """Get how long stored weather of a data type stays fresh, in seconds.
+
+    Unknown data types use the forecast TTL.
+    """
+    variable, default = WEATHER_TTL_SETTINGS.get(data_type, WEATHER_TTL_SETTINGS['forecast'])
+    return int(os.getenv(variable, str(default)))
+
+# Placeholder AQI fields when no air pollution data is available
+AQI_UNAVAILABLE = {
+    'aqi': None,
+    'aqi_mean': None,
+    'aqi_description': 'Data Unavailable',
+    'pm2_5': None,
+    'pm10': None,
+    'no2': None,
+    'o3': None,
+    'co': None
+}
+
+# Bounded pool for fetching many dates at once
+_executor = None
+_executor_lock = threading.Lock()
+
+# Coalesces concurrent fetches of the same weather day
+_flights = None
+_flights_lock = threading.Lock()
+
+# Last fetched forecast payloads, shared by all future dates
+_forecast_lock = threading.Lock()
+_forecast_cache = {}
+
+def get_failure_reason(error):
+    """Classify a failed request for the weather_fetch_status table."""
+    if isinstance(error, ratelimit.RateLimitExceeded):
+        return 'rate_limited'
+    if isinstance(error, requests.RequestException):
+        response = getattr(error, 'response', None)
+        if response is None:
+            return 'network'
+        if response.status_code == 401:
+            return 'unauthorized'
+        return f'http_{response.status_code}'
+    return 'parse_error'
+
+def record_fetch_failure(date_str, endpoint, reason):
+    """Remember a failed fetch so it is not retried before its back-off expires."""
+    base_delay, max_delay = RETRY_BACKOFF.get(reason, DEFAULT_RETRY_BACKOFF)
+    try:
+        next_retry_at = database.record_weather_fetch_failure(date_str, endpoint, reason, base_delay, max_delay)
+        print(f"[Weather] {endpoint} fetch for {date_str} failed ({reason}), next retry at {next_retry_at}")
+    except Exception as e:
+        print(f"[Weather] Could not record fetch failure for {date_str}: {e}")
 
 def get_current_weather():
     """Fetch current weather data from OpenWeatherMap API."""
-    if not API_KEY:
+    if not get_api_key():
         print("Warning: OPENWEATHER_API_KEY not set")
         return None
 
     try:
-        url = f'http://api.openweathermap.org/data/2.5/weather?lat={LAT}&lon={LON}&appid={API_KEY}&units=metric'
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = openweather.get_client().get('/data/2.5/weather', {
+            'lat': get_latitude(), 'lon': get_longitude(), 'appid': get_api_key(), 'units': 'metric'
+        }, endpoint='current')
 
         # Extract relevant weather data
         # Calculate daylight hours from sunrise/sunset
@@ -47,86 +132,232 @@ def get_current_weather():
         return weather_data
     except requests.RequestException as e:
         print(f"Error fetching current weather data: {e}")
+        record_fetch_failure(datetime.now().date().isoformat(), 'current', get_failure_reason(e))
         return None
     except KeyError as e:
         print(f"Error parsing weather data: {e}")
+        record_fetch_failure(datetime.now().date().isoformat(), 'current', get_failure_reason(e))
         return None
 
-def get_forecast_weather(date_str):
-    """Fetch forecast weather data for future dates."""
-    if not API_KEY:
-        print("Warning: OPENWEATHER_API_KEY not set")
-        return None
+def aggregate_forecast_day(date_str, day_forecasts):
+    """Aggregate the 3-hourly forecasts of one day into daily weather data."""
+    # Calculate daily aggregates from hourly forecasts
+    temps = [f['main']['temp'] for f in day_forecasts]
+    humidities = [f['main']['humidity'] for f in day_forecasts]
+    precipitations = [f.get('rain', {}).get('3h', 0) + f.get('snow', {}).get('3h', 0) for f in day_forecasts]
+
+    # Get the most common weather condition
+    weather_conditions = [f['weather'][0]['main'] for f in day_forecasts]
+    most_common_condition = max(set(weather_conditions), key=weather_conditions.count)
+
+    # Get description from first forecast with the most common condition
+    description = next(f['weather'][0]['description'] for f in day_forecasts if f['weather'][0]['main'] == most_common_condition)
+
+    # Calculate estimated daylight hours for forecast date
+    daylight_hours = calculate_daylight_hours(date_str, float(get_latitude()))
+
+    return {
+        'temp_min': min(temps),
+        'temp_max': max(temps),
+        'temp_current': sum(temps) / len(temps),
+        'humidity': sum(humidities) / len(humidities),
+        'pressure': day_forecasts[0]['main']['pressure'],
+        'precipitation': max(precipitations),
+        'weather_main': most_common_condition,
+        'weather_description': description,
+        'wind_speed': sum(f.get('wind', {}).get('speed', 0) for f in day_forecasts) / len(day_forecasts),
+        'clouds': sum(f.get('clouds', {}).get('all', 0) for f in day_forecasts) / len(day_forecasts),
+        'air_pressure': sum(f['main']['pressure'] for f in day_forecasts) / len(day_forecasts),
+        'daylight_hours': daylight_hours,
+        'data_type': 'forecast'
+    }
 
-    try:
-        url = f'http://api.openweathermap.org/data/2.5/forecast?lat={LAT}&lon={LON}&appid={API_KEY}&units=metric'
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+def aggregate_air_pollution(entries):
+    """Aggregate hourly air pollution samples: worst and mean AQI of the day and mean pollutant levels."""
+    aqi_values = [e.get('main', {}).get('aqi', 0) for e in entries]
+    aqi = max(aqi_values)
+
+    def mean_component(name):
+        values = [e.get('components', {}).get(name) for e in entries]
+        values = [v for v in values if v is not None]
+        return round(sum(values) / len(values), 2) if values else 0
+
+    return {
+        'aqi': aqi,
+        'aqi_mean': round(sum(aqi_values) / len(aqi_values), 2),
+        'aqi_description': get_aqi_description(aqi),
+        'pm2_5': mean_component('pm2_5'),
+        'pm10': mean_component('pm10'),
+        'no2': mean_component('no2'),
+        'o3': mean_component('o3'),
+        'co': mean_component('co')
+    }
+
+def group_by_date(entries):
+    """Group timestamped API list entries by local date string."""
+    by_date = {}
+    for entry in entries:
+        date_str = datetime.fromtimestamp(entry['dt']).date().isoformat()
+        by_date.setdefault(date_str, []).append(entry)
+    return by_date
 
-        # Parse the target date
-        target_date = datetime.strptime(date_str, '%Y-%m-%d').date()
+def fetch_forecast_days():
+    """Fetch the 5-day forecast once and aggregate every day it contains."""
+    data = openweather.get_client().get('/data/2.5/forecast', {
+        'lat': get_latitude(), 'lon': get_longitude(), 'appid': get_api_key(), 'units': 'metric'
+    }, endpoint='forecast')
 
-        # Find forecast data for the target date
-        daily_forecasts = {}
-        for forecast in data['list']:
-            forecast_datetime = datetime.fromtimestamp(forecast['dt'])
-            forecast_date = forecast_datetime.date()
+    return {date_str: aggregate_forecast_day(date_str, day_forecasts)
+            for date_str, day_forecasts in group_by_date(data['list']).items()}
 
-            if forecast_date not in daily_forecasts:
-                daily_forecasts[forecast_date] = []
-            daily_forecasts[forecast_date].append(forecast)
+def fetch_air_pollution_forecast_days():
+    """Fetch the air pollution forecast once and aggregate every day it contains."""
+    data = openweather.get_client().get('/data/2.5/air_pollution/forecast', {
+        'lat': get_latitude(), 'lon': get_longitude(), 'appid': get_api_key()
+    }, endpoint='air_pollution_forecast')
 
-        if target_date in daily_forecasts:
-            day_forecasts = daily_forecasts[target_date]
+    return {date_str: aggregate_air_pollution(day_entries)
+            for date_str, day_entries in group_by_date(data['list']).items()}
 
-            # Calculate daily aggregates from hourly forecasts
-            temps = [f['main']['temp'] for f in day_forecasts]
-            humidities = [f['main']['humidity'] for f in day_forecasts]
-            precipitations = [f.get('rain', {}).get('3h', 0) + f.get('snow', {}).get('3h', 0) for f in day_forecasts]
+def fetch_air_pollution_history_days(start_date, end_date):
+    """Fetch hourly air pollution from start_date to end_date (inclusive) in one call.
 
-            # Get the most common weather condition
-            weather_conditions = [f['weather'][0]['main'] for f in day_forecasts]
-            most_common_condition = max(set(weather_conditions), key=weather_conditions.count)
+    Returns {date: daily aggregate} for every day in the range with samples.
+    """
+    start = int(datetime.combine(start_date, datetime.min.time()).timestamp())
+    end = int(datetime.combine(end_date + timedelta(days=1), datetime.min.time()).timestamp()) - 1
+    data = openweather.get_client().get('/data/2.5/air_pollution/history', {
+        'lat': get_latitude(), 'lon': get_longitude(), 'start': start, 'end': end, 'appid': get_api_key()
+    }, endpoint='air_pollution_history')
+
+    first, last = start_date.isoformat(), end_date.isoformat()
+    return {date_str: aggregate_air_pollution(entries)
+            for date_str, entries in group_by_date(data['list']).items() if first <= date_str <= last}
+
+def ingest_air_pollution_history(start_date, end_date):
+    """Backfill daily air pollution for a date range with one request per calendar month.
+
+    All days are written to the weather table in one transaction. A month
+    whose request fails is recorded under its first day and skipped until
+    its back-off expires. Returns {date: daily aggregate} for the stored days.
+    """
+    if not get_api_key():
+        print("ERROR: OPENWEATHER_API_KEY not set - Air Quality data unavailable")
+        return {}
+
+    days = {}
+    month_start = start_date
+    while month_start <= end_date:
+        month_end = min(month_start.replace(day=calendar.monthrange(month_start.year, month_start.month)[1]),
+                        end_date)
+        block_date = month_start.replace(day=1).isoformat()
+
+        if not is_fetch_blocked(block_date, 'air_pollution_history'):
+            try:
+                month_days = fetch_air_pollution_history_days(month_start, month_end)
+                print(f"[AQI] Got {len(month_days)} days of air pollution history for {month_start} to {month_end}")
+                days.update(month_days)
+                database.clear_weather_fetch_failures(block_date, 'air_pollution_history')
+            except (requests.RequestException, KeyError, ValueError, TypeError) as e:
+                print(f"[AQI] ERROR: Failed to get air pollution history for {month_start} to {month_end}: {e}")
+                record_fetch_failure(block_date, 'air_pollution_history', get_failure_reason(e))
+
+        month_start = month_end + timedelta(days=1)
+
+    database.store_air_pollution_batch(days)
+    return days
+
+def get_cached_forecast(name, fetch):
+    """Get a forecast payload, fetching it at most once per forecast TTL.
+
+    Returns (days, fetched_now).
+    """
+    with _forecast_lock:
+        cached = _forecast_cache.get(name)
+        if cached and time.monotonic() - cached['fetched_at'] < get_weather_ttl('forecast'):
+            return cached['days'], False
 
-            # Get description from first forecast with the most common condition
-            description = next(f['weather'][0]['description'] for f in day_forecasts if f['weather'][0]['main'] == most_common_condition)
+        days = fetch()
+        _forecast_cache[name] = {'fetched_at': time.monotonic(), 'days': days}
+        return days, True
 
-            # Calculate estimated daylight hours for forecast date
-            daylight_hours = calculate_daylight_hours(date_str, float(LAT))
+def ingest_forecast():
+    """Fetch both forecast endpoints once and store every future day they cover.
 
-            weather_data = {
-                'temp_min': min(temps),
-                'temp_max': max(temps),
-                'temp_current': sum(temps) / len(temps),
-                'humidity': sum(humidities) / len(humidities),
-                'pressure': day_forecasts[0]['main']['pressure'],
-                'precipitation': max(precipitations),
-                'weather_main': most_common_condition,
-                'weather_description': description,
-                'wind_speed': sum(f.get('wind', {}).get('speed', 0) for f in day_forecasts) / len(day_forecasts),
-                'clouds': sum(f.get('clouds', {}).get('all', 0) for f in day_forecasts) / len(day_forecasts),
-                'air_pressure': sum(f['main']['pressure'] for f in day_forecasts) / len(day_forecasts),
-                'daylight_hours': daylight_hours,
-                'data_type': 'forecast'
-            }
-            return weather_data
+    All days are written to the weather table in one batch whenever either
+    forecast was refetched. Weather fetch errors propagate; a failed air
+    pollution forecast only leaves the AQI fields empty.
+    """
+    weather_days, weather_fetched = get_cached_forecast('weather', fetch_forecast_days)
+
+    today = datetime.now().date().isoformat()
+    air_days, air_fetched = {}, False
+    if not is_fetch_blocked(today, 'air_pollution_forecast'):
+        try:
+            air_days, air_fetched = get_cached_forecast('air_pollution', fetch_air_pollution_forecast_days)
+        except (requests.RequestException, KeyError, ValueError, IndexError) as e:
+            print(f"[AQI] ERROR: Failed to get air pollution forecast: {e}")
+            record_fetch_failure(today, 'air_pollution_forecast', get_failure_reason(e))
+
+    days = {}
+    for date_str, weather_data in weather_days.items():
+        if date_str <= today:
+            continue  # Today uses the current weather endpoint
+        day = dict(weather_data)
+        day.update(air_days.get(date_str) or AQI_UNAVAILABLE)
+        days[date_str] = day
+
+    if weather_fetched or air_fetched:
+        print(f"[Weather] Storing forecast for {len(days)} days")
+        database.store_weather_data_batch(days)
+    return days
+
+def get_forecast_weather(date_str):
+    """Fetch forecast weather data for future dates."""
+    if not get_api_key():
+        print("Warning: OPENWEATHER_API_KEY not set")
+        return None
+
+    try:
+        days = ingest_forecast()
+        if date_str in days:
+            return dict(days[date_str])
         else:
             print(f"No forecast data available for {date_str}")
+            record_fetch_failure(date_str, 'forecast', 'no_data')
             return None
 
     except requests.RequestException as e:
         print(f"Error fetching forecast weather data for {date_str}: {e}")
+        record_fetch_failure(date_str, 'forecast', get_failure_reason(e))
         return None
     except (KeyError, ValueError, IndexError) as e:
         print(f"Error parsing forecast weather data for {date_str}: {e}")
+        record_fetch_failure(date_str, 'forecast', get_failure_reason(e))
         return None
 
+def is_weather_stale(weather_data, date_str):
+    """Check whether stored weather for today or a future date has outlived its TTL.
+
+    Past dates never go stale, but rows holding only backfilled air pollution
+    still need their weather fetched.
+    """
+    if weather_data.get('data_type') == 'air_pollution':
+        return True
+    if date_str < datetime.now().date().isoformat():
+        return False
+
+    fetched_at = weather_data.get('fetched_at')
+    if not fetched_at:
+        return True
+    ttl = get_weather_ttl(weather_data.get('data_type'))
+    return (datetime.now() - datetime.fromisoformat(fetched_at)).total_seconds() > ttl
+
 def get_historical_weather(date_str):
     """Fetch historical weather data for a specific date (YYYY-MM-DD format).
     Note: Historical weather data requires OpenWeather subscription for dates older than 5 days.
     """
-    if not API_KEY:
+    if not get_api_key():
         print("Warning: OPENWEATHER_API_KEY not set")
         return None
 
@@ -142,14 +373,14 @@ def get_historical_weather(date_str):
 
         # For dates more than 5 days ago, try the paid historical API
         if days_ago > 5:
-            url = f'http://api.openweathermap.org/data/3.0/onecall/timemachine?lat={LAT}&lon={LON}&dt={timestamp}&appid={API_KEY}&units=metric'
+            path = '/data/3.0/onecall/timemachine'
         else:
             # For recent dates (within 5 days), use the free tier One Call API
-            url = f'http://api.openweathermap.org/data/2.5/onecall/timemachine?lat={LAT}&lon={LON}&dt={timestamp}&appid={API_KEY}&units=metric'
+            path = '/data/2.5/onecall/timemachine'
 
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
+        data = openweather.get_client().get(path, {
+            'lat': get_latitude(), 'lon': get_longitude(), 'dt': timestamp, 'appid': get_api_key(), 'units': 'metric'
+        }, endpoint='historical')
 
         # Extract weather data from historical API response
         if 'data' in data and len(data['data']) > 0:
@@ -164,10 +395,10 @@ def get_historical_weather(date_str):
                 else:
                     temp_min = temp_max = temp_current = day_data['temp']
             else:
-                temp_min = temp_max = temp_current = 0
+                temp_min = temp_max = temp_current = None
 
             # Calculate daylight hours for historical date
-            daylight_hours = calculate_daylight_hours(date_str, float(LAT))
+            daylight_hours = calculate_daylight_hours(date_str, float(get_latitude()))
 
             weather_data = {
                 'temp_min': temp_min,
@@ -187,6 +418,7 @@ def get_historical_weather(date_str):
             return weather_data
         else:
             print(f"No historical weather data available for {date_str}")
+            record_fetch_failure(date_str, 'historical', 'no_data')
             return None
 
     except requests.RequestException as e:
@@ -194,55 +426,89 @@ def get_historical_weather(date_str):
             print(f"Historical weather data requires OpenWeather subscription for {date_str}")
         else:
             print(f"Error fetching historical weather data for {date_str}: {e}")
+        record_fetch_failure(date_str, 'historical', get_failure_reason(e))
         return None
     except (KeyError, ValueError, IndexError) as e:
         print(f"Error parsing historical weather data for {date_str}: {e}")
+        record_fetch_failure(date_str, 'historical', get_failure_reason(e))
+        return None
+
+def is_fetch_blocked(date_str, endpoint):
+    """Check whether a fetch is still backing off after an earlier failure."""
+    try:
+        block = database.get_weather_fetch_block(date_str, endpoint)
+    except Exception as e:
+        print(f"[Weather] Could not read fetch status for {date_str}: {e}")
+        return False
+
+    if block:
+        print(f"[Weather] Skipping {endpoint} fetch for {date_str} until {block['next_retry_at']} "
+              f"({block['reason']}, {block['failures']} failures)")
+        return True
+    return False
+
+def get_endpoint_for_date(date_str):
+    """Get the API endpoint serving a date, or None if it is too far in the future.
+
+    Future dates use the forecast (next 5 days), today the current weather
+    and past dates the historical API. Raises ValueError for a bad date.
+    """
+    days_diff = (datetime.strptime(date_str, '%Y-%m-%d').date() - datetime.now().date()).days
+    if days_diff > 5:
         return None
+    if days_diff > 0:
+        return 'forecast'
+    if days_diff == 0:
+        return 'current'
+    return 'historical'
 
 def get_weather_for_date(date_str):
     """Get weather data for any date, using appropriate API based on date."""
     try:
-        date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-        today = datetime.now().date()
-        target_date = date_obj.date()
-        days_diff = (target_date - today).days
-
-        print(f"[Weather] Getting weather data for {date_str} (days diff: {days_diff})")
+        endpoint = get_endpoint_for_date(date_str)
+        print(f"[Weather] Getting weather data for {date_str} ({endpoint})")
         
+        if endpoint is None:
+            print(f"[Weather] Forecast not available for {date_str} (too far in future)")
+            return None
+
+        # Don't hit the network again for a fetch that recently failed
+        if is_fetch_blocked(date_str, endpoint):
+            return None
+
         weather_data = None
-        if days_diff > 0:
-            # Future date - get forecast (only available for next 5 days)
-            if days_diff <= 5:
-                weather_data = get_forecast_weather(date_str)
-            else:
-                print(f"[Weather] Forecast not available for {date_str} (too far in future)")
-                return None
-        elif days_diff == 0:
-            # Today - get current weather
+        if endpoint == 'forecast':
+            weather_data = get_forecast_weather(date_str)
+        elif endpoint == 'current':
             weather_data = get_current_weather()
         else:
-            # Past date - get historical weather
             weather_data = get_historical_weather(date_str)
 
+        # The shared forecast already carries air pollution data
+        if weather_data and endpoint == 'forecast':
+            database.clear_weather_fetch_failures(date_str, endpoint)
+            return weather_data
+
         # Add air pollution data if weather data was successfully retrieved
         if weather_data:
+            database.clear_weather_fetch_failures(date_str, endpoint)
             print(f"[Weather] Successfully retrieved weather data for {date_str}, now fetching air pollution")
-            air_pollution = get_air_pollution_for_date(date_str)
+            air_pollution = None
+            # Past days may already have air pollution from the range backfill
+            stored = database.get_weather_data(date_str) if endpoint == 'historical' else None
+            if stored and stored.get('aqi') is not None:
+                air_pollution = {field: stored[field] for field in AQI_UNAVAILABLE}
+            elif not is_fetch_blocked(date_str, 'air_pollution'):
+                air_pollution = get_air_pollution_for_date(date_str)
+                if air_pollution:
+                    database.clear_weather_fetch_failures(date_str, 'air_pollution')
             if air_pollution:
                 print(f"[Weather] Successfully retrieved air pollution data for {date_str}")
                 weather_data.update(air_pollution)
             else:
                 print(f"[Weather] Failed to get air pollution data for {date_str}")
                 # Make sure the AQI fields exist but are explicitly None rather than missing
-                weather_data.update({
-                    'aqi': None,
-                    'aqi_description': 'Data Unavailable',
-                    'pm2_5': None,
-                    'pm10': None,
-                    'no2': None,
-                    'o3': None,
-                    'co': None
-                })
+                weather_data.update(AQI_UNAVAILABLE)
 
         return weather_data
 
@@ -250,11 +516,112 @@ def get_weather_for_date(date_str):
         print(f"[Weather] Invalid date format: {date_str}")
         return None
 
+def get_fetch_executor():
+    """Get the shared weather fetch pool, sized from WEATHER_FETCH_WORKERS on first use."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=int(os.getenv('WEATHER_FETCH_WORKERS', '4')),
+                                               thread_name_prefix='weather-fetch')
+    return _executor
+
+def get_flights():
+    """Get the shared single-flight group, using SINGLE_FLIGHT_MODE on first use."""
+    global _flights
+    if _flights is None:
+        with _flights_lock:
+            if _flights is None:
+                _flights = singleflight.SingleFlight(
+                    singleflight.get_process_lock(os.getenv('SINGLE_FLIGHT_MODE', 'thread')))
+    return _flights
+
+def get_fresh_stored_weather(date_str):
+    """Get stored weather for a date unless it is missing or stale."""
+    stored = database.get_weather_data(date_str)
+    if stored and not is_weather_stale(stored, date_str):
+        return stored
+    return None
+
+def _fetch_and_store_weather(date_str, endpoint):
+    """Fetch weather for a date and store it."""
+    weather_data = get_weather_for_date(date_str)
+    # Forecast days are already stored by ingest_forecast
+    if weather_data and endpoint != 'forecast':
+        database.store_weather_data(date_str, weather_data)
+    return weather_data
+
+def fetch_and_store_weather(date_str):
+    """Fetch and store weather for a date, sharing one fetch among concurrent callers.
+
+    Calls are keyed by (location, date, endpoint); a caller that finds fresh
+    weather stored by a fetch that just finished uses it without fetching.
+    Returns the weather data or None.
+    """
+    try:
+        endpoint = get_endpoint_for_date(date_str)
+    except ValueError:
+        print(f"[Weather] Invalid date format: {date_str}")
+        return None
+
+    return get_flights().do(
+        (get_latitude(), get_longitude(), date_str, endpoint),
+        lambda: _fetch_and_store_weather(date_str, endpoint),
+        recheck=lambda: get_fresh_stored_weather(date_str))
+
+def log_late_result(date_str, future):
+    """Log a fetch that finished after its caller stopped waiting."""
+    try:
+        if future.result():
+            print(f"[Weather] Stored late weather data for {date_str}")
+    except Exception as e:
+        print(f"[Weather] Background fetch for {date_str} failed: {e}")
+
+def get_weather_for_dates(date_strs, timeout=None):
+    """Fetch and store weather for many dates concurrently on a bounded thread pool.
+
+    Waits at most timeout seconds (WEATHER_FETCH_DEADLINE by default) and
+    returns {date: weather_data} for the fetches that finished in time. The
+    rest keep running in the background; every fetch stores its own result.
+    """
+    if not date_strs:
+        return {}
+    if timeout is None:
+        timeout = float(os.getenv('WEATHER_FETCH_DEADLINE', '8'))
+
+    executor = get_fetch_executor()
+    futures = {executor.submit(fetch_and_store_weather, date_str): date_str for date_str in date_strs}
+    done, pending = wait(futures, timeout=timeout)
+
+    results = {}
+    for future in done:
+        date_str = futures[future]
+        try:
+            weather_data = future.result()
+        except Exception as e:
+            print(f"[Weather] Fetch for {date_str} failed: {e}")
+            continue
+        if weather_data:
+            results[date_str] = weather_data
+
+    if pending:
+        print(f"[Weather] {len(pending)} fetches still running after {timeout}s, finishing in background")
+    for future in pending:
+        future.add_done_callback(lambda f, date_str=futures[future]: log_late_result(date_str, f))
+
+    return results
+
 def format_weather_summary(weather_data):
     """Format weather data into a human-readable summary."""
     if not weather_data:
         return "Weather data unavailable"
     
+    # Backfilled air pollution whose weather was never fetched: only the AQI is known
+    if weather_data.get('data_type') == 'air_pollution':
+        if weather_data.get('aqi') and weather_data.get('aqi_description'):
+            return f"{get_aqi_emoji(weather_data['aqi'])} {weather_data['aqi_description']} air"
+        return "Weather data unavailable"
+    
     temp_min = weather_data.get('temp_min', 0) or 0
     temp_max = weather_data.get('temp_max', 0) or 0
     temp_range = f"{temp_min:.1f}°C - {temp_max:.1f}°C"
@@ -325,77 +692,13 @@ def is_future_date(date_str):
 def calculate_moon_phase(date_str):
     """Calculate moon phase for a given date."""
     try:
-        date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-
-        # Known new moon date as reference (January 6, 2000)
-        known_new_moon = datetime(2000, 1, 6, 18, 14)
-
-        # Calculate days since known new moon
-        days_since = (date_obj - known_new_moon).total_seconds() / (24 * 3600)
-
-        # Moon cycle is approximately 29.53 days
-        moon_cycle = 29.530588853
-
-        # Calculate current position in cycle (0-1)
-        cycle_position = (days_since % moon_cycle) / moon_cycle
-
-        # Calculate illumination percentage
-        if cycle_position <= 0.5:
-            # Waxing (0 to 100%)
-            illumination = cycle_position * 2 * 100
-        else:
-            # Waning (100% to 0%)
-            illumination = (1 - cycle_position) * 2 * 100
-
-        # Determine phase name based on cycle position
-        if cycle_position < 0.0625:
-            phase_name = "New Moon"
-            phase_emoji = "🌑"
-        elif cycle_position < 0.1875:
-            phase_name = "Waxing Crescent"
-            phase_emoji = "🌒"
-        elif cycle_position < 0.3125:
-            phase_name = "First Quarter"
-            phase_emoji = "🌓"
-        elif cycle_position < 0.4375:
-            phase_name = "Waxing Gibbous"
-            phase_emoji = "🌔"
-        elif cycle_position < 0.5625:
-            phase_name = "Full Moon"
-            phase_emoji = "🌕"
-        elif cycle_position < 0.6875:
-            phase_name = "Waning Gibbous"
-            phase_emoji = "🌖"
-        elif cycle_position < 0.8125:
-            phase_name = "Last Quarter"
-            phase_emoji = "🌗"
-        else:
-            phase_name = "Waning Crescent"
-            phase_emoji = "🌘"
-
-        return {
-            'phase_name': phase_name,
-            'phase_emoji': phase_emoji,
-            'illumination_percent': round(illumination, 1),
-            'cycle_position': cycle_position
-        }
-
+        return astronomy.moon_phases(date_str, date_str)[0][1]
     except ValueError:
         return None
 
 def get_moon_phase_emoji(phase_name):
     """Get emoji for moon phase."""
-    phase_emojis = {
-        'New Moon': '🌑',
-        'Waxing Crescent': '🌒',
-        'First Quarter': '🌓',
-        'Waxing Gibbous': '🌔',
-        'Full Moon': '🌕',
-        'Waning Gibbous': '🌖',
-        'Last Quarter': '🌗',
-        'Waning Crescent': '🌘'
-    }
-    return phase_emojis.get(phase_name, '🌙')
+    return astronomy.PHASE_EMOJIS.get(phase_name, '🌙')
 
 def is_historical_date(date_str):
     """Check if a date is in the past."""
@@ -408,7 +711,7 @@ def is_historical_date(date_str):
 
 def get_air_pollution_for_date(date_str):
     """Get air pollution data for a specific date."""
-    if not API_KEY:
+    if not get_api_key():
         print("ERROR: OPENWEATHER_API_KEY not set - Air Quality data unavailable")
         return None
 
@@ -420,67 +723,51 @@ def get_air_pollution_for_date(date_str):
 
         print(f"[AQI] Fetching air pollution data for {date_str} (days diff: {days_diff})")
         
+        if days_diff > 0 and days_diff <= 5:
+            # Forecast air pollution (available for next 5 days) comes from the shared forecast
+            air_days, _ = get_cached_forecast('air_pollution', fetch_air_pollution_forecast_days)
+            if date_str in air_days:
+                return dict(air_days[date_str])
+            print(f"[AQI] ERROR: No forecast air pollution data for {date_str}")
+            record_fetch_failure(date_str, 'air_pollution', 'no_data')
+            return None
+
         if days_diff == 0:
             # Current air pollution
             endpoint_type = "current"
-            url = f'http://api.openweathermap.org/data/2.5/air_pollution?lat={LAT}&lon={LON}&appid={API_KEY}'
-        elif days_diff > 0 and days_diff <= 5:
-            # Forecast air pollution (available for next 5 days)
-            endpoint_type = "forecast"
-            url = f'http://api.openweathermap.org/data/2.5/air_pollution/forecast?lat={LAT}&lon={LON}&appid={API_KEY}'
+            path = '/data/2.5/air_pollution'
+            params = {'lat': get_latitude(), 'lon': get_longitude(), 'appid': get_api_key()}
         else:
             # Historical air pollution (requires paid plan for dates > 5 days ago)
-            # Use current date timestamp at noon for historical data
+            # Request the whole day so the daily aggregate covers every hour
             endpoint_type = "historical"
-            timestamp = int(date_obj.replace(hour=12).timestamp())
-            url = f'http://api.openweathermap.org/data/2.5/air_pollution/history?lat={LAT}&lon={LON}&start={timestamp}&end={timestamp}&appid={API_KEY}'
+            start = int(date_obj.timestamp())
+            path = '/data/2.5/air_pollution/history'
+            params = {'lat': get_latitude(), 'lon': get_longitude(),
+                      'start': start, 'end': start + 24 * 3600 - 1, 'appid': get_api_key()}
         
         print(f"[AQI] Using {endpoint_type} endpoint for {date_str}")
         
-        # Remove API key from URL for logging purposes
-        log_url = url.split('appid=')[0] + 'appid=***'
-        print(f"[AQI] Requesting URL: {log_url}")
+        # Leave the API key out of the log
+        print(f"[AQI] Requesting {path} with start={params.get('start')} end={params.get('end')}")
         
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        
-        print(f"[AQI] Response status code: {response.status_code}")
+        data = openweather.get_client().get(path, params, endpoint=f'air_pollution_{endpoint_type}')
         
         if 'list' in data:
             print(f"[AQI] Found {len(data['list'])} pollution entries in response")
             
             if len(data['list']) > 0:
-                pollution_data = data['list'][0]  # Get first entry
-                
-                # For forecast data, find the entry closest to the target date
-                if days_diff > 0 and days_diff <= 5:
-                    target_timestamp = date_obj.replace(hour=12).timestamp()
-                    closest_entry = min(data['list'], 
-                                       key=lambda x: abs(x['dt'] - target_timestamp))
-                    pollution_data = closest_entry
-                    print(f"[AQI] Selected forecast entry with timestamp: {datetime.fromtimestamp(closest_entry['dt'])}")
-
-                aqi = pollution_data.get('main', {}).get('aqi', 0)
-                components = pollution_data.get('components', {})
-                
-                print(f"[AQI] Successfully parsed AQI: {aqi}, Components: {', '.join([f'{k}={v}' for k, v in components.items()])}")
-                
-                return {
-                    'aqi': aqi,
-                    'aqi_description': get_aqi_description(aqi),
-                    'pm2_5': components.get('pm2_5', 0),
-                    'pm10': components.get('pm10', 0),
-                    'no2': components.get('no2', 0),
-                    'o3': components.get('o3', 0),
-                    'co': components.get('co', 0)
-                }
+                air_pollution = aggregate_air_pollution(data['list'])
+                print(f"[AQI] Successfully parsed AQI: {air_pollution['aqi']} (mean {air_pollution['aqi_mean']})")
+                return air_pollution
             else:
                 print(f"[AQI] ERROR: Empty pollution data list for {date_str}")
+                record_fetch_failure(date_str, 'air_pollution', 'no_data')
                 return None
         else:
             print(f"[AQI] ERROR: No 'list' field in API response for {date_str}")
             print(f"[AQI] Response content: {data}")
+            record_fetch_failure(date_str, 'air_pollution', 'no_data')
             return None
 
     except requests.RequestException as e:
@@ -489,11 +776,13 @@ def get_air_pollution_for_date(date_str):
         else:
             print(f"[AQI] ERROR: Request failed for {date_str}: {e}")
             print(f"[AQI] Consider checking if your API key has access to the Air Pollution API")
+        record_fetch_failure(date_str, 'air_pollution', get_failure_reason(e))
         return None
     except (KeyError, ValueError, IndexError) as e:
         print(f"[AQI] ERROR: Failed to parse air pollution data for {date_str}: {e}")
         import traceback
         print(f"[AQI] Traceback: {traceback.format_exc()}")
+        record_fetch_failure(date_str, 'air_pollution', get_failure_reason(e))
         return None
 
 def get_aqi_description(aqi):
@@ -521,32 +810,7 @@ def get_aqi_emoji(aqi):
 def calculate_daylight_hours(date_str, latitude):
     """Calculate daylight hours for a given date and latitude."""
     try:
-        date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-        
-        # Day of year
-        day_of_year = date_obj.timetuple().tm_yday
-        
-        # Solar declination angle
-        declination = 23.45 * math.sin(math.radians(360 * (284 + day_of_year) / 365))
-        
-        # Hour angle
-        lat_rad = math.radians(latitude)
-        decl_rad = math.radians(declination)
-        
-        # Calculate sunrise hour angle
-        cos_hour_angle = -math.tan(lat_rad) * math.tan(decl_rad)
-        
-        # Check for polar day or polar night
-        if cos_hour_angle > 1:
-            return 0  # Polar night
-        elif cos_hour_angle < -1:
-            return 24  # Polar day
-        
-        hour_angle = math.degrees(math.acos(cos_hour_angle))
-        daylight_hours = 2 * hour_angle / 15  # Convert to hours
-        
-        return round(daylight_hours, 2)
-        
-    except (ValueError, ZeroDivisionError) as e:
+        return astronomy.daylight_hours(date_str, latitude)
+    except ValueError as e:
         print(f"Error calculating daylight hours for {date_str}: {e}")
         return 0
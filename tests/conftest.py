@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+# The app modules import each other by flat name, as when run from app/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'app'))
+
+# Requests to the app must not start the real background scheduler
+os.environ['SCHEDULER_ENABLED'] = 'false'
+
+import database
+import migrations
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """Point the database module at a fresh SQLite file with every migration applied."""
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'health.db'))
+    database.close_thread_connection()
+    database.config_cache.clear()
+    conn = database.get_db_connection()
+    migrations.migrate(conn)
+    yield conn
+    database.close_thread_connection()
+    database.config_cache.clear()
@@ -0,0 +1,38 @@
+import database
+
+def aggregates_for(date_str):
+    """Get the aggregate rows of one day by entry type."""
+    return database.get_daily_aggregates(date_str, date_str).get(date_str, {})
+
+def test_refresh_follows_adds_replaces_and_deletes(db):
+    database.add_timeline_entries([
+        ('2024-03-01 08:00:00', 'mood', 2, None, None),
+        ('2024-03-01 20:00:00', 'mood', 4, None, None),
+        ('2024-03-01 09:00:00', 'caffeine', 1, None, None),
+        ('2024-03-01 10:00:00', 'notes', None, 'text only', None)
+    ])
+    mood = aggregates_for('2024-03-01')['mood']
+    assert (mood['count'], mood['sum'], mood['min'], mood['max']) == (2, 6, 2, 4)
+    assert (mood['first_value'], mood['last_value']) == (2, 4)
+    assert mood['avg'] == 3
+    assert 'notes' not in aggregates_for('2024-03-01')
+
+    # Replacing the latest entry updates the last value
+    database.add_timeline_entry('2024-03-01 20:00:00', 'mood', 5)
+    mood = aggregates_for('2024-03-01')['mood']
+    assert (mood['count'], mood['sum'], mood['last_value']) == (2, 7, 5)
+
+    database.delete_timeline_entry('2024-03-01 08:00:00', 'mood')
+    database.delete_timeline_entry('2024-03-01 20:00:00', 'mood')
+    assert 'mood' not in aggregates_for('2024-03-01')
+    assert aggregates_for('2024-03-01')['caffeine']['sum'] == 1
+
+def test_rebuild_matches_incremental_refresh(db):
+    database.add_timeline_entries([
+        (f'2024-03-{day:02d} {hour:02d}:00:00', 'energy', (day * hour) % 5 + 1, None, None)
+        for day in range(1, 11) for hour in (8, 13, 19)
+    ])
+    incremental = database.get_daily_aggregates('2024-03-01', '2024-03-31')
+
+    database.rebuild_daily_aggregates()
+    assert database.get_daily_aggregates('2024-03-01', '2024-03-31') == incremental
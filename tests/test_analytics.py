@@ -0,0 +1,101 @@
+import math
+from datetime import date
+
+import pytest
+
+import analytics
+import database
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    """Drop results cached for databases of earlier tests."""
+    analytics.correlation_cache.clear()
+    analytics.series_cache.clear()
+
+def test_pearson_of_a_known_sample():
+    assert analytics.pearson([1, 2, 3, 4, 5], [2, 4, 5, 4, 5]) == pytest.approx(0.7745967)
+    assert analytics.pearson([1, 2, 3], [3, 2, 1]) == pytest.approx(-1)
+
+def test_pearson_is_undefined_for_short_or_constant_series():
+    assert analytics.pearson([1, 2], [1, 2]) is None
+    assert analytics.pearson([1, 2, 3], [4, 4, 4]) is None
+
+def test_spearman_uses_average_ranks_for_ties():
+    assert analytics.rank([3, 1, 3, 2]) == [3.5, 1, 3.5, 2]
+    # Monotonic but not linear
+    xs = [1, 2, 3, 4, 5, 6]
+    ys = [x ** 3 for x in xs]
+    assert analytics.spearman(xs, ys) == pytest.approx(1)
+    assert analytics.pearson(xs, ys) < 1
+
+def test_fisher_confidence_interval():
+    low, high = analytics.confidence_interval(0.5, 50)
+    assert (low, high) == (pytest.approx(0.2575, abs=1e-4), pytest.approx(0.6833, abs=1e-4))
+    assert analytics.confidence_interval(0.5, 3) is None
+
+def test_correlations_are_recomputed_after_a_write(db):
+    database.add_timeline_entries([(f'2024-03-{day:02d} 09:00:00', 'mood', day % 5 + 1, None, None)
+                                   for day in range(1, 21)])
+    database.store_weather_data_batch({f'2024-03-{day:02d}': {'temp_min': 1, 'temp_max': day % 5 + 1}
+                                       for day in range(1, 21)})
+    pairs = [('temperature', 'avg_mood')]
+
+    first = analytics.get_correlations(date(2024, 3, 1), date(2024, 3, 31), 'day', pairs)[0]
+    assert first['n'] == 20
+    assert first['pearson']['r'] == pytest.approx(1)
+
+    database.add_timeline_entry('2024-03-21 09:00:00', 'mood', 3)
+    database.store_weather_data('2024-03-21', {'temp_min': 1, 'temp_max': 9})
+    assert analytics.get_correlations(date(2024, 3, 1), date(2024, 3, 31), 'day', pairs)[0]['n'] == 21
+
+def test_sleep_quality_is_the_first_of_the_day(db):
+    database.add_timeline_entries([
+        ('2024-03-01 08:00:00', 'sleep_quality', 2, None, None),
+        ('2024-03-01 21:00:00', 'sleep_quality', 5, None, None)
+    ])
+    assert analytics.query_series(date(2024, 3, 1), date(2024, 3, 1))[0]['sleep_quality'] == 2
+    assert analytics.get_daily_values('sleep_quality', date(2024, 3, 1), date(2024, 3, 1))[0] == 2
+
+def test_sub_zero_temperatures_are_kept(db):
+    database.store_weather_data_batch({'2024-01-01': {'temp_min': -5, 'temp_max': -1},
+                                       '2024-01-02': {'humidity': 80}})
+    series = analytics.query_series(date(2024, 1, 1), date(2024, 1, 2))
+    values = analytics.get_daily_values('temperature', date(2024, 1, 1), date(2024, 1, 2))
+
+    assert [row['temperature'] for row in series] == [-3, None]
+    assert values[0] == -3 and math.isnan(values[1])
+
+def test_unknown_metric_is_rejected():
+    with pytest.raises(ValueError):
+        analytics.get_correlations(date(2024, 3, 1), date(2024, 3, 31), pairs=[('mood', 'luck')])
+
+def test_lttb_keeps_ends_and_extremes():
+    points = [(x, 0) for x in range(1000)]
+    points[500] = (500, 100)
+    points[700] = (700, -50)
+
+    sampled = analytics.lttb(points, 50)
+    assert len(sampled) == 50
+    assert sampled[0] == (0, 0) and sampled[-1] == (999, 0)
+    assert (500, 100) in sampled and (700, -50) in sampled
+    assert [x for x, _ in sampled] == sorted(x for x, _ in sampled)
+
+def test_lttb_returns_short_series_unchanged():
+    points = [(x, x * x) for x in range(10)]
+    assert analytics.lttb(points, 20) == points
+
+def test_downsampled_series_fits_the_point_budget(db):
+    database.set_setting('birth_date', '1990-05-05')
+    database.add_timeline_entries([(f'{day.isoformat()} 09:00:00', 'mood', day.day % 5 + 1, None, None)
+                                   for day in map(date.fromordinal, range(date(2016, 1, 1).toordinal(),
+                                                                          date(2025, 12, 31).toordinal() + 1))])
+
+    result = analytics.get_downsampled_series(date(2016, 1, 1), date(2025, 12, 31), points=200,
+                                              metrics=['avg_mood', 'biorhythm_physical'])
+    assert result['granularity'] == 'month'
+    assert len(result['series']['avg_mood']) == 120
+    # Biorhythms come from the daily cycles, reduced to the point budget
+    physical = result['series']['biorhythm_physical']
+    assert len(physical) == 200
+    assert physical[0][0] == '2016-01-01' and physical[-1][0] == '2025-12-31'
+    assert max(value for _, value in physical) == pytest.approx(1, abs=0.01)
@@ -0,0 +1,21 @@
+from datetime import date
+
+import astronomy
+import database
+
+def test_range_outside_window_is_computed_not_stored(db):
+    window = (date(2020, 1, 1), date(2020, 1, 10))
+    days = astronomy.get_range(date(2019, 12, 27), date(2020, 1, 15), 52.0, window)
+
+    assert [day['date'] for day in days][0] == '2019-12-27'
+    assert len(days) == 20
+    assert database.count_moon_phases('2019-01-01', '2021-01-01') == 10
+    expected = dict(astronomy.moon_phases(date(2019, 12, 27), date(2020, 1, 15)))
+    assert all(day['phase_name'] == expected[day['date']]['phase_name'] for day in days)
+
+def test_api_rejects_ranges_above_cap(db):
+    import app as appmod
+
+    response = appmod.app.test_client().get('/api/astronomy?start_date=0001-01-01&end_date=9999-12-31')
+    assert response.status_code == 400
+    assert database.count_moon_phases('0001-01-01', '9999-12-31') == 0
@@ -0,0 +1,39 @@
+from datetime import date, timedelta
+
+import biorhythm
+import database
+
+def test_event_horizon_is_read_when_indexing(db, monkeypatch):
+    monkeypatch.setenv('BIORHYTHM_EVENT_HORIZON_DAYS', '30')
+    birth_date = date(1990, 5, 5)
+    biorhythm.ensure_event_index(birth_date)
+
+    start, end = database.get_biorhythm_event_span(birth_date.isoformat())
+    assert start == birth_date.isoformat()
+    assert end == (date.today() + timedelta(days=30)).isoformat()
+
+def test_stored_span_is_only_extended(db, monkeypatch):
+    birth_date = date(1990, 5, 5)
+    database.set_setting('birth_date', birth_date.isoformat())
+    monkeypatch.setenv('BIORHYTHM_EVENT_HORIZON_DAYS', '30')
+    biorhythm.ensure_event_index(birth_date)
+    span = database.get_biorhythm_event_span(birth_date.isoformat())
+
+    # Queries before birth or far past the horizon are computed, not indexed
+    monkeypatch.setenv('BIORHYTHM_EVENT_HORIZON_DAYS', '10')
+    before_birth = biorhythm.get_biorhythm_events(date(1990, 4, 1), date(1990, 6, 1))
+    far_future = biorhythm.get_biorhythm_events(date(9998, 1, 1), date(9999, 12, 31), 'critical', 2)
+    assert database.get_biorhythm_event_span(birth_date.isoformat()) == span
+
+    expected = biorhythm.compute_events(birth_date, date(1990, 4, 1), date(1990, 6, 1))
+    assert [(e['date'], e['cycle'], e['event'], e['cycle_count']) for e in before_birth] == \
+        sorted(expected, key=lambda row: (row[0], row[3], row[1]))
+    assert far_future and all(e['event'] == 'critical' and e['cycle_count'] >= 2 for e in far_future)
+
+def test_api_rejects_ranges_above_cap(db):
+    import app as appmod
+
+    database.set_setting('birth_date', '1990-05-05')
+    response = appmod.app.test_client().get('/api/biorhythm/events?start_date=1990-01-01&end_date=9999-12-31')
+    assert response.status_code == 400
+    assert database.get_biorhythm_event_span('1990-05-05') is None
@@ -0,0 +1,23 @@
+import database
+
+def query_plans(conn, call):
+    """Run call and get the EXPLAIN QUERY PLAN details of every SELECT it executed."""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        call()
+    finally:
+        conn.set_trace_callback(None)
+
+    return [' '.join(row['detail'] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}'))
+            for sql in statements if sql.lstrip().upper().startswith('SELECT')]
+
+def test_timeline_range_uses_date_index(db):
+    plans = query_plans(db, lambda: database.get_timeline_data('2024-01-01', '2024-01-31'))
+    assert plans
+    assert all('USING INDEX idx_timeline_entries_date_type' in plan for plan in plans)
+
+def test_day_entries_use_date_index(db):
+    plans = query_plans(db, lambda: database.get_day_entries('2024-01-15'))
+    assert plans
+    assert all('USING INDEX idx_timeline_entries_date_type' in plan for plan in plans)
@@ -0,0 +1,52 @@
+import csv
+import io
+import json
+
+import database
+import export
+
+def add_entries(days):
+    """Add mood, caffeine and notes entries for the first days of March 2024."""
+    database.add_timeline_entries([
+        (f'2024-03-{day:02d} {hour:02d}:00:00', entry_type, value, text, None)
+        for day in range(1, days + 1)
+        for hour, entry_type, value, text in ((8, 'caffeine', 1, None), (9, 'mood', 4, None),
+                                              (21, 'notes', None, 'line one,\n"line two"'))
+    ])
+
+def test_keyset_pages_return_every_row_once_in_order(db):
+    add_entries(20)
+    rows = list(database.iter_export_rows('2024-03-01', '2024-03-31', page_size=7))
+
+    keys = [(row['datetime'], row['entry_type']) for row in rows]
+    assert len(keys) == 60
+    assert keys == sorted(set(keys))
+
+def test_filters_by_range_and_type(db):
+    add_entries(10)
+    rows = list(database.iter_export_rows('2024-03-03', '2024-03-05', ['mood', 'notes'], page_size=2))
+
+    assert {row['date'] for row in rows} == {'2024-03-03', '2024-03-04', '2024-03-05'}
+    assert {row['entry_type'] for row in rows} == {'mood', 'notes'}
+    assert len(rows) == 6
+
+def test_rows_carry_weather_and_moon_phase(db):
+    add_entries(1)
+    database.store_weather_data('2024-03-01', {'temp_min': 2, 'temp_max': 9})
+    database.store_moon_phase_data('2024-03-01', 'Full Moon', 99.5)
+
+    row = next(database.iter_export_rows('2024-03-01', '2024-03-01'))
+    assert (row['temp_max'], row['moon_phase'], row['moon_illumination']) == (9, 'Full Moon', 99.5)
+
+def test_ndjson_and_csv_round_trip(db):
+    add_entries(3)
+
+    lines = ''.join(export.stream_export('ndjson', '2024-03-01', '2024-03-31')).splitlines()
+    records = [json.loads(line) for line in lines]
+    assert len(records) == 9
+    assert list(records[0]) == list(export.EXPORT_COLUMNS)
+
+    table = list(csv.reader(io.StringIO(''.join(export.stream_export('csv', '2024-03-01', '2024-03-31')))))
+    assert table[0] == list(export.EXPORT_COLUMNS)
+    assert len(table) == 10
+    assert table[3][export.EXPORT_COLUMNS.index('text_value')] == 'line one,\n"line two"'
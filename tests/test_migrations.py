@@ -0,0 +1,41 @@
+import sqlite3
+
+import migrations
+
+def test_fresh_database_reaches_latest_version(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'health.db')
+    applied = migrations.migrate(conn)
+
+    assert applied == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.get_schema_version(conn) == migrations.LATEST_VERSION
+    assert migrations.migrate(conn) == []
+
+def test_legacy_database_keeps_its_rows(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'health.db')
+    # Schema of databases created before migrations, with the original weather columns only
+    conn.execute('''
+        CREATE TABLE timeline_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            datetime TEXT NOT NULL,
+            entry_type TEXT NOT NULL,
+            numeric_value REAL,
+            text_value TEXT,
+            notes TEXT,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(datetime, entry_type)
+        )
+    ''')
+    conn.execute('CREATE TABLE weather (date TEXT PRIMARY KEY, temp_min REAL, temp_max REAL, '
+                 'humidity REAL, pressure REAL, precipitation REAL)')
+    conn.execute("INSERT INTO timeline_entries (datetime, entry_type, numeric_value) VALUES ('2024-03-01 09:00:00', 'mood', 4)")
+    conn.execute("INSERT INTO weather (date, temp_min, temp_max) VALUES ('2024-03-01', 2, 9)")
+    conn.commit()
+
+    migrations.migrate(conn)
+
+    weather_columns = migrations.get_columns(conn.cursor(), 'weather')
+    assert {column for column, _ in migrations.WEATHER_COLUMNS} <= weather_columns
+    assert conn.execute('SELECT temp_max FROM weather').fetchone() == (9,)
+    assert conn.execute('SELECT entry_date FROM timeline_entries').fetchone() == ('2024-03-01',)
+    # Existing entries are aggregated when the table is created
+    assert conn.execute('SELECT count, sum FROM daily_aggregates').fetchone() == (1, 4)
@@ -0,0 +1,55 @@
+from bisect import bisect_left
+
+import pytest
+
+import ratelimit
+
+LIMITS = ratelimit.RateLimiter(per_minute=60, per_day=1000).limits
+
+def drive(start, seconds, step=0.25):
+    """Try a call every step seconds on a fake clock and get the times of the granted ones."""
+    calls = []
+    granted = []
+    for i in range(int(seconds / step)):
+        now = start + i * step
+        calls, wait = ratelimit.take_call(calls, LIMITS, now)
+        if wait == 0:
+            granted.append(now)
+    return granted
+
+def most_in_any_window(granted, length):
+    """Get the most granted calls within any window of length seconds."""
+    return max(bisect_left(granted, t + length) - i for i, t in enumerate(granted))
+
+@pytest.mark.parametrize('start', [0, 30.5, 86400 - 45])
+def test_at_most_per_minute_limit_in_any_minute(start):
+    granted = drive(start, 10 * 60)
+    assert most_in_any_window(granted, 60) == 60
+
+def test_at_most_per_day_limit_in_each_utc_day():
+    # Two UTC days, starting late in the first one
+    granted = drive(86400 - 3600, 3600 + 86400, step=1)
+    first_day = [t for t in granted if t < 86400]
+    second_day = [t for t in granted if 86400 <= t < 2 * 86400]
+
+    # The day budget resets at midnight UTC, not 24 hours after the first call
+    assert len(first_day) == 1000
+    assert len(second_day) == 1000
+    assert most_in_any_window(granted, 60) <= 60
+
+def test_wait_points_at_the_next_free_slot():
+    calls = [0.5 * i for i in range(60)]  # 60 calls in the first 30 seconds
+    assert ratelimit.time_until_call(calls, LIMITS, 40) == pytest.approx(20)
+
+    day_full = [float(i) for i in range(1000)]
+    assert ratelimit.time_until_call(day_full, LIMITS, 5000) == pytest.approx(86400 - 5000)
+
+def test_shared_limiter_counts_calls_across_instances(db):
+    limiters = [ratelimit.RateLimiter(per_minute=3, per_day=100, max_wait=0, shared=True) for _ in range(2)]
+    limiters[0].acquire('weather')
+    limiters[1].acquire('weather')
+    limiters[0].acquire('weather')
+
+    with pytest.raises(ratelimit.RateLimitExceeded):
+        limiters[1].acquire('weather')
+    assert limiters[1].stats()['budgets']['per_minute'] == {'limit': 3, 'used': 3, 'available': 0}
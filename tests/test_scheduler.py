@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from dotenv import load_dotenv
+
+import scheduler
+
+def test_window_follows_env_loaded_after_import(tmp_path, monkeypatch):
+    # Unset the variables in a way monkeypatch restores after load_dotenv sets them
+    for name in ('BACKFILL_DAYS_BACK', 'BACKFILL_DAYS_FORWARD'):
+        monkeypatch.setenv(name, '')
+        monkeypatch.delenv(name)
+    env_file = tmp_path / '.env'
+    env_file.write_text('BACKFILL_DAYS_BACK=7\nBACKFILL_DAYS_FORWARD=2\n')
+    load_dotenv(env_file)
+
+    today = datetime.now().date()
+    assert scheduler.get_window() == (today - timedelta(days=7), today + timedelta(days=2))
+
+def test_job_intervals_are_read_when_claimed(monkeypatch):
+    monkeypatch.setenv('BACKFILL_INTERVAL', '120')
+    monkeypatch.setenv('CURRENT_WEATHER_TTL', '600')
+    intervals = {name: get_interval() for name, get_interval, _ in scheduler.JOBS}
+    assert intervals['weather_backfill'] == 120
+    assert intervals['current_weather'] == 600
+
+def test_first_request_starts_scheduler_without_debug(db, monkeypatch):
+    import app as appmod
+
+    monkeypatch.setenv('SCHEDULER_ENABLED', 'true')
+    monkeypatch.setattr(scheduler, '_start_attempted', False)
+    # Run no jobs, just keep the thread alive until stopped
+    monkeypatch.setattr(scheduler, '_run', lambda: scheduler._stop_event.wait())
+    appmod.app.debug = False
+    try:
+        assert appmod.app.test_client().get('/').status_code == 200
+        assert scheduler.is_running()
+    finally:
+        scheduler.stop(timeout=5)
+    assert not scheduler.is_running()
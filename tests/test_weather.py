@@ -0,0 +1,29 @@
+from datetime import datetime, timedelta
+
+import database
+import weather
+
+def test_ttl_is_read_from_the_environment_at_call_time(monkeypatch):
+    today = datetime.now().date().isoformat()
+    row = {'data_type': 'current', 'fetched_at': (datetime.now() - timedelta(minutes=10)).isoformat()}
+
+    monkeypatch.setenv('CURRENT_WEATHER_TTL', '300')
+    assert weather.is_weather_stale(row, today)
+
+    monkeypatch.setenv('CURRENT_WEATHER_TTL', '3600')
+    assert not weather.is_weather_stale(row, today)
+
+def test_unknown_data_type_uses_forecast_ttl(monkeypatch):
+    monkeypatch.setenv('FORECAST_TTL', '120')
+    assert weather.get_weather_ttl('historical') == 120
+
+def test_air_pollution_only_row_is_summarized_by_its_aqi(db):
+    database.store_air_pollution_batch({'2024-03-01': {
+        'aqi': 2, 'aqi_mean': 2.4, 'aqi_description': 'Fair',
+        'pm2_5': 8.1, 'pm10': 12.0, 'no2': 9.5, 'o3': 60.2, 'co': 210.0
+    }})
+    row = database.get_weather_data('2024-03-01')
+
+    assert row['data_type'] == 'air_pollution'
+    assert weather.format_weather_summary(row) == f"{weather.get_aqi_emoji(2)} Fair air"
+    assert weather.format_weather_summary(dict(row, aqi=None, aqi_description=None)) == "Weather data unavailable"